@@ -1,174 +1,888 @@
-import tkinter as tk
-from tkinter import filedialog, messagebox, simpledialog
-from PIL import Image, ImageTk, ImageSequence, GifImagePlugin
-import os
-
-#############################################################################
-##                                                                         ##
-## PixelForge Animator 16bit                                               ##
-## Copyright (C) 2024  Justin Garcia                                       ##
-##                                                                         ##
-## This program is free software: you can redistribute it and/or modify    ##
-## it under the terms of the GNU General Public License as published by    ##
-## the Free Software Foundation, either version 3 of the License, or       ##
-## (at your option) any later version.                                     ##
-##                                                                         ##
-## This program is distributed in the hope that it will be useful,         ##
-## but WITHOUT ANY WARRANTY; without even the implied warranty of          ##
-## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the           ##
-## GNU General Public License for more details.                            ##
-##                                                                         ##
-## You should have received a copy of the GNU General Public License       ##
-## along with this program.  If not, see <http://www.gnu.org/licenses/>.   ##
-##                                                                         ##
-#############################################################################
-
-class PNGToGIFConverter(tk.Tk):
-    def __init__(self):
-        super().__init__()
-        self.title("Pixel Forge Animator")
-        self.configure(bg='light gray')
-        self.png_files = []
-        self.frame_duration = 100  # Default frame duration in milliseconds
-        self.preview_images = []
-        self.current_preview_index = 0
-        self.preview_animation_running = False
-        self.create_widgets()
-
-    def create_widgets(self):
-        self.load_button = tk.Button(self, text="Load PNGs", command=self.load_pngs, bg='light blue', fg='black')
-        self.load_button.grid(row=0, column=0, padx=10, pady=10)
-
-        self.clear_button = tk.Button(self, text="Clear PNGs", command=self.clear_pngs, bg='red', fg='white')
-        self.clear_button.grid(row=0, column=1, padx=10, pady=10)
-
-        self.save_button = tk.Button(self, text="Save as GIF", command=self.save_as_gif, bg='light green', fg='black')
-        self.save_button.grid(row=0, column=2, padx=10, pady=10)
-
-        self.duration_button = tk.Button(self, text="Set Frame Duration", command=self.set_frame_duration, bg='orange', fg='black')
-        self.duration_button.grid(row=0, column=3, padx=10, pady=10)
-
-        self.preview_label = tk.Label(self, text="GIF Preview", bg='light gray', fg='black')
-        self.preview_label.grid(row=1, column=0, columnspan=4)
-
-        self.preview_canvas = tk.Canvas(self, bg='white')
-        self.preview_canvas.grid(row=2, column=0, columnspan=4, padx=10, pady=10)
-
-        self.sequence_label = tk.Label(self, text="Sequence Control", bg='light gray', fg='black')
-        self.sequence_label.grid(row=3, column=0, columnspan=4)
-
-        self.up_button = tk.Button(self, text="Move Up", command=self.move_up, bg='light blue', fg='black')
-        self.up_button.grid(row=4, column=0, padx=10, pady=10)
-
-        self.down_button = tk.Button(self, text="Move Down", command=self.move_down, bg='light blue', fg='black')
-        self.down_button.grid(row=4, column=1, padx=10, pady=10)
-
-        self.remove_button = tk.Button(self, text="Remove", command=self.remove_selected, bg='light blue', fg='black')
-        self.remove_button.grid(row=4, column=2, padx=10, pady=10)
-
-        self.preview_listbox = tk.Listbox(self)
-        self.preview_listbox.grid(row=5, column=0, columnspan=4, padx=10, pady=10, sticky="nsew")
-        self.preview_listbox.bind("<<ListboxSelect>>", self.show_preview)
-
-        self.preview_button = tk.Button(self, text="Preview Animation", command=self.toggle_preview_animation, bg='light blue', fg='black')
-        self.preview_button.grid(row=6, column=0, columnspan=4, padx=10, pady=10)
-
-    def load_pngs(self):
-        file_paths = filedialog.askopenfilenames(filetypes=[("PNG files", "*.png")])
-        if file_paths:
-            self.png_files.extend(file_paths)
-            self.update_preview_list()
-            self.show_preview()
-            self.update_preview_canvas_size()
-
-    def clear_pngs(self):
-        self.png_files.clear()
-        self.preview_listbox.delete(0, tk.END)
-        self.preview_canvas.delete("all")
-        self.preview_images.clear()
-
-    def save_as_gif(self):
-        if not self.png_files:
-            messagebox.showwarning("No PNGs", "No PNG files loaded to convert.")
-            return
-
-        file_path = filedialog.asksaveasfilename(defaultextension=".gif", filetypes=[("GIF files", "*.gif")])
-        if file_path:
-            images = [Image.open(png) for png in self.png_files]
-            images[0].save(file_path, save_all=True, append_images=images[1:], duration=self.frame_duration, loop=0, disposal=2)
-            messagebox.showinfo("GIF Saved", f"GIF saved as {file_path}")
-
-    def set_frame_duration(self):
-        duration = simpledialog.askinteger("Frame Duration", "Enter frame duration in milliseconds:", initialvalue=self.frame_duration)
-        if duration is not None:
-            self.frame_duration = duration
-
-    def update_preview_list(self):
-        self.preview_listbox.delete(0, tk.END)
-        for png in self.png_files:
-            self.preview_listbox.insert(tk.END, os.path.basename(png))
-        self.load_preview_images()
-
-    def load_preview_images(self):
-        self.preview_images.clear()
-        for png in self.png_files:
-            img = Image.open(png)
-            self.preview_images.append(ImageTk.PhotoImage(img))
-
-    def show_preview(self, event=None):
-        selected_index = self.preview_listbox.curselection()
-        if selected_index:
-            index = selected_index[0]
-            self.preview_canvas.create_image(0, 0, anchor=tk.NW, image=self.preview_images[index])
-
-    def move_up(self):
-        selected_index = self.preview_listbox.curselection()
-        if selected_index and selected_index[0] > 0:
-            index = selected_index[0]
-            self.png_files.insert(index - 1, self.png_files.pop(index))
-            self.update_preview_list()
-            self.preview_listbox.selection_set(index - 1)
-
-    def move_down(self):
-        selected_index = self.preview_listbox.curselection()
-        if selected_index and selected_index[0] < len(self.png_files) - 1:
-            index = selected_index[0]
-            self.png_files.insert(index + 1, self.png_files.pop(index))
-            self.update_preview_list()
-            self.preview_listbox.selection_set(index + 1)
-
-    def remove_selected(self):
-        selected_index = self.preview_listbox.curselection()
-        if selected_index:
-            index = selected_index[0]
-            self.png_files.pop(index)
-            self.update_preview_list()
-            self.show_preview()
-
-    def toggle_preview_animation(self):
-        if self.preview_animation_running:
-            self.preview_animation_running = False
-            self.preview_button.config(text="Preview Animation")
-        else:
-            self.preview_animation_running = True
-            self.preview_button.config(text="Stop Animation")
-            self.animate_preview()
-
-    def animate_preview(self):
-        if not self.preview_animation_running:
-            return
-
-        if self.preview_images:
-            self.preview_canvas.delete("all")  # Clear the canvas for disposal=2 effect
-            self.preview_canvas.create_image(0, 0, anchor=tk.NW, image=self.preview_images[self.current_preview_index])
-            self.current_preview_index = (self.current_preview_index + 1) % len(self.preview_images)
-            self.after(self.frame_duration, self.animate_preview)
-
-    def update_preview_canvas_size(self):
-        if self.png_files:
-            first_image = Image.open(self.png_files[0])
-            self.preview_canvas.config(width=first_image.width, height=first_image.height)
-
-if __name__ == "__main__":
-    app = PNGToGIFConverter()
-    app.mainloop()
+import tkinter as tk
+from tkinter import filedialog, messagebox, simpledialog
+from PIL import Image, ImageTk, ImageSequence, GifImagePlugin
+import os
+import sys
+import glob
+import json
+import math
+import time
+import hashlib
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from Pixel_Forge_Profiler import Profiler, profiling_requested
+from Pixel_Forge_Core import (FrameChannel, FrameStore, GifWriter, natural_sort_key, parse_cell_size, save_gif_scales,
+                              slice_sheet)
+
+#############################################################################
+##                                                                         ##
+## PixelForge Animator 16bit                                               ##
+## Copyright (C) 2024  Justin Garcia                                       ##
+##                                                                         ##
+## This program is free software: you can redistribute it and/or modify    ##
+## it under the terms of the GNU General Public License as published by    ##
+## the Free Software Foundation, either version 3 of the License, or       ##
+## (at your option) any later version.                                     ##
+##                                                                         ##
+## This program is distributed in the hope that it will be useful,         ##
+## but WITHOUT ANY WARRANTY; without even the implied warranty of          ##
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the           ##
+## GNU General Public License for more details.                            ##
+##                                                                         ##
+## You should have received a copy of the GNU General Public License       ##
+## along with this program.  If not, see <http://www.gnu.org/licenses/>.   ##
+##                                                                         ##
+#############################################################################
+
+class PNGToGIFConverter(tk.Tk):
+    thumb_size = 48
+    zoom_levels = (1, 2, 4, 8, 16)
+    max_cache_pixels = 16 * 1024 * 1024  # scaled preview frames kept around, in pixels
+    preview_window = 16  # frames materialized ahead of the playhead
+
+    def __init__(self):
+        super().__init__()
+        self.title("Pixel Forge Animator")
+        self.configure(bg='light gray')
+        self.png_files = []
+        self.frame_duration = 100  # Default frame duration in milliseconds
+        self.frame_durations = []  # duration of each entry in png_files
+        self.frame_hashes = []  # content hash of each entry in png_files
+        self.frame_store = FrameStore()  # decoded RGBA of each distinct frame, memory-mapped
+        self.frame_images = OrderedDict()  # (content hash, zoom) -> PhotoImage, least recently shown first
+        self.cache_pixels = 0  # pixels held by frame_images
+        self.frame_sizes = {}  # content hash -> (width, height)
+        self.thumbnails = {}  # content hash -> small PIL image read from a sequence's thumbnail index
+        self.thumb_photos = {}  # content hash -> PhotoImage of a thumbnail in view
+        self.hash_cache = {}  # path -> ((mtime, size), content hash)
+        self.sequence_path = None
+        self.current_preview_index = 0
+        self.preview_animation_running = False
+        self.zoom = 1
+        self.zoom_var = tk.IntVar(value=1)  # 0 means fit to window
+        self.zoom_job = None
+        self.loader = None  # thread pool that decodes frames being loaded
+        self.loading = deque()  # (path, future) of frames still being loaded, in sequence order
+        self.load_failures = []
+        self.load_started = 0.0
+        self.live_channel = None  # frames published by an editor's Live Preview
+        self.live_frames = {}  # "Editor frame N" entries in png_files -> content hash
+        self.live_seen = {}  # channel slot -> sequence number last read
+        self.live_generation = None
+        self.live_poll_job = None
+        self.sheet_frames = {}  # "sheet.png #N" entries in png_files -> content hash
+        self.profiler = Profiler(enabled=profiling_requested(sys.argv))
+        self.create_menu()
+        self.create_widgets()
+
+    def create_menu(self):
+        menu = tk.Menu(self)
+        self.config(menu=menu)
+
+        file_menu = tk.Menu(menu, tearoff=0)
+        menu.add_cascade(label="File", menu=file_menu)
+        file_menu.add_command(label="Load Folder", command=self.load_folder)
+        file_menu.add_command(label="Load Pattern", command=self.load_pattern)
+        file_menu.add_command(label="Import Sprite Sheet...", command=self.import_sheet)
+        self.live_var = tk.BooleanVar(value=False)
+        file_menu.add_checkbutton(label="Connect to Editor", variable=self.live_var, command=self.toggle_editor_link)
+        file_menu.add_separator()
+        file_menu.add_command(label="Open Sequence", command=self.open_sequence)
+        file_menu.add_command(label="Save Sequence", command=self.save_sequence)
+        file_menu.add_command(label="Save Sequence As", command=self.save_sequence_as)
+        file_menu.add_separator()
+        file_menu.add_command(label="Save GIF at Several Scales...", command=self.save_gif_at_scales)
+
+        view_menu = tk.Menu(menu, tearoff=0)
+        menu.add_cascade(label="View", menu=view_menu)
+        for zoom in self.zoom_levels:
+            view_menu.add_radiobutton(label=f"Zoom {zoom}x", variable=self.zoom_var, value=zoom, command=self.change_zoom)
+        view_menu.add_radiobutton(label="Fit to Window", variable=self.zoom_var, value=0, command=self.change_zoom)
+
+    def create_widgets(self):
+        self.load_button = tk.Button(self, text="Load PNGs", command=self.load_pngs, bg='light blue', fg='black')
+        self.load_button.grid(row=0, column=0, padx=10, pady=10)
+
+        self.clear_button = tk.Button(self, text="Clear PNGs", command=self.clear_pngs, bg='red', fg='white')
+        self.clear_button.grid(row=0, column=1, padx=10, pady=10)
+
+        self.save_button = tk.Button(self, text="Save as GIF", command=self.save_as_gif, bg='light green', fg='black')
+        self.save_button.grid(row=0, column=2, padx=10, pady=10)
+
+        self.duration_button = tk.Button(self, text="Set Frame Duration", command=self.set_frame_duration, bg='orange', fg='black')
+        self.duration_button.grid(row=0, column=3, padx=10, pady=10)
+
+        self.preview_label = tk.Label(self, text="GIF Preview", bg='light gray', fg='black')
+        self.preview_label.grid(row=1, column=0, columnspan=4)
+
+        self.preview_canvas = tk.Canvas(self, bg='white')
+        self.preview_canvas.grid(row=2, column=0, columnspan=4, padx=10, pady=10, sticky="nsew")
+        self.preview_canvas.bind("<Configure>", self.fit_preview)
+        # Let the preview take up the room when the window is enlarged
+        self.grid_rowconfigure(2, weight=1)
+        for column in range(4):
+            self.grid_columnconfigure(column, weight=1)
+
+        self.sequence_label = tk.Label(self, text="Sequence Control", bg='light gray', fg='black')
+        self.sequence_label.grid(row=3, column=0, columnspan=4)
+
+        self.up_button = tk.Button(self, text="Move Up", command=self.move_up, bg='light blue', fg='black')
+        self.up_button.grid(row=4, column=0, padx=10, pady=10)
+
+        self.down_button = tk.Button(self, text="Move Down", command=self.move_down, bg='light blue', fg='black')
+        self.down_button.grid(row=4, column=1, padx=10, pady=10)
+
+        self.remove_button = tk.Button(self, text="Remove", command=self.remove_selected, bg='light blue', fg='black')
+        self.remove_button.grid(row=4, column=2, padx=10, pady=10)
+
+        self.frame_duration_button = tk.Button(self, text="Set Selected Duration", command=self.set_selected_duration, bg='orange', fg='black')
+        self.frame_duration_button.grid(row=4, column=3, padx=10, pady=10)
+
+        self.preview_listbox = tk.Listbox(self)
+        self.preview_listbox.grid(row=5, column=0, columnspan=4, padx=10, pady=10, sticky="nsew")
+        self.preview_listbox.bind("<<ListboxSelect>>", self.show_preview)
+
+        self.preview_button = tk.Button(self, text="Preview Animation", command=self.toggle_preview_animation, bg='light blue', fg='black')
+        self.preview_button.grid(row=6, column=0, columnspan=4, padx=10, pady=10)
+
+        self.thumb_canvas = tk.Canvas(self, height=self.thumb_size + 8, bg='white', highlightthickness=0)
+        self.thumb_canvas.grid(row=7, column=0, columnspan=4, padx=10, sticky="ew")
+        self.thumb_scrollbar = tk.Scrollbar(self, orient=tk.HORIZONTAL, command=self.scroll_thumbnails)
+        self.thumb_scrollbar.grid(row=8, column=0, columnspan=4, padx=10, sticky="ew")
+        self.thumb_canvas.config(xscrollcommand=self.thumb_scrollbar.set)
+        self.thumb_canvas.bind("<Configure>", lambda event: self.refresh_thumbnails())
+        self.thumb_canvas.bind("<Button-1>", self.select_thumbnail)
+
+        if self.profiler.enabled:
+            self.profiler_status = tk.Label(self, text="Profiling...", bg='light gray', fg='black', anchor='w')
+            self.profiler_status.grid(row=9, column=0, columnspan=3, padx=10, sticky="ew")
+
+            self.trace_button = tk.Button(self, text="Export Trace", command=self.export_trace, bg='light blue', fg='black')
+            self.trace_button.grid(row=9, column=3, padx=10, pady=10)
+
+    def update_profiler_status(self):
+        if not self.profiler.enabled:
+            return
+        last = self.profiler.last
+        parts = []
+        if "load_frames" in last:
+            parts.append(f"load {last['load_frames'] * 1000:.1f} ms")
+        if "import_sheet" in last:
+            parts.append(f"sheet import {last['import_sheet'] * 1000:.1f} ms")
+        if "load_preview_images" in last:
+            parts.append(f"refresh {last['load_preview_images'] * 1000:.1f} ms")
+        if "save_as_gif" in last:
+            parts.append(f"GIF export {last['save_as_gif'] * 1000:.1f} ms")
+        if "save_gif_scales" in last:
+            parts.append(f"GIF scales export {last['save_gif_scales'] * 1000:.1f} ms")
+        self.profiler_status.config(text="  |  ".join(parts) or "Profiling...")
+
+    def export_trace(self):
+        file_path = filedialog.asksaveasfilename(defaultextension=".json", filetypes=[("Trace files", "*.json")])
+        if file_path:
+            self.profiler.export_chrome_trace(file_path)
+            messagebox.showinfo("Trace Saved", f"Trace saved as {file_path}")
+
+    def load_pngs(self):
+        file_paths = filedialog.askopenfilenames(filetypes=[("PNG files", "*.png")])
+        if file_paths:
+            self.load_frames(file_paths)
+
+    def load_folder(self):
+        directory = filedialog.askdirectory()
+        if directory:
+            self.load_frames(sorted(glob.glob(os.path.join(directory, "*.png")), key=natural_sort_key))
+
+    def load_pattern(self):
+        pattern = simpledialog.askstring("Load Pattern", "Glob pattern for the frames (** matches subfolders):",
+                                         initialvalue=os.path.join(os.getcwd(), "*.png"))
+        if pattern:
+            file_paths = sorted(glob.glob(os.path.expanduser(pattern), recursive=True), key=natural_sort_key)
+            if not file_paths:
+                messagebox.showwarning("No Frames", f"Nothing matches {pattern}")
+            self.load_frames(file_paths)
+
+    def load_frames(self, file_paths):
+        # Frames are decoded and hashed on a thread pool; poll_loading adds
+        # them to the sequence in order as they finish, so the window keeps
+        # responding while thousands of files come in.
+        if not file_paths:
+            return
+        if self.loader is None:
+            self.loader = ThreadPoolExecutor(max_workers=min(8, os.cpu_count() or 1))
+        start_polling = not self.loading
+        for png in file_paths:
+            self.loading.append((png, self.loader.submit(self.scan_frame, png)))
+        if start_polling:
+            self.load_started = time.perf_counter()
+            self.after(10, self.poll_loading)
+
+    def import_sheet(self):
+        # Every sprite on the sheet becomes a frame that lives only in the
+        # frame store, the way editor frames do; no PNG is written per frame.
+        if self.loading:
+            messagebox.showwarning("Import Sprite Sheet", "Wait for the frames being loaded to finish first.")
+            return
+        file_path = filedialog.askopenfilename(filetypes=[("PNG files", "*.png")], title="Import Sprite Sheet")
+        if not file_path:
+            return
+        text = simpledialog.askstring("Import Sprite Sheet", "Cell size, e.g. 32 or 32x48 (leave blank to find each sprite):")
+        if text is None:
+            return
+        start = time.perf_counter()
+        try:
+            cell = parse_cell_size(text) if text.strip() else None
+            with Image.open(file_path) as image:
+                # Found sprites are padded to one size so they line up as frames
+                sprites = slice_sheet(image, cell, uniform=cell is None)
+        except (OSError, ValueError) as e:
+            messagebox.showerror("Import Sprite Sheet", f"Could not slice {file_path}:\n{e}")
+            return
+        if not sprites:
+            messagebox.showwarning("Import Sprite Sheet", f"{os.path.basename(file_path)} has no visible sprites.")
+            return
+        first_frame = not self.png_files
+        for (x, y, width, height), sprite in sprites:
+            # Named by where the sprite is, so the same cell always has the same name
+            name = f"{os.path.basename(file_path)} [{x},{y} {width}x{height}]"
+            content_hash = self.pixel_hash(sprite.width, sprite.height, sprite.tobytes())
+            self.frame_store.add(content_hash, sprite)
+            self.frame_sizes[content_hash] = sprite.size
+            self.sheet_frames[name] = content_hash
+            self.png_files.append(name)
+            self.frame_durations.append(self.frame_duration)
+            self.frame_hashes.append(content_hash)
+            self.preview_listbox.insert(tk.END, name)
+        self.profiler.record_since("import_sheet", start, frames=len(sprites))
+        if first_frame:
+            self.update_preview_canvas_size()
+            self.preview_listbox.selection_set(0)
+            self.show_preview()
+        self.update_sequence_label()
+        self.refresh_thumbnails()
+        self.update_profiler_status()
+
+    def poll_loading(self, budget=0.02):
+        start = time.perf_counter()
+        first_frame = not self.png_files
+        while self.loading and self.loading[0][1].done() and time.perf_counter() - start < budget:
+            png, future = self.loading.popleft()
+            try:
+                content_hash = self.record_frame(png, future.result())
+            except (OSError, ValueError) as e:
+                self.load_failures.append(f"{os.path.basename(png)}: {e}")
+                continue
+            self.png_files.append(png)
+            self.frame_durations.append(self.frame_duration)
+            self.frame_hashes.append(content_hash)
+            self.preview_listbox.insert(tk.END, os.path.basename(png))
+        if first_frame and self.png_files:
+            self.update_preview_canvas_size()
+            self.preview_listbox.selection_set(0)
+            self.show_preview()
+        self.update_sequence_label()
+        if self.loading:
+            self.sequence_label.config(text=f"{self.sequence_label.cget('text')} - loading {len(self.loading)} more")
+            self.after(10, self.poll_loading)
+            return
+        self.profiler.record_since("load_frames", self.load_started, frames=len(self.png_files))
+        self.refresh_thumbnails()
+        self.update_profiler_status()
+        if self.load_failures:
+            failures, self.load_failures = self.load_failures, []
+            messagebox.showwarning("Load Failed", f"{len(failures)} file(s) could not be loaded:\n" + "\n".join(failures[:10]))
+
+    def clear_pngs(self):
+        for png, future in self.loading:
+            future.cancel()
+        self.loading.clear()
+        self.png_files.clear()
+        self.frame_durations.clear()
+        self.preview_listbox.delete(0, tk.END)
+        self.preview_canvas.delete("all")
+        self.frame_hashes.clear()
+        self.frame_images.clear()
+        self.cache_pixels = 0
+        self.frame_store.clear()
+        self.thumb_photos.clear()
+        self.live_frames.clear()
+        self.live_seen.clear()
+        self.sheet_frames.clear()
+        self.current_preview_index = 0
+        self.update_sequence_label()
+        self.refresh_thumbnails()
+
+    def save_as_gif(self):
+        if not self.png_files:
+            messagebox.showwarning("No PNGs", "No PNG files loaded to convert.")
+            return
+
+        file_path = filedialog.asksaveasfilename(defaultextension=".gif", filetypes=[("GIF files", "*.gif")])
+        if file_path:
+            with self.profiler.span("save_as_gif", frames=len(self.png_files)):
+                # Each frame is written as soon as it is read, so only one
+                # or two are ever in memory; a run of identical frames
+                # becomes one GIF frame shown for the whole run.
+                with GifWriter(file_path) as writer:
+                    previous_hash = None
+                    for index, duration in enumerate(self.frame_durations):
+                        content_hash = self.refresh_frame_hash(index)
+                        if content_hash == previous_hash:
+                            writer.hold(duration)
+                            continue
+                        writer.add(self.gif_frame(index), duration)
+                        previous_hash = content_hash
+            self.update_profiler_status()
+            messagebox.showinfo("GIF Saved", f"GIF saved as {file_path}")
+
+    def gif_frames(self):
+        # Every frame at once, for exports that need them all (the shared
+        # palette of the multi-scale GIFs). Runs of identical frames are
+        # merged the same way as in save_as_gif.
+        images = []
+        durations = []
+        previous_hash = None
+        for index, duration in enumerate(self.frame_durations):
+            content_hash = self.refresh_frame_hash(index)
+            if content_hash == previous_hash:
+                durations[-1] += duration
+                continue
+            images.append(self.stored_frame(index))
+            durations.append(duration)
+            previous_hash = content_hash
+        return images, durations
+
+    def save_gif_at_scales(self):
+        if not self.png_files:
+            messagebox.showwarning("No PNGs", "No PNG files loaded to convert.")
+            return
+        text = simpledialog.askstring("GIF Scales", "Comma-separated scales, e.g. 1,2,4,8:", initialvalue="1,2,4")
+        if not text:
+            return
+        try:
+            scales = sorted({int(part) for part in text.split(",") if part.strip()})
+        except ValueError:
+            scales = []
+        if not scales or scales[0] < 1:
+            messagebox.showerror("GIF Scales", "Scales must be positive whole numbers.")
+            return
+        file_path = filedialog.asksaveasfilename(defaultextension=".gif", filetypes=[("GIF files", "*.gif")],
+                                                 title="Save GIFs As (_<n>x is added per scale)")
+        if file_path:
+            base = os.path.splitext(file_path)[0]
+            with self.profiler.span("save_gif_scales", frames=len(self.png_files), scales=len(scales)):
+                # Every frame is quantized once; the scales are encoded in parallel
+                images, durations = self.gif_frames()
+                written = save_gif_scales(images, durations, {n: f"{base}_{n}x.gif" for n in scales})
+            self.update_profiler_status()
+            messagebox.showinfo("GIFs Saved", "Saved " + ", ".join(os.path.basename(path) for path in written))
+
+    def set_frame_duration(self):
+        duration = simpledialog.askinteger("Frame Duration", "Enter frame duration in milliseconds:", initialvalue=self.frame_duration)
+        if duration is not None:
+            self.frame_duration = duration
+            self.frame_durations = [duration] * len(self.png_files)
+
+    def set_selected_duration(self):
+        selected_index = self.preview_listbox.curselection()
+        if not selected_index:
+            messagebox.showwarning("No Frame Selected", "Select a frame to set its duration.")
+            return
+        index = selected_index[0]
+        duration = simpledialog.askinteger("Frame Duration", f"Duration of frame {index + 1} in milliseconds:",
+                                           initialvalue=self.frame_durations[index], minvalue=1)
+        if duration is not None:
+            self.frame_durations[index] = duration
+
+    def update_preview_list(self):
+        self.preview_listbox.delete(0, tk.END)
+        for png in self.png_files:
+            self.preview_listbox.insert(tk.END, os.path.basename(png))
+        self.load_preview_images()
+
+    def frame_hash(self, png):
+        return self.record_frame(png, self.scan_frame(png))
+
+    def refresh_frame_hash(self, index):
+        # The file is checked again, so stored_frame hands out the pixels of
+        # a frame edited on disk since it was loaded, not the old ones.
+        self.frame_hashes[index] = self.frame_hash(self.png_files[index])
+        return self.frame_hashes[index]
+
+    def scan_frame(self, png):
+        # Returns ((mtime, size), content hash, (width, height)) and puts the
+        # decoded frame in the frame store. Files whose mtime and size have
+        # not changed are not decoded again and come back without a size.
+        # Safe to run off the UI thread: it only reads hash_cache, the store
+        # locks itself and no widgets are touched.
+        if png in self.live_frames:
+            return None, self.live_frames[png], None
+        if png in self.sheet_frames:
+            return None, self.sheet_frames[png], None
+        stat = os.stat(png)
+        key = (stat.st_mtime_ns, stat.st_size)
+        cached = self.hash_cache.get(png)
+        if cached and cached[0] == key:
+            return key, cached[1], None
+        with Image.open(png) as img:
+            rgba = img.convert("RGBA")
+        content_hash = self.pixel_hash(rgba.width, rgba.height, rgba.tobytes())
+        self.frame_store.add(content_hash, rgba)
+        return key, content_hash, rgba.size
+
+    def pixel_hash(self, width, height, data):
+        digest = hashlib.blake2b(f"{width}x{height}".encode(), digest_size=16)
+        digest.update(data)
+        return digest.hexdigest()
+
+    def record_frame(self, png, scan):
+        key, content_hash, size = scan
+        self.hash_cache[png] = (key, content_hash)
+        if size is not None:
+            self.frame_sizes[content_hash] = size
+        return content_hash
+
+    def stored_frame(self, index):
+        # Zero-copy RGBA image of a frame, decoding it into the store first
+        # if it only came in through the hash cache.
+        content_hash = self.frame_hashes[index]
+        if content_hash not in self.frame_store:
+            with Image.open(self.png_files[index]) as img:
+                self.frame_store.add(content_hash, img)
+        return self.frame_store.image(content_hash)
+
+    def gif_frame(self, index):
+        # A frame for the GIF writer in the mode its PNG was saved in: Pillow
+        # quantizes RGB, L and P images differently from RGBA, so only RGBA
+        # frames (and ones that never had a file) come from the store.
+        png = self.png_files[index]
+        if png not in self.live_frames and png not in self.sheet_frames:
+            with Image.open(png) as img:
+                if img.mode != "RGBA":
+                    img.load()
+                    return img
+        return self.stored_frame(index)
+
+    def make_thumbnail(self, rgba):
+        # Small sprites are blown up by a whole factor, large frames shrunk
+        thumb = rgba.copy()
+        factor = self.thumb_size // max(thumb.width, thumb.height)
+        if factor >= 1:
+            thumb = thumb.resize((thumb.width * factor, thumb.height * factor), Image.NEAREST)
+        else:
+            thumb.thumbnail((self.thumb_size, self.thumb_size))
+        return thumb
+
+    def load_preview_images(self):
+        # Only hashes are worked out here; full frames are decoded when they
+        # are first shown (preview_image) and thumbnails when scrolled into view.
+        with self.profiler.span("load_preview_images", frames=len(self.png_files)):
+            self.frame_hashes = [self.frame_hash(png) for png in self.png_files]
+            # Let go of frames that are no longer in the sequence
+            live = set(self.frame_hashes)
+            for cache in (self.thumb_photos, self.thumbnails):
+                for content_hash in set(cache) - live:
+                    del cache[content_hash]
+            for content_hash in set(self.frame_store.slots) - live:
+                self.frame_store.discard(content_hash)
+            for key in [key for key in self.frame_images if key[0] not in live]:
+                self.drop_frame_image(key)
+        if self.current_preview_index >= len(self.png_files):
+            self.current_preview_index = 0
+        self.update_sequence_label()
+        self.update_profiler_status()
+        self.refresh_thumbnails()
+
+    def preview_image(self, index):
+        # Frames are scaled once per zoom level and kept in an LRU cache, so
+        # playback only ever hands Tk an image that already exists.
+        key = (self.frame_hashes[index], self.zoom)
+        photo = self.frame_images.get(key)
+        if photo is not None:
+            self.frame_images.move_to_end(key)
+            return photo
+        rgba = self.stored_frame(index)
+        if self.zoom > 1:
+            rgba = rgba.resize((rgba.width * self.zoom, rgba.height * self.zoom), Image.NEAREST)
+        photo = self.frame_images[key] = ImageTk.PhotoImage(rgba)
+        self.cache_pixels += rgba.width * rgba.height
+        self.profiler.count("tk_calls")
+        # Room for every frame of the loop, so a looping preview is only
+        # scaled once; the pixel budget is what keeps big frames in check
+        limit = max(2 * self.preview_window, len(self.frame_hashes))
+        while len(self.frame_images) > 1 and (self.cache_pixels > self.max_cache_pixels
+                                              or len(self.frame_images) > limit):
+            self.drop_frame_image(next(iter(self.frame_images)))
+        return photo
+
+    def drop_frame_image(self, key):
+        photo = self.frame_images.pop(key)
+        self.cache_pixels -= photo.width() * photo.height()
+
+    def change_zoom(self):
+        zoom = self.zoom_var.get()
+        if zoom == 0:
+            self.fit_preview()
+        else:
+            self.set_zoom(zoom)
+            self.update_preview_canvas_size()
+
+    def fit_preview(self, event=None):
+        if self.zoom_var.get() != 0 or not self.frame_hashes:
+            return
+        width, height = self.frame_sizes[self.frame_hashes[0]]
+        zoom = max(1, min(self.preview_canvas.winfo_width() // width, self.preview_canvas.winfo_height() // height))
+        self.set_zoom(zoom)
+
+    def set_zoom(self, zoom):
+        if zoom == self.zoom:
+            return
+        self.zoom = zoom
+        self.preview_canvas.delete("all")
+        if not self.preview_animation_running:
+            self.show_preview()
+        self.warm_zoom_cache()
+
+    def warm_zoom_cache(self):
+        # Scale the frames just ahead of the playhead for the current zoom a
+        # few at a time from the idle loop, so a zoom change during playback
+        # does not stall the animation while the cache is rebuilt.
+        if self.zoom_job:
+            self.after_cancel(self.zoom_job)
+        order = list(range(self.current_preview_index, len(self.png_files))) + list(range(self.current_preview_index))
+        first_index = {}
+        for index in order:
+            first_index.setdefault(self.frame_hashes[index], index)
+        pending = list(first_index.values())[:self.preview_window]
+        self.zoom_job = self.after_idle(self.warm_zoom_slice, self.zoom, pending)
+
+    def warm_zoom_slice(self, zoom, pending, budget=0.008):
+        self.zoom_job = None
+        if zoom != self.zoom:
+            return
+        start = time.perf_counter()
+        with self.profiler.span("warm_zoom_cache", zoom=zoom):
+            while pending and time.perf_counter() - start < budget:
+                index = pending.pop(0)
+                if index < len(self.png_files):
+                    self.preview_image(index)
+        if pending:
+            self.zoom_job = self.after(1, self.warm_zoom_slice, zoom, pending)
+
+    def thumbnail_photo(self, index):
+        content_hash = self.frame_hashes[index]
+        photo = self.thumb_photos.get(content_hash)
+        if photo is None:
+            thumb = self.thumbnails.get(content_hash)
+            if thumb is None:
+                thumb = self.make_thumbnail(self.stored_frame(index))
+            photo = self.thumb_photos[content_hash] = ImageTk.PhotoImage(thumb)
+        return photo
+
+    def scroll_thumbnails(self, *args):
+        self.thumb_canvas.xview(*args)
+        self.refresh_thumbnails()
+
+    def refresh_thumbnails(self):
+        # Only the thumbnails in view get canvas items and PhotoImages, so a
+        # long sequence costs nothing until it is scrolled through.
+        slot = self.thumb_size + 8
+        self.thumb_canvas.delete("thumb")
+        self.thumb_canvas.config(scrollregion=(0, 0, len(self.png_files) * slot, slot))
+        first = max(0, int(self.thumb_canvas.canvasx(0)) // slot)
+        last = min(len(self.png_files), first + self.thumb_canvas.winfo_width() // slot + 2)
+        selected_index = self.preview_listbox.curselection()
+        for index in range(first, last):
+            x = index * slot + 4
+            if selected_index and selected_index[0] == index:
+                self.thumb_canvas.create_rectangle(x - 3, 1, x + self.thumb_size + 3, self.thumb_size + 7, outline='blue', width=2, tags="thumb")
+            self.thumb_canvas.create_image(x, 4, anchor=tk.NW, image=self.thumbnail_photo(index), tags="thumb")
+        # Thumbnails scrolled out of view are rebuilt from the store if needed
+        for content_hash in set(self.thumb_photos) - set(self.frame_hashes[first:last]):
+            del self.thumb_photos[content_hash]
+
+    def select_thumbnail(self, event):
+        index = int(self.thumb_canvas.canvasx(event.x)) // (self.thumb_size + 8)
+        if index < len(self.png_files):
+            self.preview_listbox.selection_clear(0, tk.END)
+            self.preview_listbox.selection_set(index)
+            self.preview_listbox.see(index)
+            self.show_preview()
+
+    def open_sequence(self):
+        file_path = filedialog.askopenfilename(filetypes=[("Pixel Forge sequences", "*.pfseq")])
+        if not file_path:
+            return
+        with self.profiler.span("open_sequence"):
+            with open(file_path, 'r') as f:
+                sequence = json.load(f)
+            base = os.path.dirname(os.path.abspath(file_path))
+            png_files = []
+            frame_durations = []
+            missing = 0
+            for frame in sequence["frames"]:
+                png = os.path.normpath(os.path.join(base, frame["path"]))
+                if not os.path.exists(png):
+                    missing += 1
+                    continue
+                png_files.append(png)
+                frame_durations.append(frame.get("duration", sequence.get("frame_duration", self.frame_duration)))
+                # The stored hash stands in for decoding the file as long as
+                # the file has not changed since the sequence was saved.
+                self.hash_cache[png] = ((frame["mtime_ns"], frame["size"]), frame["hash"])
+                self.frame_sizes[frame["hash"]] = (frame["width"], frame["height"])
+            self.load_thumbnail_index(file_path)
+
+            self.clear_pngs()
+            self.sequence_path = file_path
+            self.frame_duration = sequence.get("frame_duration", self.frame_duration)
+            self.png_files.extend(png_files)
+            self.frame_durations.extend(frame_durations)
+            self.update_preview_list()
+            self.update_preview_canvas_size()
+        if missing:
+            messagebox.showwarning("Missing Frames", f"{missing} frame file(s) could not be found and were skipped.")
+
+    def save_sequence(self):
+        if self.sequence_path:
+            self.write_sequence(self.sequence_path)
+        else:
+            self.save_sequence_as()
+
+    def save_sequence_as(self):
+        file_path = filedialog.asksaveasfilename(defaultextension=".pfseq", filetypes=[("Pixel Forge sequences", "*.pfseq")])
+        if file_path:
+            self.write_sequence(file_path)
+
+    def write_sequence(self, file_path):
+        with self.profiler.span("save_sequence", frames=len(self.png_files)):
+            base = os.path.dirname(os.path.abspath(file_path))
+            frames = []
+            skipped = 0
+            for png, duration in zip(self.png_files, self.frame_durations):
+                if png in self.live_frames or png in self.sheet_frames:
+                    skipped += 1  # editor frames and sheet cells have no file to point at
+                    continue
+                content_hash = self.frame_hash(png)
+                (mtime_ns, size), _ = self.hash_cache[png]
+                try:
+                    path = os.path.relpath(png, base)
+                except ValueError:  # different drive on Windows
+                    path = os.path.abspath(png)
+                width, height = self.frame_sizes[content_hash]
+                frames.append({"path": path, "duration": duration, "hash": content_hash,
+                               "mtime_ns": mtime_ns, "size": size, "width": width, "height": height})
+            with open(file_path, 'w') as f:
+                json.dump({"pixelforge_sequence": 1, "frame_duration": self.frame_duration, "frames": frames}, f, indent=1)
+            self.save_thumbnail_index(file_path)
+            self.sequence_path = file_path
+        if skipped:
+            messagebox.showinfo("Sequence Saved", f"Sequence saved as {file_path}\n{skipped} frame(s) from the editor or a sprite sheet were left out; export them as a GIF instead.")
+        else:
+            messagebox.showinfo("Sequence Saved", f"Sequence saved as {file_path}")
+
+    def save_thumbnail_index(self, sequence_path):
+        # All thumbnails go into one atlas PNG next to the sequence, with the
+        # hash -> slot index stored in a text chunk, so reopening reads one
+        # small file instead of decoding every frame.
+        from PIL import PngImagePlugin
+        hashes = list(dict.fromkeys(self.frame_hashes))
+        thumbnails = dict(self.thumbnails)
+        for index, content_hash in enumerate(self.frame_hashes):
+            if content_hash not in thumbnails:
+                thumbnails[content_hash] = self.make_thumbnail(self.stored_frame(index))
+        columns = max(1, math.ceil(math.sqrt(len(hashes))))
+        rows = max(1, math.ceil(len(hashes) / columns))
+        atlas = Image.new("RGBA", (columns * self.thumb_size, rows * self.thumb_size), (0, 0, 0, 0))
+        entries = {}
+        for slot, content_hash in enumerate(hashes):
+            thumb = thumbnails[content_hash]
+            x, y = (slot % columns) * self.thumb_size, (slot // columns) * self.thumb_size
+            atlas.paste(thumb, (x, y))
+            entries[content_hash] = [x, y, thumb.width, thumb.height]
+        info = PngImagePlugin.PngInfo()
+        info.add_text("pixelforge-thumbnails", json.dumps({"thumb_size": self.thumb_size, "entries": entries}))
+        atlas.save(sequence_path + ".thumbs.png", pnginfo=info)
+
+    def load_thumbnail_index(self, sequence_path):
+        thumbs_path = sequence_path + ".thumbs.png"
+        if not os.path.exists(thumbs_path):
+            return
+        with Image.open(thumbs_path) as atlas:
+            index = json.loads(atlas.text.get("pixelforge-thumbnails", "{}"))
+            if index.get("thumb_size") != self.thumb_size:
+                return
+            atlas = atlas.convert("RGBA")
+        for content_hash, (x, y, width, height) in index["entries"].items():
+            self.thumbnails[content_hash] = atlas.crop((x, y, x + width, y + height))
+
+    def update_sequence_label(self):
+        if self.png_files:
+            self.sequence_label.config(text=f"Sequence Control ({len(self.png_files)} frames, {len(set(self.frame_hashes))} unique)")
+        else:
+            self.sequence_label.config(text="Sequence Control")
+
+    def show_preview(self, event=None):
+        selected_index = self.preview_listbox.curselection()
+        if selected_index:
+            index = selected_index[0]
+            self.preview_canvas.delete("all")
+            self.preview_canvas.create_image(0, 0, anchor=tk.NW, image=self.preview_image(index))
+        self.refresh_thumbnails()
+
+    def toggle_editor_link(self):
+        # Frames come straight from an editor with Animator > Live Preview on,
+        # through shared memory, and are re-read whenever the editor changes them.
+        if not self.live_var.get():
+            self.unlink_editor()
+            return
+        if self.png_files and not messagebox.askyesno(
+                "Connect to Editor", f"Connecting replaces the {len(self.png_files)} loaded frame(s) with the editor's frames. Continue?"):
+            self.live_var.set(False)
+            return
+        try:
+            self.live_channel = FrameChannel.attach()
+        except FileNotFoundError:
+            self.live_var.set(False)
+            messagebox.showwarning("Connect to Editor", "No editor is publishing frames. Turn on Animator > Live Preview in the editor first.")
+            return
+        self.clear_pngs()
+        self.live_generation = None
+        self.poll_editor()
+
+    def unlink_editor(self):
+        # Frames already received stay in the sequence
+        if self.live_poll_job is not None:
+            self.after_cancel(self.live_poll_job)
+            self.live_poll_job = None
+        if self.live_channel is not None:
+            self.live_channel.close()
+            self.live_channel = None
+        self.live_var.set(False)
+
+    def poll_editor(self):
+        self.live_poll_job = None
+        if self.live_channel is None:
+            return
+        if not self.live_channel.owner_alive():
+            # The editor turned Live Preview off or quit
+            self.unlink_editor()
+            messagebox.showinfo("Connect to Editor", "The editor stopped publishing frames, so the animator is no longer connected.")
+            return
+        generation = self.live_channel.generation
+        if generation != self.live_generation and self.sync_editor_frames():
+            self.live_generation = generation
+        self.live_poll_job = self.after(50, self.poll_editor)
+
+    def live_name(self, index):
+        return f"Editor frame {index + 1}"
+
+    def sync_editor_frames(self):
+        # Returns False if a frame was mid-write, so the next poll tries again
+        channel = self.live_channel
+        width, height = channel.width, channel.height
+        count = channel.frame_count
+        complete = True
+        changed = False
+        with self.profiler.span("sync_editor_frames", frames=count):
+            for index in range(count):
+                if self.live_seen.get(index) == channel.sequence(index):
+                    continue
+                frame = channel.read(index)
+                if frame is None:
+                    complete = False
+                    continue
+                seq, data = frame
+                content_hash = self.pixel_hash(width, height, data)
+                self.frame_store.add(content_hash, Image.frombytes("RGBA", (width, height), data))
+                self.frame_sizes[content_hash] = (width, height)
+                self.live_frames[self.live_name(index)] = content_hash
+                self.live_seen[index] = seq
+                changed = True
+            # Follow the editor when it publishes more or fewer frames
+            dropped = {self.live_name(index) for index in self.live_seen if index >= count}
+            for index in [index for index in self.live_seen if index >= count]:
+                del self.live_seen[index]
+                del self.live_frames[self.live_name(index)]
+            kept = [(png, duration) for png, duration in zip(self.png_files, self.frame_durations) if png not in dropped]
+            present = {png for png, duration in kept}
+            kept += [(self.live_name(index), self.frame_duration) for index in range(count)
+                     if self.live_name(index) in self.live_frames and self.live_name(index) not in present]
+            if changed or len(kept) != len(self.png_files):
+                selected_index = self.preview_listbox.curselection()
+                self.png_files = [png for png, duration in kept]
+                self.frame_durations = [duration for png, duration in kept]
+                self.update_preview_list()
+                if self.png_files:
+                    self.update_preview_canvas_size()
+                    self.preview_listbox.selection_set(min(selected_index[0] if selected_index else 0, len(self.png_files) - 1))
+                if not self.preview_animation_running:
+                    self.show_preview()
+        return complete
+
+    def move_up(self):
+        selected_index = self.preview_listbox.curselection()
+        if selected_index and selected_index[0] > 0:
+            index = selected_index[0]
+            self.png_files.insert(index - 1, self.png_files.pop(index))
+            self.frame_durations.insert(index - 1, self.frame_durations.pop(index))
+            self.update_preview_list()
+            self.preview_listbox.selection_set(index - 1)
+
+    def move_down(self):
+        selected_index = self.preview_listbox.curselection()
+        if selected_index and selected_index[0] < len(self.png_files) - 1:
+            index = selected_index[0]
+            self.png_files.insert(index + 1, self.png_files.pop(index))
+            self.frame_durations.insert(index + 1, self.frame_durations.pop(index))
+            self.update_preview_list()
+            self.preview_listbox.selection_set(index + 1)
+
+    def remove_selected(self):
+        selected_index = self.preview_listbox.curselection()
+        if selected_index:
+            index = selected_index[0]
+            self.png_files.pop(index)
+            self.frame_durations.pop(index)
+            self.update_preview_list()
+            self.show_preview()
+
+    def toggle_preview_animation(self):
+        if self.preview_animation_running:
+            self.preview_animation_running = False
+            self.preview_button.config(text="Preview Animation")
+        else:
+            self.preview_animation_running = True
+            self.preview_button.config(text="Stop Animation")
+            self.warm_zoom_cache()
+            self.animate_preview()
+
+    def animate_preview(self):
+        if not self.preview_animation_running:
+            return
+
+        if self.png_files:
+            index = self.current_preview_index % len(self.png_files)
+            self.preview_canvas.delete("all")  # Clear the canvas for disposal=2 effect
+            self.preview_canvas.create_image(0, 0, anchor=tk.NW, image=self.preview_image(index))
+            self.current_preview_index = (index + 1) % len(self.png_files)
+            self.after(self.frame_durations[index], self.animate_preview)
+            # Keep the window of ready PhotoImages moving with the playhead
+            self.after_idle(self.prefetch_preview, (index + self.preview_window) % len(self.png_files))
+
+    def prefetch_preview(self, index):
+        if index < len(self.png_files):
+            self.preview_image(index)
+
+    def update_preview_canvas_size(self):
+        if self.frame_hashes:
+            width, height = self.frame_sizes[self.frame_hashes[0]]
+            if self.zoom_var.get() == 0:
+                self.fit_preview()
+            else:
+                self.preview_canvas.config(width=width * self.zoom, height=height * self.zoom)
+
+if __name__ == "__main__":
+    app = PNGToGIFConverter()
+    app.mainloop()
+    app.profiler.export_on_exit()
@@ -1,9 +1,14 @@
+import time
+_STARTUP_T0 = time.perf_counter()
+
 import tkinter as tk
-from tkinter import colorchooser, filedialog, messagebox, simpledialog
-from PIL import Image, ImageColor
-import json
 import os
+import sys
 import math
+from collections import OrderedDict
+from Pixel_Forge_Profiler import Profiler, profiled, profiling_requested
+from Pixel_Forge_Scheduler import IdleScheduler
+from Pixel_Forge_Core import image_to_layer, rgb_to_hex, parse_color, load_project, save_project_file
 
 #############################################################################
 ##                                                                         ##
@@ -25,17 +30,27 @@ import math
 ##                                                                         ##
 #############################################################################
 
+# PIL and the tkinter dialog modules are imported where they are used so the
+# editor window can come up without paying for them.
+
 class SpriteEditor(tk.Tk):
     def __init__(self):
         super().__init__()
         self.title("PixelForge 16x16px Editor")
         self.configure(bg='black')
-        self.icon_image = tk.PhotoImage(file='frame_9.png')  # Set the icon
-        self.iconphoto(False, self.icon_image)
+        self.startup_marks = [("imports", _STARTUP_T0)]
+        self.startup_report = "--startup-report" in sys.argv or bool(os.environ.get("PIXELFORGE_STARTUP_REPORT"))
+        self.profiler = Profiler(enabled=profiling_requested(sys.argv))
+        self.profiler_status = None
+        # Long operations run in time-sliced chunks between Tk events
+        self.scheduler = IdleScheduler(self, profiler=self.profiler)
+        self.redraw_region = None  # region a queued redraw still has to cover
         self.grid_size = 16
         self.cell_size = 20
         self.canvas_size = self.grid_size * self.cell_size
-        self.last_colors = []
+        self.last_colors = OrderedDict()  # normalized colour -> swatch button, most recent first
+        self.max_recent_colors = 32
+        self.rgb_cache = {}
         self.current_color = None
         self.history = []
         self.redo_stack = []
@@ -49,6 +64,34 @@ class SpriteEditor(tk.Tk):
         self.start_x = None
         self.start_y = None
 
+        # Rectangular selection, in cells: (x0, y0, x1, y1) with x1/y1 exclusive
+        self.select_mode = False
+        self.selection = None
+        self.selection_anchor = None
+        self.selection_outline = None
+        self.clipboard = None
+        self.floating = None  # pixels being dragged by a selection move
+        self.layer_override = {}  # (i, j) -> colour drawn instead of the active layer's cell
+
+        # Live preview: frames published to a running animator over shared memory
+        self.live_channel = None
+        self.live_frame = 0  # animator frame the composite is published to
+        self.live_pending = False
+
+        self.block_store_root = None  # shared block store the open project is saved into, if any
+
+        # Layer list thumbnails, drawn in idle time from the layer buffers.
+        # Every edit of a layer bumps its dirty counter and a thumbnail is
+        # only rendered again when the counter has moved.
+        self.layer_versions = {}  # id(layer) -> dirty counter
+        self.layer_thumbs = {}  # id(layer) -> (layer, counter, size, PhotoImage)
+        self.layer_thumb_items = []  # canvas image items, one per visible row, reused between passes
+        self.layer_thumb_job = None
+
+        # Last choices in the Export Matrix dialog
+        self.export_settings = {"scales": {1, 2, 4}, "ico_sizes": set(), "upscaler": "nearest"}
+        self.optimize_png_var = tk.BooleanVar(value=False)
+
         # Default key bindings
         self.key_bindings = {
             "add_layer": "Ctrl+A",
@@ -64,14 +107,54 @@ class SpriteEditor(tk.Tk):
             "paint": "Ctrl+P",
             "undo": "<Control-z>",
             "redo": "<Control-Z>",
-            "rename_layer": "Ctrl+R"
+            "rename_layer": "Ctrl+R",
+            "copy": "<Control-c>",
+            "cut": "<Control-x>",
+            "paste": "<Control-v>",
+            "deselect": "<Escape>"
         }
 
-        self.create_menu()
+        self.mark_startup("imports and Tk window")
         self.create_widgets()
+        self.mark_startup("core widgets")
         self.create_grid()  # Create the grid before adding the first layer
         self.add_layer()
+        self.mark_startup("grid and first layer")
+        # Everything the artist does not need for the first stroke is built
+        # once the window is on screen.
+        self.after(1, self.finish_startup)
+
+    def finish_startup(self):
+        self.mark_startup("first frame shown")
+        self.create_menu()
+        self.create_secondary_widgets()
         self.bind_shortcuts()
+        self.set_icon()
+        if self.profiler.enabled:
+            self.show_profiler_status()
+        self.mark_startup("menu, tools and shortcuts")
+        if self.startup_report:
+            self.report_startup()
+
+    def mark_startup(self, label):
+        self.startup_marks.append((label, time.perf_counter()))
+
+    def report_startup(self):
+        print("PixelForge startup report")
+        previous = self.startup_marks[0][1]
+        for label, stamp in self.startup_marks[1:]:
+            print(f"  {label:<28}{(stamp - previous) * 1000:8.1f} ms")
+            previous = stamp
+        total = self.startup_marks[-1][1] - self.startup_marks[0][1]
+        print(f"  {'total':<28}{total * 1000:8.1f} ms")
+
+    def set_icon(self):
+        # Look next to the script rather than in the current directory so
+        # the editor also starts when launched from elsewhere.
+        icon_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'frame_9.png')
+        if os.path.exists(icon_path):
+            self.icon_image = tk.PhotoImage(file=icon_path)  # Set the icon
+            self.iconphoto(False, self.icon_image)
 
     def create_menu(self):
         menu = tk.Menu(self)
@@ -80,13 +163,21 @@ class SpriteEditor(tk.Tk):
         # File Menu
         file_menu = tk.Menu(menu, tearoff=0)
         menu.add_cascade(label="File", menu=file_menu)
-        file_menu.add_command(label="Export as 16x16 PNG", command=lambda: self.save_image(16))
-        file_menu.add_command(label="Export as 32x32 PNG", command=lambda: self.save_image(32))
-        file_menu.add_command(label="Export as 64x64 PNG", command=lambda: self.save_image(64))
+        # Whole multiples of the grid only, so no export drops pixels
+        for scale in (1, 2, 4):
+            size = self.grid_size * scale
+            file_menu.add_command(label=f"Export as {size}x{size} PNG", command=lambda size=size: self.save_image(size))
         file_menu.add_command(label="Export as ICO", command=self.save_as_ico)
+        file_menu.add_command(label="Export Matrix...", command=self.open_export_matrix)
+        file_menu.add_command(label="Export Palette Variants", command=self.export_palette_variants)
+        file_menu.add_checkbutton(label="Size-Optimized PNGs", variable=self.optimize_png_var)
+        file_menu.add_separator()
+        file_menu.add_command(label="Import PNG as Layer", command=self.import_png)
+        file_menu.add_command(label="Import Sprite Sheet as Layers", command=self.import_sheet)
         file_menu.add_separator()
         file_menu.add_command(label="Save Project", command=self.save_project, accelerator=self.key_bindings["add_layer"])
         file_menu.add_command(label="Open Project", command=self.open_project, accelerator=self.key_bindings["duplicate_layer"])
+        file_menu.add_command(label="Save Project with Shared Blocks", command=self.save_project_shared)
 
         # Edit Menu
         edit_menu = tk.Menu(menu, tearoff=0)
@@ -110,23 +201,117 @@ class SpriteEditor(tk.Tk):
         edit_menu.add_command(label=f"Flip Vertical ({self.key_bindings['flip_vertical']})", command=self.flip_vertical)
         edit_menu.add_command(label=f"Paint ({self.key_bindings['paint']})", command=self.enable_paint_bucket)
 
+        # Selection Functions
+        edit_menu.add_separator()
+        edit_menu.add_command(label="Select", command=self.enable_select_mode)
+        edit_menu.add_command(label="Copy (Ctrl+C)", command=self.copy_selection)
+        edit_menu.add_command(label="Cut (Ctrl+X)", command=self.cut_selection)
+        edit_menu.add_command(label="Paste (Ctrl+V)", command=self.paste_clipboard)
+        edit_menu.add_command(label="Deselect (Esc)", command=self.clear_selection)
+
         # Undo/Redo Functions
         edit_menu.add_separator()
         edit_menu.add_command(label="Undo (Ctrl+Z)", command=self.undo)
         edit_menu.add_command(label="Redo (Ctrl+Shift+Z)", command=self.redo)
 
+        # Filters Menu: run on the active layer, inside the selection if there is one
+        filter_menu = tk.Menu(menu, tearoff=0)
+        menu.add_cascade(label="Filters", menu=filter_menu)
+        filter_menu.add_command(label="Outline", command=lambda: self.filter_with_color("outline"))
+        filter_menu.add_command(label="Outline with Corners", command=lambda: self.filter_with_color("outline", diagonal=True))
+        filter_menu.add_command(label="Drop Shadow", command=lambda: self.filter_with_color("shadow"))
+        filter_menu.add_command(label="Ordered Dither (Recent Colors)", command=self.dither_layer)
+        filter_menu.add_command(label="Ramp Shade (Recent Colors)", command=self.shade_layer)
+
+        # Animator Menu
+        self.live_var = tk.BooleanVar(value=False)
+        self.live_source = tk.StringVar(value="composite")
+        animator_menu = tk.Menu(menu, tearoff=0)
+        menu.add_cascade(label="Animator", menu=animator_menu)
+        animator_menu.add_checkbutton(label="Live Preview", variable=self.live_var, command=self.toggle_live_preview)
+        animator_menu.add_radiobutton(label="Publish Composite", variable=self.live_source, value="composite", command=self.publish_live)
+        animator_menu.add_radiobutton(label="Publish Layers as Frames", variable=self.live_source, value="layers", command=self.publish_live)
+        animator_menu.add_command(label="Set Live Frame...", command=self.set_live_frame)
+
+        # Tilemap Menu
+        tilemap_menu = tk.Menu(menu, tearoff=0)
+        menu.add_cascade(label="Tilemap", menu=tilemap_menu)
+        tilemap_menu.add_command(label="Open Tilemap Editor", command=self.open_tilemap)
+
+        # Profile Menu
+        self.profile_var = tk.BooleanVar(value=self.profiler.enabled)
+        profile_menu = tk.Menu(menu, tearoff=0)
+        menu.add_cascade(label="Profile", menu=profile_menu)
+        profile_menu.add_checkbutton(label="Record Profile", variable=self.profile_var, command=self.toggle_profiler)
+        profile_menu.add_command(label="Show Summary", command=self.show_profile_summary)
+        profile_menu.add_command(label="Export Trace (Chrome JSON)", command=self.export_trace)
+        profile_menu.add_command(label="Clear Profile", command=self.profiler.clear)
+
         # Help Menu
         help_menu = tk.Menu(menu, tearoff=0)
         menu.add_cascade(label="Help", menu=help_menu)
         help_menu.add_command(label="About", command=self.show_about)
 
     def show_about(self):
+        from tkinter import messagebox
         about_text = "Pixel Forge\nVersion 1.0\n\nCreated by [Your Name]\n\nThis application allows you to create and edit pixel art sprites with multiple layers and export them in various formats."
         messagebox.showinfo("About", about_text)
 
+    def toggle_profiler(self):
+        self.profiler.enabled = self.profile_var.get()
+        if self.profiler.enabled:
+            self.show_profiler_status()
+        elif self.profiler_status is not None:
+            self.profiler_status.grid_remove()
+
+    def show_profiler_status(self):
+        if self.profiler_status is None:
+            self.profiler_status = tk.Label(self, text="Profiling...", bg='black', fg='light green', anchor='w')
+        self.profiler_status.grid(row=17, column=0, columnspan=4, padx=10, sticky="ew")
+
+    def update_profiler_status(self):
+        if self.profiler_status is None or not self.profiler.enabled:
+            return
+        last = self.profiler.last
+        parts = []
+        if "event_to_paint" in last:
+            parts.append(f"event-to-paint {last['event_to_paint'] * 1000:.1f} ms")
+        if "load_grid_data" in last:
+            parts.append(f"redraw {last['load_grid_data'] * 1000:.1f} ms")
+        self.profiler_status.config(text="  |  ".join(parts) or "Profiling...")
+
+    def track_paint_latency(self, start):
+        # The canvas repaints from an idle callback queued by the item changes
+        # just made, so an idle callback queued now runs once the stroke is on
+        # screen.
+        self.after_idle(lambda: self.finish_paint_latency(start))
+
+    def finish_paint_latency(self, start):
+        self.profiler.record_since("event_to_paint", start)
+        self.update_profiler_status()
+
+    def show_profile_summary(self):
+        from tkinter import messagebox
+        messagebox.showinfo("Profile Summary", self.profiler.summary() or "Nothing recorded yet.")
+
+    def export_trace(self):
+        from tkinter import filedialog, messagebox
+        file_path = filedialog.asksaveasfilename(defaultextension=".json",
+                                                 filetypes=[("Trace files", "*.json")],
+                                                 title="Export Trace")
+        if file_path:
+            self.profiler.export_chrome_trace(file_path)
+            messagebox.showinfo("Export Trace", "Trace saved. Open it in chrome://tracing or Perfetto.")
+
     def create_widgets(self):
-        self.layer_listbox = tk.Listbox(self, bg='dark gray', fg='white')
-        self.layer_listbox.grid(row=0, column=0, padx=10, pady=10, rowspan=12, sticky="nsew")
+        layer_panel = tk.Frame(self, bg='dark gray')
+        layer_panel.grid(row=0, column=0, padx=10, pady=10, rowspan=12, sticky="nsew")
+        self.layer_thumb_canvas = tk.Canvas(layer_panel, width=24, bg='dark gray', highlightthickness=0)
+        self.layer_thumb_canvas.pack(side=tk.LEFT, fill=tk.Y)
+        self.layer_thumb_canvas.bind("<Button-1>", self.click_layer_thumb)
+        self.layer_listbox = tk.Listbox(layer_panel, bg='dark gray', fg='white',
+                                        yscrollcommand=lambda *args: self.schedule_layer_thumbs())
+        self.layer_listbox.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
         self.layer_listbox.bind("<<ListboxSelect>>", self.select_layer)
 
         self.canvas = tk.Canvas(self, width=self.canvas_size, height=self.canvas_size, bg='white')
@@ -140,6 +325,12 @@ class SpriteEditor(tk.Tk):
         self.color_button = tk.Button(self, text="Choose Color", command=self.choose_color, bg='light blue', fg='black')
         self.color_button.grid(row=0, column=2, padx=10, pady=10)
 
+        self.color_history = tk.Frame(self, bg='black')
+        self.color_history.grid(row=0, column=3, padx=10, pady=10, rowspan=12)
+
+        self.paint_bucket_mode = False
+
+    def create_secondary_widgets(self):
         self.rotate_clockwise_button = tk.Button(self, text="Rotate 90° CW", command=self.rotate_clockwise, bg='orange', fg='black')
         self.rotate_clockwise_button.grid(row=1, column=2, padx=10, pady=10)
 
@@ -161,6 +352,9 @@ class SpriteEditor(tk.Tk):
         self.draw_line_button = tk.Button(self, text="Draw Line", command=self.enable_line_mode, bg='cyan', fg='black')
         self.draw_line_button.grid(row=7, column=2, padx=10, pady=10)
 
+        self.select_button = tk.Button(self, text="Select", command=self.enable_select_mode, bg='cyan', fg='black')
+        self.select_button.grid(row=16, column=2, padx=10, pady=10)
+
         self.add_layer_button = tk.Button(self, text="Add Layer", command=self.add_layer, bg='blue', fg='white')
         self.add_layer_button.grid(row=8, column=2, padx=10, pady=5)
 
@@ -186,11 +380,6 @@ class SpriteEditor(tk.Tk):
         self.opacity_slider.set(100)
         self.opacity_slider.grid(row=15, column=2, padx=10, pady=10)
 
-        self.color_history = tk.Frame(self, bg='black')
-        self.color_history.grid(row=0, column=3, padx=10, pady=10, rowspan=12)
-
-        self.paint_bucket_mode = False
-
     def bind_shortcuts(self):
         self.bind_all(self.key_bindings["add_layer"], self.add_layer)
         self.bind_all(self.key_bindings["duplicate_layer"], self.duplicate_layer)
@@ -206,38 +395,101 @@ class SpriteEditor(tk.Tk):
         self.bind_all(self.key_bindings["rename_layer"], self.rename_layer)
         self.bind_all(self.key_bindings["undo"], self.undo)
         self.bind_all(self.key_bindings["redo"], self.redo)
+        self.bind_all(self.key_bindings["copy"], self.copy_selection)
+        self.bind_all(self.key_bindings["cut"], self.cut_selection)
+        self.bind_all(self.key_bindings["paste"], self.paste_clipboard)
+        self.bind_all(self.key_bindings["deselect"], self.clear_selection)
 
     def create_grid(self):
+        # The grid itself is a handful of lines; a cell only gets its own
+        # rectangle the first time something is drawn into it.
         self.rectangles = {}
-        for i in range(self.grid_size):
-            for j in range(self.grid_size):
-                rect_id = self.canvas.create_rectangle(i * self.cell_size, j * self.cell_size,
-                                                       (i + 1) * self.cell_size, (j + 1) * self.cell_size,
-                                                       fill="", outline="gray")
-                self.rectangles[(i, j)] = rect_id
-        self.load_grid_data()
+        self.cell_fills = {}
+        for k in range(self.grid_size + 1):
+            offset = k * self.cell_size
+            self.canvas.create_line(offset, 0, offset, self.canvas_size, fill="gray")
+            self.canvas.create_line(0, offset, self.canvas_size, offset, fill="gray")
+
+    def fill_cell(self, i, j, color):
+        color = color or ""
+        if self.cell_fills.get((i, j), "") == color:
+            return
+        rect_id = self.rectangles.get((i, j))
+        if rect_id is None:
+            rect_id = self.canvas.create_rectangle(i * self.cell_size, j * self.cell_size,
+                                                   (i + 1) * self.cell_size, (j + 1) * self.cell_size,
+                                                   fill=color, outline="gray")
+            self.rectangles[(i, j)] = rect_id
+            # A new item lands on top; keep the selection outline above the cells
+            self.canvas.tag_raise("overlay")
+        else:
+            self.canvas.itemconfig(rect_id, fill=color)
+        self.cell_fills[(i, j)] = color
+        self.profiler.count("tk_calls")
+        if self.live_channel is not None and not self.live_pending:
+            self.schedule_live_publish()
+
+    def in_grid(self, x, y):
+        return 0 <= x < self.grid_size and 0 <= y < self.grid_size
 
     def choose_color(self):
+        from tkinter import colorchooser
         color = colorchooser.askcolor()[1]
         if color:
-            self.current_color = color
-            if color not in self.last_colors:
-                self.last_colors.append(color)
-                self.update_color_history()
-
-    def update_color_history(self):
-        for widget in self.color_history.winfo_children():
-            widget.destroy()
-
-        for color in self.last_colors:
-            color_button = tk.Button(self.color_history, bg=color, width=2, height=1,
-                                     command=lambda c=color: self.set_color(c))
-            color_button.pack(pady=2)
+            self.set_color(color)
+
+    def normalize_color(self, color):
+        return rgb_to_hex(self.color_to_rgb(color))
+
+    def remember_color(self, color):
+        # Move (or add) a single swatch to the top of the history instead of
+        # rebuilding the whole column, and drop the least recently used one
+        # once the history is full.
+        color = self.normalize_color(color)
+        first = next(iter(self.last_colors), None)
+        if first == color:
+            return color
+        swatch = self.last_colors.pop(color, None)
+        if swatch is None:
+            swatch = tk.Button(self.color_history, bg=color, width=2, height=1,
+                               command=lambda c=color: self.set_color(c))
+        if first is None:
+            swatch.pack(pady=2)
+        else:
+            swatch.pack(pady=2, before=self.last_colors[first])
+        self.last_colors[color] = swatch
+        self.last_colors.move_to_end(color, last=False)
+        while len(self.last_colors) > self.max_recent_colors:
+            _, oldest = self.last_colors.popitem()
+            oldest.destroy()
+        return color
+
+    def update_color_history(self, colors=()):
+        # Replaces the whole history, e.g. when a project is opened. Colours
+        # are given oldest first, the order projects have always stored them
+        # in, so a long list keeps its newest end.
+        for swatch in self.last_colors.values():
+            swatch.destroy()
+        self.last_colors.clear()
+        unique = OrderedDict()
+        for color in colors:
+            color = self.normalize_color(color)
+            unique.pop(color, None)
+            unique[color] = None
+        for color in list(unique)[-self.max_recent_colors:]:
+            self.remember_color(color)
+
+    def saved_colors(self):
+        # The history as projects store it: oldest first
+        return list(reversed(self.last_colors))
 
     def set_color(self, color):
-        self.current_color = color
+        self.current_color = self.remember_color(color)
 
     def start_paint(self, event):
+        if self.select_mode:
+            self.start_selection(event)
+            return
         self.record_state()
         self.painting = True
         self.start_x = event.x // self.cell_size
@@ -247,7 +499,12 @@ class SpriteEditor(tk.Tk):
             return
         self.paint(event)
 
+    @profiled("paint")
     def paint(self, event):
+        start = time.perf_counter()
+        if self.select_mode:
+            self.drag_selection(event)
+            return
         if self.painting and self.current_color:
             x = event.x // self.cell_size
             y = event.y // self.cell_size
@@ -258,11 +515,18 @@ class SpriteEditor(tk.Tk):
                 self.update_temp_circle(x, y)
             elif self.line_mode:
                 self.update_temp_line(x, y)
-            else:
-                self.canvas.itemconfig(self.rectangles[(x, y)], fill=self.current_color)
+            elif self.in_grid(x, y):
+                self.fill_cell(x, y, self.current_color)
                 self.layers[self.current_layer]["data"][y][x] = self.current_color
+                self.mark_layer_dirty()
+                self.profiler.count("cells")
+            if self.profiler.enabled:
+                self.track_paint_latency(start)
 
     def stop_paint(self, event):
+        if self.select_mode:
+            self.finish_selection(event)
+            return
         if self.painting:
             if self.circle_mode:
                 self.commit_temp_circle(event)
@@ -277,50 +541,208 @@ class SpriteEditor(tk.Tk):
     def erase(self, event):
         x = event.x // self.cell_size
         y = event.y // self.cell_size
+        if not self.in_grid(x, y):
+            return
         self.record_state()
-        self.canvas.itemconfig(self.rectangles[(x, y)], fill="")
+        self.fill_cell(x, y, None)
         self.layers[self.current_layer]["data"][y][x] = None
+        self.mark_layer_dirty()
         self.clear_redo_stack()  # Clear redo stack when a new action is taken
 
     def rotate_clockwise(self, event=None):
-        self.record_state()
-        self.layers[self.current_layer]["data"] = [list(reversed(col)) for col in zip(*self.layers[self.current_layer]["data"])]
-        self.load_grid_data()
-        self.clear_redo_stack()  # Clear redo stack when a new action is taken
+        self.transform(lambda rows: [list(reversed(col)) for col in zip(*rows)])
 
     def rotate_counterclockwise(self, event=None):
-        self.record_state()
-        self.layers[self.current_layer]["data"] = [list(row) for row in zip(*self.layers[self.current_layer]["data"])][::-1]
-        self.load_grid_data()
-        self.clear_redo_stack()  # Clear redo stack when a new action is taken
+        self.transform(lambda rows: [list(row) for row in zip(*rows)][::-1])
 
     def flip_horizontal(self, event=None):
-        self.record_state()
-        self.layers[self.current_layer]["data"] = [row[::-1] for row in self.layers[self.current_layer]["data"]]
-        self.load_grid_data()
-        self.clear_redo_stack()  # Clear redo stack when a new action is taken
+        self.transform(lambda rows: [row[::-1] for row in rows])
 
     def flip_vertical(self, event=None):
+        self.transform(lambda rows: rows[::-1])
+
+    def transform(self, transform):
+        # With a selection only the selected block is transformed; otherwise
+        # the whole active layer is.
+        if self.selection:
+            self.transform_selection(transform)
+            return
         self.record_state()
-        self.layers[self.current_layer]["data"].reverse()
-        self.load_grid_data()
+        self.layers[self.current_layer]["data"] = transform(self.layers[self.current_layer]["data"])
+        self.mark_layer_dirty()
+        self.request_redraw()
         self.clear_redo_stack()  # Clear redo stack when a new action is taken
 
     def enable_paint_bucket(self, event=None):
         self.paint_bucket_mode = True
         self.circle_mode = False
         self.line_mode = False
+        self.select_mode = False
         self.canvas.bind("<Button-1>", self.paint_bucket_start)
 
     def enable_circle_mode(self):
         self.circle_mode = True
         self.paint_bucket_mode = False
         self.line_mode = False
+        self.select_mode = False
 
     def enable_line_mode(self):
         self.line_mode = True
         self.paint_bucket_mode = False
         self.circle_mode = False
+        self.select_mode = False
+
+    def enable_select_mode(self, event=None):
+        self.select_mode = True
+        self.paint_bucket_mode = False
+        self.circle_mode = False
+        self.line_mode = False
+        self.canvas.bind("<Button-1>", self.start_paint)
+
+    def event_cell(self, event):
+        x = min(max(event.x // self.cell_size, 0), self.grid_size - 1)
+        y = min(max(event.y // self.cell_size, 0), self.grid_size - 1)
+        return x, y
+
+    def set_selection(self, x0, y0, x1, y1):
+        self.selection = (x0, y0, x1, y1)
+        coords = (x0 * self.cell_size, y0 * self.cell_size, x1 * self.cell_size, y1 * self.cell_size)
+        if self.selection_outline is None:
+            self.selection_outline = self.canvas.create_rectangle(*coords, outline="red", dash=(4, 2), width=2,
+                                                                  tags="overlay")
+        else:
+            self.canvas.coords(self.selection_outline, *coords)
+            self.canvas.itemconfig(self.selection_outline, state="normal")
+        self.canvas.tag_raise(self.selection_outline)
+
+    def clear_selection(self, event=None):
+        # Deselecting also leaves select mode, back to freehand painting
+        self.selection = None
+        if self.selection_outline is not None:
+            self.canvas.itemconfig(self.selection_outline, state="hidden")
+        if self.select_mode:
+            self.select_mode = False
+            self.canvas.bind("<Button-1>", self.start_paint)
+
+    def clip_region(self, x0, y0, x1, y1):
+        return max(x0, 0), max(y0, 0), min(x1, self.grid_size), min(y1, self.grid_size)
+
+    def union_region(self, a, b):
+        return self.clip_region(min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3]))
+
+    def read_block(self, x0, y0, x1, y1):
+        return [row[x0:x1] for row in self.layers[self.current_layer]["data"][y0:y1]]
+
+    def write_block(self, x, y, block, transparent=False):
+        # Writes a block of rows with its top-left cell at (x, y), clipped to
+        # the grid. With transparent=True, None cells leave the layer as is.
+        data = self.layers[self.current_layer]["data"]
+        for dy, row in enumerate(block):
+            j = y + dy
+            if not 0 <= j < self.grid_size:
+                continue
+            lo = max(0, -x)
+            hi = min(len(row), self.grid_size - x)
+            if lo >= hi:
+                continue
+            if transparent:
+                for di in range(lo, hi):
+                    if row[di] is not None:
+                        data[j][x + di] = row[di]
+            else:
+                data[j][x + lo:x + hi] = row[lo:hi]
+        self.mark_layer_dirty()
+
+    def start_selection(self, event):
+        x, y = self.event_cell(event)
+        sel = self.selection
+        if sel and sel[0] <= x < sel[2] and sel[1] <= y < sel[3]:
+            # Pressing inside the selection picks its pixels up to move them
+            self.floating = (sel, self.read_block(*sel), x, y)
+        else:
+            self.selection_anchor = (x, y)
+            self.set_selection(x, y, x + 1, y + 1)
+
+    def drag_selection(self, event):
+        x, y = self.event_cell(event)
+        if self.floating:
+            source, block, press_x, press_y = self.floating
+            dx, dy = x - press_x, y - press_y
+            target = (source[0] + dx, source[1] + dy, source[2] + dx, source[3] + dy)
+            previous = self.selection
+            self.layer_override = self.move_override(source, block, target)
+            self.set_selection(*target)
+            self.load_grid_data(self.union_region(previous, target))
+            self.canvas.tag_raise(self.selection_outline)
+        elif self.selection_anchor:
+            ax, ay = self.selection_anchor
+            self.set_selection(min(ax, x), min(ay, y), max(ax, x) + 1, max(ay, y) + 1)
+
+    def finish_selection(self, event):
+        if self.floating:
+            source, block, press_x, press_y = self.floating
+            target = self.selection
+            self.floating = None
+            self.layer_override = {}
+            if target != source:
+                region = self.union_region(source, target)
+                self.record_region(*region)
+                self.write_block(source[0], source[1], [[None] * len(row) for row in block])
+                self.write_block(target[0], target[1], block, transparent=True)
+                self.load_grid_data(region)
+                self.set_selection(*self.clip_region(*target))
+                self.clear_redo_stack()  # Clear redo stack when a new action is taken
+        self.selection_anchor = None
+
+    def move_override(self, source, block, target):
+        # What the active layer looks like while the block is being dragged:
+        # lifted from the source and dropped (with transparency) at the target.
+        override = {}
+        for dy, row in enumerate(block):
+            for dx, color in enumerate(row):
+                if color is not None:
+                    override[(source[0] + dx, source[1] + dy)] = None
+        for dy, row in enumerate(block):
+            for dx, color in enumerate(row):
+                if color is not None:
+                    override[(target[0] + dx, target[1] + dy)] = color
+        return override
+
+    def transform_selection(self, transform):
+        x0, y0, x1, y1 = self.selection
+        block = transform(self.read_block(x0, y0, x1, y1))
+        new_selection = self.clip_region(x0, y0, x0 + len(block[0]), y0 + len(block))
+        region = self.union_region(self.selection, new_selection)
+        self.record_region(*region)
+        self.write_block(x0, y0, [[None] * (x1 - x0) for _ in range(y1 - y0)])
+        self.write_block(x0, y0, block, transparent=True)
+        self.set_selection(*new_selection)
+        self.load_grid_data(region)
+        self.clear_redo_stack()  # Clear redo stack when a new action is taken
+
+    def copy_selection(self, event=None):
+        if self.selection:
+            self.clipboard = self.read_block(*self.selection)
+
+    def cut_selection(self, event=None):
+        if self.selection:
+            x0, y0, x1, y1 = self.selection
+            self.clipboard = self.read_block(x0, y0, x1, y1)
+            self.record_region(x0, y0, x1, y1)
+            self.write_block(x0, y0, [[None] * (x1 - x0) for _ in range(y1 - y0)])
+            self.load_grid_data(self.selection)
+            self.clear_redo_stack()  # Clear redo stack when a new action is taken
+
+    def paste_clipboard(self, event=None):
+        if not self.clipboard:
+            return
+        x, y = self.selection[:2] if self.selection else (0, 0)
+        region = self.clip_region(x, y, x + len(self.clipboard[0]), y + len(self.clipboard))
+        self.record_region(*region)
+        self.write_block(x, y, self.clipboard, transparent=True)
+        self.set_selection(*region)
+        self.load_grid_data(region)
+        self.clear_redo_stack()  # Clear redo stack when a new action is taken
 
     def update_temp_circle(self, x, y):
         self.load_grid_data()  # Clear previous temporary shapes
@@ -330,7 +752,7 @@ class SpriteEditor(tk.Tk):
                 cx = i - self.start_x
                 cy = j - self.start_y
                 if cx * cx + cy * cy <= r * r:
-                    self.canvas.itemconfig(self.rectangles[(i, j)], fill=self.current_color)
+                    self.fill_cell(i, j, self.current_color)
 
     def update_temp_line(self, x, y):
         self.load_grid_data()  # Clear previous temporary shapes
@@ -342,7 +764,7 @@ class SpriteEditor(tk.Tk):
         err = dx - dy
 
         while True:
-            self.canvas.itemconfig(self.rectangles[(x0, y0)], fill=self.current_color)
+            self.fill_cell(x0, y0, self.current_color)
             if x0 == x and y0 == y:
                 break
             e2 = 2 * err
@@ -362,8 +784,9 @@ class SpriteEditor(tk.Tk):
                 cx = i - self.start_x
                 cy = j - self.start_y
                 if cx * cx + cy * cy <= r * r:
-                    self.canvas.itemconfig(self.rectangles[(i, j)], fill=self.current_color)
+                    self.fill_cell(i, j, self.current_color)
                     self.layers[self.current_layer]["data"][j][i] = self.current_color
+        self.mark_layer_dirty()
 
     def commit_temp_line(self, event):
         end_x = event.x // self.cell_size
@@ -376,7 +799,7 @@ class SpriteEditor(tk.Tk):
         err = dx - dy
 
         while True:
-            self.canvas.itemconfig(self.rectangles[(x0, y0)], fill=self.current_color)
+            self.fill_cell(x0, y0, self.current_color)
             self.layers[self.current_layer]["data"][y0][x0] = self.current_color
             if x0 == end_x and y0 == end_y:
                 break
@@ -387,6 +810,7 @@ class SpriteEditor(tk.Tk):
             if e2 < dx:
                 err += dx
                 y0 += sy
+        self.mark_layer_dirty()
 
     def paint_bucket_start(self, event):
         x = event.x // self.cell_size
@@ -397,26 +821,48 @@ class SpriteEditor(tk.Tk):
 
     def paint_bucket_fill(self, x, y):
         target_color = self.layers[self.current_layer]["data"][y][x]
-        if target_color == self.current_color:
+        if target_color == self.current_color or self.scheduler.pending("flood_fill"):
             return
         self.record_state()
-        self.flood_fill(x, y, target_color, self.current_color)
-        self.load_grid_data()
+        layer = self.layers[self.current_layer]
+        self.scheduler.submit("flood_fill", self.flood_fill(layer, x, y, target_color, self.current_color),
+                              priority=2, on_done=lambda _: self.finish_layer_edit(layer), replace=False)
         self.clear_redo_stack()  # Clear redo stack when a new action is taken
 
-    def flood_fill(self, x, y, target_color, replacement_color):
-        if x < 0 or x >= self.grid_size or y < 0 or y >= self.grid_size:
-            return
-        if self.layers[self.current_layer]["data"][y][x] != target_color:
-            return
-        self.layers[self.current_layer]["data"][y][x] = replacement_color
-        self.flood_fill(x + 1, y, target_color, replacement_color)
-        self.flood_fill(x - 1, y, target_color, replacement_color)
-        self.flood_fill(x, y + 1, target_color, replacement_color)
-        self.flood_fill(x, y - 1, target_color, replacement_color)
+    def flood_fill(self, layer, x, y, target_color, replacement_color, chunk=256):
+        # A scheduler task: iterative, so a 32x32 fill stays clear of the
+        # recursion limit, and it yields every `chunk` cells so input and
+        # redraws can get in between.
+        start = time.perf_counter()
+        data = layer["data"]
+        stack = [(x, y)]
+        filled = 0
+        while stack:
+            x, y = stack.pop()
+            if x < 0 or x >= self.grid_size or y < 0 or y >= self.grid_size:
+                continue
+            if data[y][x] != target_color:
+                continue
+            data[y][x] = replacement_color
+            self.profiler.count("cells")
+            stack.extend(((x + 1, y), (x - 1, y), (x, y + 1), (x, y - 1)))
+            filled += 1
+            if filled % chunk == 0:
+                yield
+        self.profiler.record_since("flood_fill", start)
+
+    def finish_layer_edit(self, layer):
+        # Once a scheduled edit is done; the layer may have been removed (or
+        # undone) while it ran, and then there is nothing left to show.
+        for index, candidate in enumerate(self.layers):
+            if candidate is layer:
+                self.mark_layer_dirty(index)
+                self.request_redraw()
+                return
 
     def add_layer(self, event=None):
         if len(self.layers) >= self.max_layers:
+            from tkinter import messagebox
             messagebox.showwarning("Layer Limit", "Cannot add more than 25 layers.")
             return
         self.layers.append({"data": [[None for _ in range(self.grid_size)] for _ in range(self.grid_size)], "visible": True, "opacity": 1.0})
@@ -424,11 +870,12 @@ class SpriteEditor(tk.Tk):
         self.layer_listbox.selection_clear(0, tk.END)
         self.layer_listbox.selection_set(tk.END)
         self.current_layer = len(self.layers) - 1
-        self.load_grid_data()
+        self.request_redraw()
         self.clear_redo_stack()  # Clear redo stack when a new action is taken
 
     def duplicate_layer(self, event=None):
         if len(self.layers) >= self.max_layers:
+            from tkinter import messagebox
             messagebox.showwarning("Layer Limit", "Cannot duplicate layer; maximum layers reached.")
             return
         self.record_state()
@@ -438,10 +885,11 @@ class SpriteEditor(tk.Tk):
         self.layer_listbox.selection_clear(0, tk.END)
         self.layer_listbox.selection_set(tk.END)
         self.current_layer = len(self.layers) - 1
-        self.load_grid_data()
+        self.request_redraw()
         self.clear_redo_stack()  # Clear redo stack when a new action is taken
 
     def rename_layer(self, event=None):
+        from tkinter import simpledialog
         current_name = self.layer_listbox.get(self.current_layer)
         new_name = simpledialog.askstring("Rename Layer", "Enter new layer name:", initialvalue=current_name)
         if new_name:
@@ -453,163 +901,640 @@ class SpriteEditor(tk.Tk):
         selected = self.layer_listbox.curselection()
         if selected:
             self.current_layer = selected[0]
-            self.load_grid_data()
+            self.request_redraw()
 
     def toggle_layer(self, event=None):
         self.layers[self.current_layer]["visible"] = not self.layers[self.current_layer]["visible"]
-        self.load_grid_data()
+        self.request_redraw()
 
     def merge_above(self, event=None):
         if self.current_layer == 0:
+            from tkinter import messagebox
             messagebox.showwarning("Merge Error", "Cannot merge the top layer with a layer above.")
             return
-        self.record_state()
-        for j in range(self.grid_size):
-            for i in range(self.grid_size):
-                if self.layers[self.current_layer]["data"][j][i] is not None:
-                    self.layers[self.current_layer - 1]["data"][j][i] = self.layers[self.current_layer]["data"][j][i]
-        self.delete_layer()
-        self.clear_redo_stack()  # Clear redo stack when a new action is taken
+        self.merge_into(self.current_layer - 1)
 
     def merge_below(self, event=None):
         if self.current_layer == len(self.layers) - 1:
+            from tkinter import messagebox
             messagebox.showwarning("Merge Error", "Cannot merge the bottom layer with a layer below.")
             return
+        self.merge_into(self.current_layer + 1)
+
+    def merge_into(self, target):
+        # The active layer is copied onto target a row per chunk on the
+        # scheduler, then removed.
+        if self.scheduler.pending("merge_layers"):
+            return
         self.record_state()
-        for j in range(self.grid_size):
-            for i in range(self.grid_size):
-                if self.layers[self.current_layer]["data"][j][i] is not None:
-                    self.layers[self.current_layer + 1]["data"][j][i] = self.layers[self.current_layer]["data"][j][i]
-        self.delete_layer()
-        self.clear_redo_stack()  # Clear redo stack when a new action is taken
+        source, destination = self.layers[self.current_layer], self.layers[target]
+
+        def work():
+            start = time.perf_counter()
+            for row, cells in zip(destination["data"], source["data"]):
+                for i, color in enumerate(cells):
+                    if color is not None:
+                        row[i] = color
+                yield
+            self.profiler.record_since("merge_layers", start)
+
+        def done(_):
+            self.finish_layer_edit(destination)
+            for index, layer in enumerate(self.layers):
+                if layer is source:
+                    self.current_layer = index
+                    self.delete_layer()
+                    break
+            self.clear_redo_stack()  # Clear redo stack when a new action is taken
+
+        self.scheduler.submit("merge_layers", work(), priority=2, on_done=done, replace=False)
 
     def delete_layer(self, event=None):
         if len(self.layers) == 1:
+            from tkinter import messagebox
             messagebox.showwarning("Delete Error", "Cannot delete the only layer.")
             return
         self.record_state()
         del self.layers[self.current_layer]
         self.layer_listbox.delete(self.current_layer)
         self.current_layer = max(0, self.current_layer - 1)
-        self.load_grid_data()
+        self.request_redraw()
         self.clear_redo_stack()  # Clear redo stack when a new action is taken
 
     def adjust_opacity(self, value):
         opacity = int(value) / 100
         self.layers[self.current_layer]["opacity"] = opacity
-        self.load_grid_data()
+        self.request_redraw()
         self.clear_redo_stack()  # Clear redo stack when a new action is taken
 
+    def mark_layer_dirty(self, index=None):
+        layer = self.layers[self.current_layer if index is None else index]
+        self.layer_versions[id(layer)] = self.layer_versions.get(id(layer), 0) + 1
+        self.schedule_layer_thumbs()
+
+    def schedule_layer_thumbs(self):
+        if self.layer_thumb_job is None:
+            self.layer_thumb_job = self.after_idle(self.update_layer_thumbs)
+
+    def update_layer_thumbs(self, budget=0.004):
+        # Runs when Tk is idle, and not at all during a stroke. Thumbnails
+        # whose counter moved are rendered until the budget is spent; the
+        # rest keep showing their last image until the next idle pass.
+        if self.painting:
+            self.layer_thumb_job = self.after(100, self.update_layer_thumbs)
+            return
+        self.layer_thumb_job = None
+        with self.profiler.span("layer_thumbs"):
+            deadline = time.perf_counter() + budget
+            live = {id(layer) for layer in self.layers}
+            for key in set(self.layer_thumbs) - live:
+                del self.layer_thumbs[key]
+            for key in set(self.layer_versions) - live:
+                del self.layer_versions[key]
+            canvas = self.layer_thumb_canvas
+            items = self.layer_thumb_items
+            shown = 0
+            for index, layer in enumerate(self.layers):
+                box = self.layer_listbox.bbox(index)
+                if not box:
+                    continue  # scrolled out of view
+                size = max(4, box[3] - 2)
+                version = self.layer_versions.get(id(layer), 0)
+                cached = self.layer_thumbs.get(id(layer))
+                if cached and cached[0] is not layer:
+                    cached = None
+                if not cached or cached[1:3] != (version, size):
+                    if time.perf_counter() <= deadline:
+                        cached = self.layer_thumbs[id(layer)] = (layer, version, size,
+                                                                 self.render_layer_thumb(layer, size))
+                        self.profiler.count("rendered")
+                    else:
+                        self.schedule_layer_thumbs()
+                        if not cached:
+                            continue  # nothing rendered for this layer yet
+                y = box[1] + box[3] // 2
+                if shown < len(items):
+                    canvas.coords(items[shown], 12, y)
+                    canvas.itemconfigure(items[shown], image=cached[3])
+                else:
+                    items.append(canvas.create_image(12, y, image=cached[3], tags="thumb"))
+                shown += 1
+            for item in items[shown:]:
+                canvas.delete(item)
+            del items[shown:]
+
+    def render_layer_thumb(self, layer, size):
+        # Nearest-neighbour sample of the layer's own colours; empty cells
+        # take the list's background.
+        data = layer["data"]
+        step = self.grid_size / size
+        rows = []
+        for y in range(size):
+            row = data[int(y * step)]
+            rows.append("{" + " ".join(row[int(x * step)] or "#a9a9a9" for x in range(size)) + "}")
+        photo = tk.PhotoImage(width=size, height=size)
+        photo.put(" ".join(rows))
+        return photo
+
+    def click_layer_thumb(self, event):
+        index = self.layer_listbox.nearest(event.y)
+        if 0 <= index < len(self.layers):
+            self.layer_listbox.selection_clear(0, tk.END)
+            self.layer_listbox.selection_set(index)
+            self.select_layer(None)
+
+    def composite_image(self, layers=None):
+        from PIL import Image
+        image = Image.new("RGBA", (self.grid_size, self.grid_size), (0, 0, 0, 0))
+        pixels = image.load()
+
+        for layer in self.layers if layers is None else layers:
+            if layer["visible"]:
+                layer_opacity = layer.get("opacity", 1.0)
+                for i in range(self.grid_size):
+                    for j in range(self.grid_size):
+                        color = layer["data"][j][i]
+                        if color:
+                            rgb_color = self.color_to_rgb(color)
+                            r, g, b = [int(c * layer_opacity) for c in rgb_color]
+                            pixel_color = (r, g, b, int(255 * layer_opacity))
+                            pixels[i, j] = pixel_color
+        return image
+
     def save_image(self, size):
+        from tkinter import filedialog
+        from PIL import Image
         file_path = filedialog.asksaveasfilename(defaultextension=".png",
                                                  filetypes=[("PNG files", "*.png")],
                                                  title="Save as")
         if file_path:
-            image = Image.new("RGBA", (self.grid_size, self.grid_size), (0, 0, 0, 0))
-            pixels = image.load()
-
-            for layer in self.layers:
-                if layer["visible"]:
-                    layer_opacity = layer.get("opacity", 1.0)
-                    for i in range(self.grid_size):
-                        for j in range(self.grid_size):
-                            color = layer["data"][j][i]
-                            if color:
-                                rgb_color = ImageColor.getrgb(color)
-                                r, g, b = [int(c * layer_opacity) for c in rgb_color]
-                                pixel_color = (r, g, b, int(255 * layer_opacity))
-                                pixels[i, j] = pixel_color
-
-            image = image.resize((size, size), Image.NEAREST)
-            image.save(file_path)
+            start = time.perf_counter()
+            image = self.composite_image().resize((size, size), Image.NEAREST)
+            if self.optimize_png_var.get():
+                import numpy as np
+                from Pixel_Forge_Core import save_optimized_png
+                self.run_in_background("export_png", start, save_optimized_png, file_path, np.asarray(image))
+            else:
+                self.run_in_background("export_png", start, image.save, file_path)
 
     def save_as_ico(self):
+        from tkinter import filedialog
+        from PIL import Image
         file_path = filedialog.asksaveasfilename(defaultextension=".ico",
                                                  filetypes=[("ICO files", "*.ico")],
                                                  title="Save as ICO")
         if file_path:
-            image = Image.new("RGBA", (self.grid_size, self.grid_size), (0, 0, 0, 0))
-            pixels = image.load()
-
-            for layer in self.layers:
-                if layer["visible"]:
-                    layer_opacity = layer.get("opacity", 1.0)
-                    for i in range(self.grid_size):
-                        for j in range(self.grid_size):
-                            color = layer["data"][j][i]
-                            if color:
-                                rgb_color = ImageColor.getrgb(color)
-                                r, g, b = [int(c * layer_opacity) for c in rgb_color]
-                                pixel_color = (r, g, b, int(255 * layer_opacity))
-                                pixels[i, j] = pixel_color
+            start = time.perf_counter()
+            image = self.composite_image()
 
             # Create different sizes for ICO file
             icon_sizes = [image.resize((16, 16), Image.NEAREST),
                           image.resize((32, 32), Image.NEAREST),
                           image.resize((64, 64), Image.NEAREST)]
-            icon_sizes[0].save(file_path, format='ICO', sizes=[(16, 16), (32, 32), (64, 64)])
+
+            def write():
+                # The largest image is the base; Pillow uses the others as they are
+                icon_sizes[-1].save(file_path, format='ICO', sizes=[(16, 16), (32, 32), (64, 64)],
+                                    append_images=icon_sizes[:-1])
+            self.run_in_background("export_ico", start, write)
+
+    def open_export_matrix(self):
+        from Pixel_Forge_Core import EXPORT_PRESETS, ICO_SIZES
+        settings = self.export_settings
+        dialog = tk.Toplevel(self)
+        dialog.title("Export Matrix")
+        dialog.configure(bg='black')
+
+        tk.Label(dialog, text="PNG scales", bg='black', fg='white').grid(row=0, column=0, columnspan=8, padx=10, sticky="w")
+        scale_vars = {}
+        for n in range(1, 17):
+            scale_vars[n] = tk.BooleanVar(value=n in settings["scales"])
+            tk.Checkbutton(dialog, text=f"{n}x", variable=scale_vars[n], bg='black', fg='white',
+                           selectcolor='black').grid(row=1 + (n - 1) // 8, column=(n - 1) % 8, padx=5, sticky="w")
+
+        tk.Label(dialog, text="ICO sizes", bg='black', fg='white').grid(row=3, column=0, columnspan=8, padx=10, sticky="w")
+        ico_vars = {}
+        for k, size in enumerate(ICO_SIZES):
+            ico_vars[size] = tk.BooleanVar(value=size in settings["ico_sizes"])
+            tk.Checkbutton(dialog, text=str(size), variable=ico_vars[size], bg='black', fg='white',
+                           selectcolor='black').grid(row=4, column=k, padx=5, sticky="w")
+
+        tk.Label(dialog, text="Upscaler", bg='black', fg='white').grid(row=5, column=0, columnspan=8, padx=10, sticky="w")
+        upscaler_var = tk.StringVar(value=settings["upscaler"])
+        for k, (label, name) in enumerate((("Nearest", "nearest"), ("Scale2x / EPX", "scale2x"), ("xBR-style", "xbr"))):
+            tk.Radiobutton(dialog, text=label, variable=upscaler_var, value=name, bg='black', fg='white',
+                           selectcolor='black').grid(row=6, column=k * 2, columnspan=2, padx=5, sticky="w")
+
+        def export(preset=None):
+            if preset:
+                for n, var in scale_vars.items():
+                    var.set(n in preset["scales"])
+                for size, var in ico_vars.items():
+                    var.set(size in preset["ico_sizes"])
+            settings["scales"] = {n for n, var in scale_vars.items() if var.get()}
+            settings["ico_sizes"] = {size for size, var in ico_vars.items() if var.get()}
+            settings["upscaler"] = upscaler_var.get()
+            dialog.destroy()
+            self.run_export_matrix()
+
+        # Presets export straight away
+        for k, (name, preset) in enumerate(EXPORT_PRESETS.items()):
+            tk.Button(dialog, text=name, command=lambda preset=preset: export(preset),
+                      bg='light blue', fg='black').grid(row=7, column=k * 2, columnspan=2, padx=5, pady=10)
+        tk.Button(dialog, text="Export", command=export, bg='light green', fg='black').grid(row=7, column=6, columnspan=2, padx=5, pady=10)
+
+    def run_export_matrix(self):
+        from tkinter import filedialog, messagebox
+        import numpy as np
+        from Pixel_Forge_Core import export_matrix
+        settings = self.export_settings
+        if not settings["scales"] and not settings["ico_sizes"]:
+            messagebox.showwarning("Export Matrix", "Pick at least one scale or ICO size.")
+            return
+        file_path = filedialog.asksaveasfilename(defaultextension=".png", filetypes=[("PNG files", "*.png")],
+                                                 title="Export Matrix As")
+        if not file_path:
+            return
+        start = time.perf_counter()
+        # One composite feeds every size
+        pixels = np.asarray(self.composite_image())
+        self.run_in_background("export_matrix", start, export_matrix, pixels, file_path, sorted(settings["scales"]),
+                               sorted(settings["ico_sizes"]), settings["upscaler"], self.optimize_png_var.get(),
+                               done=lambda written: messagebox.showinfo(
+                                   "Export Matrix", f"Wrote {len(written)} files:\n" + "\n".join(os.path.basename(path) for path in written)))
+
+    def apply_filter(self, name, **options):
+        from tkinter import messagebox
+        from Pixel_Forge_Core import filter_layer
+        start = time.perf_counter()
+        try:
+            result, region = filter_layer(self.layers[self.current_layer]["data"], name, self.selection, **options)
+        except ValueError as e:
+            messagebox.showwarning("Filter", str(e))
+            return
+        if region is None:
+            return
+        # One undo entry and one redraw, both covering only the cells that changed
+        x0, y0, x1, y1 = region
+        self.record_region(x0, y0, x1, y1)
+        self.write_block(x0, y0, [row[x0:x1] for row in result[y0:y1]])
+        self.request_redraw(region)
+        self.profiler.record_since(f"filter_{name}", start)
+
+    def filter_with_color(self, name, **options):
+        from tkinter import messagebox
+        if not self.current_color:
+            messagebox.showwarning("Filter", "Choose a color first.")
+            return
+        self.apply_filter(name, color=self.current_color, **options)
+
+    def dither_layer(self):
+        self.apply_filter("dither", palette=list(self.last_colors))
+
+    def shade_layer(self):
+        # The ramp runs from the darkest recent color to the lightest
+        ramp = sorted(self.last_colors, key=lambda color: sum(self.color_to_rgb(color)))
+        self.apply_filter("shade", ramp=ramp)
+
+    def open_tilemap(self):
+        from Pixel_Forge_Tilemap import TilemapWindow
+        TilemapWindow(self)
+
+    def toggle_live_preview(self):
+        from Pixel_Forge_Core import FrameChannel
+        if not self.live_var.get():
+            self.close_live_channel()
+            return
+        try:
+            self.live_channel = FrameChannel.create(self.grid_size, self.grid_size)
+        except FileExistsError:
+            from tkinter import messagebox
+            self.live_var.set(False)
+            messagebox.showwarning("Live Preview", "Another editor is already publishing live frames.")
+            return
+        self.publish_live()
+
+    def close_live_channel(self):
+        if self.live_channel is not None:
+            self.live_channel.close()
+            self.live_channel = None
+
+    def set_live_frame(self):
+        from tkinter import simpledialog
+        frame = simpledialog.askinteger("Live Frame", "Publish the composite as animator frame:",
+                                        initialvalue=self.live_frame + 1, minvalue=1, maxvalue=256)
+        if frame is not None:
+            self.live_frame = frame - 1
+            self.publish_live()
+
+    def schedule_live_publish(self):
+        # One publish per batch of edits, once Tk is idle
+        self.live_pending = True
+        self.after_idle(self.publish_live)
+
+    def publish_live(self):
+        self.live_pending = False
+        channel = self.live_channel
+        if channel is None:
+            return
+        with self.profiler.span("live_publish"):
+            if self.live_source.get() == "layers":
+                for n, layer in enumerate(self.layers[:channel.max_frames]):
+                    channel.publish(n, self.composite_image([dict(layer, visible=True)]).tobytes())
+                channel.set_frame_count(len(self.layers))
+            else:
+                frame = min(self.live_frame, channel.max_frames - 1)
+                channel.publish(frame, self.composite_image().tobytes())
+                channel.set_frame_count(max(channel.frame_count, frame + 1))
+
+    def export_palette_variants(self):
+        from tkinter import filedialog, messagebox, simpledialog
+        from Pixel_Forge_Core import load_variant_table, render_variants
+        table_path = filedialog.askopenfilename(filetypes=[("Variant tables", "*.json")], title="Open Variant Table")
+        if not table_path:
+            return
+        out_dir = filedialog.askdirectory(title="Export Variants To")
+        if not out_dir:
+            return
+        prefix = simpledialog.askstring("Export Palette Variants", "File name prefix:", initialvalue="sprite")
+        if not prefix:
+            return
+        try:
+            table = load_variant_table(table_path)
+        except ValueError as e:
+            messagebox.showerror("Export Palette Variants", str(e))
+            return
+        # The workers get a copy, so editing can go on while they render
+        layers = [dict(layer, data=[row[:] for row in layer["data"]]) for layer in self.layers]
+        self.run_in_background("export_variants", time.perf_counter(), render_variants, {prefix: {"layers": layers}},
+                               table, out_dir, done=lambda written: messagebox.showinfo(
+                                   "Export Palette Variants", f"Wrote {len(written)} variants to {out_dir}"))
+
+    def run_in_background(self, name, start, fn, *args, done=None):
+        # fn runs on a worker thread; done (or an error box) follows on the Tk thread
+        def work():
+            result = yield self.scheduler.offload(fn, *args)
+            self.profiler.record_since(name, start)
+            return result
+
+        def failed(error):
+            from tkinter import messagebox
+            messagebox.showerror("Export Failed", f"{name}: {error}")
+        self.scheduler.submit(name, work(), on_done=done, on_error=failed, replace=False)
+
+    def import_png(self, event=None):
+        from tkinter import filedialog, messagebox, simpledialog
+        from PIL import Image
+        if len(self.layers) >= self.max_layers:
+            messagebox.showwarning("Layer Limit", "Cannot import; maximum layers reached.")
+            return
+        file_path = filedialog.askopenfilename(filetypes=[("PNG files", "*.png")], title="Import PNG")
+        if not file_path:
+            return
+        colors = simpledialog.askinteger("Import PNG", "Number of colors (1-256):", initialvalue=16, minvalue=1, maxvalue=256)
+        if colors is None:
+            return
+        with Image.open(file_path) as image:
+            downscale = False
+            if image.size != (self.grid_size, self.grid_size):
+                downscale = messagebox.askyesno("Import PNG", f"The image is {image.width}x{image.height}. Downscale it to "
+                                                f"{self.grid_size}x{self.grid_size}?\n\nChoose No to crop it instead.")
+            with self.profiler.span("import_png", colors=colors):
+                data, palette = image_to_layer(image, self.grid_size, colors, downscale)
+
+        self.layers.append({"data": data, "visible": True, "opacity": 1.0})
+        self.layer_listbox.insert(tk.END, os.path.basename(file_path))
+        self.layer_listbox.selection_clear(0, tk.END)
+        self.layer_listbox.selection_set(tk.END)
+        self.current_layer = len(self.layers) - 1
+        for color in reversed(palette):
+            self.remember_color(color)
+        self.request_redraw()
+        self.clear_redo_stack()  # Clear redo stack when a new action is taken
+
+    def import_sheet(self, event=None):
+        # Each sprite on the sheet becomes a layer, all mapped onto one
+        # palette taken from the sprites together so the frames stay consistent.
+        from tkinter import filedialog, messagebox, simpledialog
+        from PIL import Image
+        import numpy as np
+        from Pixel_Forge_Core import parse_cell_size, quantize_pixels, slice_sheet
+        room = self.max_layers - len(self.layers)
+        if room <= 0:
+            messagebox.showwarning("Layer Limit", "Cannot import; maximum layers reached.")
+            return
+        file_path = filedialog.askopenfilename(filetypes=[("PNG files", "*.png")], title="Import Sprite Sheet")
+        if not file_path:
+            return
+        text = simpledialog.askstring("Import Sprite Sheet", "Cell size, e.g. 32 or 32x48 (leave blank to find each sprite):",
+                                      initialvalue=str(self.grid_size))
+        if text is None:
+            return
+        colors = simpledialog.askinteger("Import Sprite Sheet", "Number of colors (1-256):", initialvalue=16, minvalue=1, maxvalue=256)
+        if colors is None:
+            return
+        try:
+            cell = parse_cell_size(text) if text.strip() else None
+            with Image.open(file_path) as image:
+                rgba = image.convert("RGBA")
+            sprites = slice_sheet(rgba, cell, uniform=cell is None)
+        except (OSError, ValueError) as e:
+            messagebox.showerror("Import Sprite Sheet", f"Could not slice {file_path}:\n{e}")
+            return
+        if not sprites:
+            messagebox.showwarning("Import Sprite Sheet", f"{os.path.basename(file_path)} has no visible sprites.")
+            return
+        if len(sprites) > room:
+            messagebox.showwarning("Layer Limit", f"The sheet has {len(sprites)} sprites; only the first {room} fit as layers.")
+            sprites = sprites[:room]
+        downscale = False
+        if any(max(sprite.size) > self.grid_size for _, sprite in sprites):
+            downscale = messagebox.askyesno("Import Sprite Sheet", f"Some sprites are larger than {self.grid_size}x{self.grid_size}. "
+                                            "Downscale them to fit?\n\nChoose No to crop them instead.")
+        with self.profiler.span("import_sheet", sprites=len(sprites), colors=colors):
+            pixels = np.concatenate([np.asarray(sprite).reshape(-1, 4) for _, sprite in sprites])
+            palette = quantize_pixels(pixels, colors, mask=pixels[:, 3] >= 128)
+            used = []
+            for n, (_, sprite) in enumerate(sprites, 1):
+                data, sprite_colors = image_to_layer(sprite, self.grid_size, downscale=downscale and max(sprite.size) > self.grid_size,
+                                                     palette=palette)
+                self.layers.append({"data": data, "visible": True, "opacity": 1.0})
+                self.layer_listbox.insert(tk.END, f"{os.path.basename(file_path)} {n}")
+                used += [color for color in sprite_colors if color not in used]
+
+        self.layer_listbox.selection_clear(0, tk.END)
+        self.layer_listbox.selection_set(tk.END)
+        self.current_layer = len(self.layers) - 1
+        for color in reversed(used):
+            self.remember_color(color)
+        self.request_redraw()
+        self.clear_redo_stack()  # Clear redo stack when a new action is taken
 
     def save_project(self, event=None):
+        from tkinter import filedialog, messagebox
         file_path = filedialog.asksaveasfilename(defaultextension=".json",
                                                  filetypes=[("JSON files", "*.json")],
                                                  title="Save Project")
         if file_path:
-            project_data = {
-                "layers": self.layers,
-                "last_colors": self.last_colors
-            }
-            with open(file_path, 'w') as f:
-                json.dump(project_data, f)
+            save_project_file(file_path, self.layers, self.saved_colors(), store_root=self.block_store_root)
+            messagebox.showinfo("Save Project", "Project saved successfully!")
+
+    def save_project_shared(self):
+        # Layers go into a block store next to the project; related sprites
+        # saved the same way share every block they have in common.
+        from tkinter import filedialog, messagebox
+        file_path = filedialog.asksaveasfilename(defaultextension=".json",
+                                                 filetypes=[("JSON files", "*.json")],
+                                                 title="Save Project with Shared Blocks")
+        if file_path:
+            self.block_store_root = os.path.join(os.path.dirname(os.path.abspath(file_path)), ".pixelforge_blocks")
+            save_project_file(file_path, self.layers, self.saved_colors(), store_root=self.block_store_root)
             messagebox.showinfo("Save Project", "Project saved successfully!")
 
     def open_project(self, event=None):
+        from tkinter import filedialog, messagebox
         file_path = filedialog.askopenfilename(defaultextension=".json",
                                                filetypes=[("JSON files", "*.json")],
                                                title="Open Project")
         if file_path:
-            with open(file_path, 'r') as f:
-                project_data = json.load(f)
-            self.layers = project_data["layers"]
-            self.last_colors = project_data["last_colors"]
-            self.update_color_history()
-            self.load_grid_data()
-            messagebox.showinfo("Open Project", "Project loaded successfully!")
-
-    def load_grid_data(self):
-        for j in range(self.grid_size):
-            for i in range(self.grid_size):
+            # The file is read and its blocks resolved on a worker thread
+            def work():
+                project_data = yield self.scheduler.offload(load_project, file_path)
+                self.block_store_root = project_data.get("block_store")
+                self.layers = project_data["layers"]
+                # The list shows the project's layers, not the ones it replaced
+                self.current_layer = 0
+                self.layer_listbox.delete(0, tk.END)
+                for n in range(len(self.layers)):
+                    self.layer_listbox.insert(tk.END, f"Layer {n + 1}")
+                self.layer_listbox.selection_set(0)
+                self.update_color_history(project_data["last_colors"])
+                self.request_redraw()
+
+            self.scheduler.submit("open_project", work(), priority=1,
+                                  on_done=lambda _: messagebox.showinfo("Open Project", "Project loaded successfully!"),
+                                  on_error=lambda e: messagebox.showerror("Open Project", f"Could not open {file_path}:\n{e}"))
+
+    def request_redraw(self, region=None):
+        # Redraws after bulk edits (fills, merges, rotations, layer changes,
+        # project loads) are drawn a few rows per chunk by the scheduler,
+        # merged with any redraw still queued, so input is never held up.
+        region = region or (0, 0, self.grid_size, self.grid_size)
+        if self.redraw_region and self.scheduler.pending("redraw"):
+            region = self.union_region(self.redraw_region, region)
+        self.redraw_region = region
+        self.schedule_layer_thumbs()  # layers may have been added, removed or reordered
+        self.scheduler.submit("redraw", self.redraw_rows(region), priority=2)
+
+    def redraw_rows(self, region):
+        x0, y0, x1, y1 = region
+        # About a thousand layer cells per chunk, a millisecond or two
+        band = max(1, 1024 // ((x1 - x0) * max(1, len(self.layers))))
+        for j in range(y0, y1, band):
+            self.load_grid_data((x0, j, x1, min(j + band, y1)))
+            yield
+        self.redraw_region = None
+
+    @profiled("load_grid_data")
+    def load_grid_data(self, region=None):
+        # region limits the redraw to (x0, y0, x1, y1); None redraws the grid
+        # straight away, which makes any queued redraw unnecessary
+        if self.live_channel is not None and not self.live_pending:
+            self.schedule_live_publish()
+        if region is None and self.scheduler.pending("redraw"):
+            self.scheduler.cancel("redraw")
+            self.redraw_region = None
+        x0, y0, x1, y1 = region or (0, 0, self.grid_size, self.grid_size)
+        self.profiler.count("cells", (x1 - x0) * (y1 - y0))
+        override = self.layer_override
+        active = self.layers[self.current_layer] if self.layers else None
+        for j in range(y0, y1):
+            for i in range(x0, x1):
                 color = None
                 for layer in self.layers:
-                    if layer["visible"] and layer["data"][j][i]:
+                    cell = layer["data"][j][i]
+                    if override and layer is active and (i, j) in override:
+                        cell = override[(i, j)]
+                    if layer["visible"] and cell:
                         layer_opacity = layer.get("opacity", 1.0)
-                        color = layer["data"][j][i]
+                        color = cell
                         if color:
-                            rgb_color = ImageColor.getrgb(color)
+                            rgb_color = self.color_to_rgb(color)
                             r, g, b = [int(c * layer_opacity) for c in rgb_color]
                             color = f"#{r:02x}{g:02x}{b:02x}"
-                self.canvas.itemconfig(self.rectangles[(i, j)], fill=color if color else "")
+                self.fill_cell(i, j, color)
+        if self.profiler.enabled:
+            self.after_idle(self.update_profiler_status)
+
+    def color_to_rgb(self, color):
+        # Plain hex colours are parsed here so redraws never need PIL; the
+        # results are cached because a sprite only uses a few colours.
+        rgb = self.rgb_cache.get(color)
+        if rgb is None:
+            rgb = self.rgb_cache[color] = parse_color(color)
+        return rgb
+
+    @profiled("record_state")
+    def finish_layer_edits(self):
+        # A fill or merge still running on the scheduler lands before the
+        # history moves, so undo never swaps a layer out from under it.
+        self.scheduler.run_now("flood_fill")
+        self.scheduler.run_now("merge_layers")
 
     def record_state(self):
+        self.finish_layer_edits()
+        self.profiler.count("cells", self.grid_size * self.grid_size)
         # Push current state to the undo stack
         self.history.append([row[:] for row in self.layers[self.current_layer]["data"]])
         # Clear redo stack since a new action is taken
         self.redo_stack.clear()
 
+    @profiled("record_region")
+    def record_region(self, x0, y0, x1, y1):
+        # Undo entry covering just a block of the active layer
+        self.finish_layer_edits()
+        self.profiler.count("cells", (x1 - x0) * (y1 - y0))
+        self.history.append({"layer": self.current_layer, "x": x0, "y": y0,
+                             "rows": self.read_block(x0, y0, x1, y1)})
+        self.redo_stack.clear()
+
+    def swap_region(self, entry):
+        # Put a region entry back and return the entry that reverses it
+        if entry["layer"] >= len(self.layers):
+            return entry
+        data = self.layers[entry["layer"]]["data"]
+        x0, y0 = entry["x"], entry["y"]
+        x1, y1 = x0 + len(entry["rows"][0]), y0 + len(entry["rows"])
+        inverse = dict(entry, rows=[row[x0:x1] for row in data[y0:y1]])
+        for dy, row in enumerate(entry["rows"]):
+            data[y0 + dy][x0:x1] = row
+        self.mark_layer_dirty(entry["layer"])
+        self.load_grid_data((x0, y0, x1, y1))
+        return inverse
+
     def undo(self, event=None):
-        if self.history:
+        self.finish_layer_edits()
+        if self.history and isinstance(self.history[-1], dict):
+            self.redo_stack.append(self.swap_region(self.history.pop()))
+        elif self.history:
             # Push current state to the redo stack before undoing
             self.redo_stack.append([row[:] for row in self.layers[self.current_layer]["data"]])
             # Pop the last state from the undo stack
             self.layers[self.current_layer]["data"] = self.history.pop()
-            self.load_grid_data()
+            self.mark_layer_dirty()
+            self.request_redraw()
 
     def redo(self, event=None):
-        if self.redo_stack:
+        self.finish_layer_edits()
+        if self.redo_stack and isinstance(self.redo_stack[-1], dict):
+            self.history.append(self.swap_region(self.redo_stack.pop()))
+        elif self.redo_stack:
             # Push current state to the undo stack before redoing
             self.history.append([row[:] for row in self.layers[self.current_layer]["data"]])
             # Pop the last state from the redo stack
             self.layers[self.current_layer]["data"] = self.redo_stack.pop()
-            self.load_grid_data()
+            self.mark_layer_dirty()
+            self.request_redraw()
 
     def clear_redo_stack(self):
         self.redo_stack.clear()
@@ -617,3 +1542,6 @@ class SpriteEditor(tk.Tk):
 if __name__ == "__main__":
     app = SpriteEditor()
     app.mainloop()
+    app.scheduler.shutdown()  # lets exports that are still being written finish
+    app.close_live_channel()
+    app.profiler.export_on_exit()
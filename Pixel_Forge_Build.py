@@ -0,0 +1,331 @@
+import hashlib
+import json
+import math
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from Pixel_Forge_Core import (UPSCALERS, IndexedProject, load_project, multi_scale, read_sequence, save_ico,
+                              save_optimized_png, sequence_to_gif)
+
+#############################################################################
+##                                                                         ##
+## Pixel Forge Build                                                       ##
+## Copyright (C) 2024  Bluehatchet                                         ##
+##                                                                         ##
+## This program is free software: you can redistribute it and/or modify    ##
+## it under the terms of the GNU General Public License as published by    ##
+## the Free Software Foundation, either version 3 of the License, or       ##
+## (at your option) any later version.                                     ##
+##                                                                         ##
+## This program is distributed in the hope that it will be useful,         ##
+## but WITHOUT ANY WARRANTY; without even the implied warranty of          ##
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the           ##
+## GNU General Public License for more details.                            ##
+##                                                                         ##
+## You should have received a copy of the GNU General Public License       ##
+## along with this program.  If not, see <http://www.gnu.org/licenses/>.   ##
+##                                                                         ##
+#############################################################################
+
+# Incremental asset builds from a JSON manifest, run with
+# `python Pixel_Forge_Tools.py build assets.json`. Paths are relative to
+# the manifest:
+#
+#   {
+#     "sprites": {"octo": "Pixel Forge Projects/octo.json", ...},
+#     "sequences": {
+#       "drip": {"frames": ["teardrop_1", "teardrop_3", "frames/splash.png"], "duration": 80},
+#       "walk": {"pfseq": "walk.pfseq"}
+#     },
+#     "targets": {
+#       "octo": {"type": "png", "sprite": "octo", "output": "build/octo_{scale}x.png", "scales": [1, 4]},
+#       "octo_icon": {"type": "ico", "sprite": "octo", "output": "build/octo.ico", "sizes": [16, 32]},
+#       "drip": {"type": "gif", "sequence": "drip", "output": "build/drip.gif", "scale": 4},
+#       "sheet": {"type": "atlas", "sprites": ["octo", "flame"], "output": "build/sheet.png"}
+#     }
+#   }
+#
+# Sequence frames name sprites or PNG files. Every target may also set
+# "upscaler" (nearest, scale2x or xbr), and png and atlas targets
+# "optimize": true for the smallest PNGs (palette and bit depth reduction).
+#
+# Each sprite is composited once into a cache of PNGs named by the hash of
+# its project file, and targets are built from those. A target is rebuilt
+# only when the hash of its settings and inputs differs from its last
+# build; file hashes are only recomputed when mtime or size move, so a
+# build where nothing changed reads no file contents at all.
+
+TARGET_TYPES = ("png", "ico", "gif", "atlas")
+
+
+def _build_composite(project_path, cache_path):
+    from PIL import Image
+
+    pixels = IndexedProject(load_project(project_path)["layers"]).composite()
+    # Written under a temporary name first so a half-written file never looks cached
+    temp_path = f"{cache_path}.{os.getpid()}.tmp"
+    Image.fromarray(pixels, "RGBA").save(temp_path, format="PNG")
+    os.replace(temp_path, cache_path)
+
+
+def _read_pixels(path):
+    import numpy as np
+    from PIL import Image
+
+    with Image.open(path) as img:
+        return np.asarray(img.convert("RGBA"))
+
+
+def _build_png(composite_path, outputs, scales, upscaler, optimize):
+    from PIL import Image
+
+    for n, array in multi_scale(_read_pixels(composite_path), scales, upscaler).items():
+        if optimize:
+            save_optimized_png(outputs[scales.index(n)], array)
+        else:
+            Image.fromarray(array, "RGBA").save(outputs[scales.index(n)])
+
+
+def _build_ico(composite_path, output, sizes, upscaler):
+    save_ico(output, _read_pixels(composite_path), sizes, upscaler)
+
+
+def _build_gif(frames, output, scale, upscaler):
+    sequence_to_gif(frames, output, scale, upscaler)
+
+
+def _build_atlas(items, output, columns, padding, scale, upscaler, optimize):
+    # Sprites go into equal cells, row by row; the rectangles are written
+    # next to the sheet as JSON.
+    import numpy as np
+    from PIL import Image
+
+    sprites = [(name, multi_scale(_read_pixels(path), (scale,), upscaler)[scale]) for name, path in items]
+    cell_width = max(pixels.shape[1] for _, pixels in sprites) + padding
+    cell_height = max(pixels.shape[0] for _, pixels in sprites) + padding
+    columns = columns or math.ceil(math.sqrt(len(sprites)))
+    rows = math.ceil(len(sprites) / columns)
+    sheet = np.zeros((rows * cell_height - padding, columns * cell_width - padding, 4), dtype=np.uint8)
+    frames = {}
+    for n, (name, pixels) in enumerate(sprites):
+        y, x = n // columns * cell_height, n % columns * cell_width
+        height, width = pixels.shape[:2]
+        sheet[y:y + height, x:x + width] = pixels
+        frames[name] = {"x": x, "y": y, "w": width, "h": height}
+    if optimize:
+        save_optimized_png(output, sheet)
+    else:
+        Image.fromarray(sheet, "RGBA").save(output)
+    with open(os.path.splitext(output)[0] + ".json", 'w') as f:
+        json.dump({"image": os.path.basename(output), "size": [sheet.shape[1], sheet.shape[0]], "frames": frames}, f, indent=1)
+
+
+_BUILDERS = {"composite": _build_composite, "png": _build_png, "ico": _build_ico, "gif": _build_gif, "atlas": _build_atlas}
+
+
+def _run_node(kind, args, outputs):
+    start = time.perf_counter()
+    for path in outputs:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    _BUILDERS[kind](*args)
+    return time.perf_counter() - start
+
+
+class Node:
+    def __init__(self, name, kind, deps, key, args, outputs):
+        self.name = name
+        self.kind = kind
+        self.deps = deps  # names of the nodes this one reads
+        self.key = key  # hash of everything the outputs depend on
+        self.args = args
+        self.outputs = outputs
+        self.stale = True
+
+
+class Build:
+    """A manifest turned into a DAG of composite and target nodes."""
+
+    def __init__(self, manifest_path, workers=None, force=False, log=print):
+        self.base = os.path.dirname(os.path.abspath(manifest_path))
+        with open(manifest_path, 'r') as f:
+            self.manifest = json.load(f)
+        self.workers = workers
+        self.force = force
+        self.log = log
+        self.cache_dir = self.path(self.manifest.get("cache", ".pixelforge_cache"))
+        self.state_path = os.path.join(self.cache_dir, "state.json")
+        self.state = {"files": {}, "targets": {}}
+        if os.path.exists(self.state_path):
+            with open(self.state_path, 'r') as f:
+                self.state = json.load(f)
+        self.nodes = {}
+
+    def path(self, relative):
+        return os.path.normpath(os.path.join(self.base, relative))
+
+    def file_hash(self, path):
+        stat = os.stat(path)
+        cached = self.state["files"].get(path)
+        if cached and cached[:2] == [stat.st_mtime_ns, stat.st_size]:
+            return cached[2]
+        with open(path, 'rb') as f:
+            content_hash = hashlib.blake2b(f.read(), digest_size=16).hexdigest()
+        self.state["files"][path] = [stat.st_mtime_ns, stat.st_size, content_hash]
+        return content_hash
+
+    def sprite_node(self, name):
+        node_name = "sprite:" + name
+        if node_name not in self.nodes:
+            sprites = self.manifest.get("sprites", {})
+            if name not in sprites:
+                raise ValueError(f"unknown sprite {name!r}")
+            key = self.file_hash(self.path(sprites[name]))
+            cache_path = os.path.join(self.cache_dir, key + ".png")
+            self.nodes[node_name] = Node(node_name, "composite", [], key, (self.path(sprites[name]), cache_path), [cache_path])
+        return self.nodes[node_name]
+
+    def sequence_frames(self, name):
+        # [(node or file, duration)] for a named sequence
+        sequences = self.manifest.get("sequences", {})
+        if name not in sequences:
+            raise ValueError(f"unknown sequence {name!r}")
+        sequence = sequences[name]
+        if "pfseq" in sequence:
+            return [(png, duration) for png, duration in read_sequence(self.path(sequence["pfseq"]))]
+        durations = sequence.get("durations") or [sequence.get("duration", 100)] * len(sequence["frames"])
+        frames = []
+        for frame, duration in zip(sequence["frames"], durations):
+            if frame in self.manifest.get("sprites", {}):
+                frames.append((self.sprite_node(frame), duration))
+            else:
+                frames.append((self.path(frame), duration))
+        return frames
+
+    def target_node(self, name, spec):
+        kind = spec.get("type")
+        if kind not in TARGET_TYPES:
+            raise ValueError(f"target {name!r}: type must be one of {', '.join(TARGET_TYPES)}")
+        upscaler = spec.get("upscaler", "nearest")
+        if upscaler not in UPSCALERS:
+            raise ValueError(f"target {name!r}: unknown upscaler {upscaler!r}")
+        output = self.path(spec["output"])
+        inputs = []  # sprite nodes or (file path, hash)
+        if kind == "png":
+            scales = list(spec.get("scales", [1]))
+            if len(scales) > 1 and "{scale}" not in spec["output"]:
+                raise ValueError(f"target {name!r}: several scales need {{scale}} in the output name")
+            sprite = self.sprite_node(spec["sprite"])
+            inputs.append(sprite)
+            outputs = [output.replace("{scale}", str(n)) for n in scales]
+            args = (sprite.outputs[0], outputs, scales, upscaler, bool(spec.get("optimize")))
+        elif kind == "ico":
+            sprite = self.sprite_node(spec["sprite"])
+            inputs.append(sprite)
+            outputs = [output]
+            args = (sprite.outputs[0], output, list(spec.get("sizes", [16, 32, 48])), upscaler)
+        elif kind == "gif":
+            frames = []
+            for frame, duration in self.sequence_frames(spec["sequence"]):
+                if isinstance(frame, Node):
+                    inputs.append(frame)
+                    frames.append((frame.outputs[0], duration))
+                else:
+                    inputs.append((frame, self.file_hash(frame)))
+                    frames.append((frame, duration))
+            if "pfseq" in self.manifest["sequences"][spec["sequence"]]:
+                pfseq = self.path(self.manifest["sequences"][spec["sequence"]]["pfseq"])
+                inputs.append((pfseq, self.file_hash(pfseq)))
+            outputs = [output]
+            args = (frames, output, spec.get("scale", 1), upscaler)
+        else:
+            sprites = [self.sprite_node(sprite) for sprite in spec["sprites"]]
+            inputs += sprites
+            outputs = [output, os.path.splitext(output)[0] + ".json"]
+            args = ([(sprite_name, node.outputs[0]) for sprite_name, node in zip(spec["sprites"], sprites)],
+                    output, spec.get("columns"), spec.get("padding", 0), spec.get("scale", 1), upscaler,
+                    bool(spec.get("optimize")))
+        digest = hashlib.blake2b(json.dumps(spec, sort_keys=True).encode(), digest_size=16)
+        for item in inputs:
+            digest.update((item.key if isinstance(item, Node) else item[1]).encode())
+        deps = list(dict.fromkeys(item.name for item in inputs if isinstance(item, Node)))
+        return Node(name, kind, deps, digest.hexdigest(), args, outputs)
+
+    def plan(self):
+        """Build the DAG and mark every node whose outputs are out of date."""
+        for name, spec in self.manifest.get("targets", {}).items():
+            try:
+                self.nodes[name] = self.target_node(name, spec)
+            except KeyError as e:
+                raise ValueError(f"target {name!r}: missing {e}")
+        built = self.state["targets"]
+        needed = set()
+        for node in self.nodes.values():
+            if node.kind != "composite":
+                node.stale = self.force or built.get(node.name) != node.key or not all(map(os.path.exists, node.outputs))
+                if node.stale:
+                    needed.update(node.deps)
+        # Composites are only made for targets that are being rebuilt
+        for node in self.nodes.values():
+            if node.kind == "composite":
+                node.stale = node.name in needed and (self.force or not os.path.exists(node.outputs[0]))
+        return self.nodes
+
+    def run(self):
+        """Build stale nodes in parallel, each as soon as its inputs are ready.
+
+        Returns {node name: (status, seconds)} for the nodes that ran.
+        """
+        start = time.perf_counter()
+        self.plan()
+        stale = {name: node for name, node in self.nodes.items() if node.stale}
+        waiting = {name: {dep for dep in node.deps if dep in stale} for name, node in stale.items()}
+        results = {}
+        if stale:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with ProcessPoolExecutor(max_workers=self.workers) as pool:
+                running = {}
+
+                def submit_ready():
+                    for name in [name for name, deps in waiting.items() if not deps]:
+                        del waiting[name]
+                        node = stale[name]
+                        running[pool.submit(_run_node, node.kind, node.args, node.outputs)] = name
+
+                submit_ready()
+                while running:
+                    done, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        name = running.pop(future)
+                        try:
+                            results[name] = ("built", future.result())
+                            if stale[name].kind != "composite":
+                                self.state["targets"][name] = stale[name].key
+                        except Exception as e:
+                            results[name] = (f"failed: {e}", 0.0)
+                            self.state["targets"].pop(name, None)
+                            self.fail_dependents(name, waiting, results)
+                        for deps in waiting.values():
+                            deps.discard(name)
+                    submit_ready()
+        os.makedirs(self.cache_dir, exist_ok=True)
+        with open(self.state_path, 'w') as f:
+            json.dump(self.state, f)
+        self.report(results, time.perf_counter() - start)
+        return results
+
+    def fail_dependents(self, name, waiting, results):
+        for dependent in [other for other, deps in waiting.items() if name in deps]:
+            del waiting[dependent]
+            results[dependent] = (f"skipped: {name} failed", 0.0)
+            self.fail_dependents(dependent, waiting, results)
+
+    def report(self, results, seconds):
+        for name, (status, elapsed) in results.items():
+            if not name.startswith("sprite:") or status != "built":
+                self.log(f"  {status:<8} {name:<32}{elapsed * 1000:>9.1f} ms")
+        targets = [name for name in self.nodes if not name.startswith("sprite:")]
+        built = sum(1 for name in targets if results.get(name, ("",))[0] == "built")
+        failed = sum(1 for name in targets if name in results and results[name][0] != "built")
+        composites = sum(1 for name in results if name.startswith("sprite:"))
+        self.log(f"{len(targets)} targets: {built} built, {failed} failed, {len(targets) - built - failed} up to date "
+                 f"({composites} composites rendered) in {seconds * 1000:.1f} ms")
@@ -0,0 +1,1879 @@
+import hashlib
+import json
+import math
+import mmap
+import os
+import re
+import struct
+import tempfile
+import threading
+import zlib
+from collections import OrderedDict
+
+#############################################################################
+##                                                                         ##
+## Pixel Forge Core                                                        ##
+## Copyright (C) 2024  Bluehatchet                                         ##
+##                                                                         ##
+## This program is free software: you can redistribute it and/or modify    ##
+## it under the terms of the GNU General Public License as published by    ##
+## the Free Software Foundation, either version 3 of the License, or       ##
+## (at your option) any later version.                                     ##
+##                                                                         ##
+## This program is distributed in the hope that it will be useful,         ##
+## but WITHOUT ANY WARRANTY; without even the implied warranty of          ##
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the           ##
+## GNU General Public License for more details.                            ##
+##                                                                         ##
+## You should have received a copy of the GNU General Public License       ##
+## along with this program.  If not, see <http://www.gnu.org/licenses/>.   ##
+##                                                                         ##
+#############################################################################
+
+# Image work shared by the 16px and 32px editors that does not need a
+# window. PIL and numpy are imported inside the functions so that importing
+# this module costs nothing at editor startup.
+
+
+def rgb_to_hex(rgb):
+    return f"#{int(rgb[0]):02x}{int(rgb[1]):02x}{int(rgb[2]):02x}"
+
+
+def color_histogram(pixels, mask=None, exact_limit=None):
+    """Bucket RGB pixels into a 15-bit (5 bits per channel) histogram.
+
+    Returns (colors, counts, exact): the mean colour and pixel count of each
+    non-empty bucket, and whether every bucket holds a single exact colour
+    (true for almost all pixel art, which keeps its palette lossless). The
+    exactness check is skipped, returning False, when there are more than
+    `exact_limit` buckets.
+    """
+    import numpy as np
+
+    pixels = np.asarray(pixels)
+    pixels = pixels.reshape(-1, pixels.shape[-1])
+    channels = [pixels[:, channel].astype(np.uint32) for channel in range(3)]
+    keys = ((channels[0] >> 3) << 10) | ((channels[1] >> 3) << 5) | (channels[2] >> 3)
+    if mask is not None:
+        keys = np.where(np.asarray(mask).reshape(-1), keys, 1 << 15)  # masked-out pixels land in a spare bucket
+    counts = np.bincount(keys, minlength=(1 << 15) + 1)[:1 << 15]
+    occupied = np.flatnonzero(counts)
+    counts = counts[occupied]
+    check_exact = exact_limit is None or len(occupied) <= exact_limit
+    colors = np.empty((len(occupied), 3), dtype=np.float64)
+    exact = check_exact
+    for channel, values in enumerate(channels):
+        values = values.astype(np.float64)
+        sums = np.bincount(keys, weights=values, minlength=(1 << 15) + 1)[occupied]
+        colors[:, channel] = sums / counts
+        if check_exact:
+            squares = np.bincount(keys, weights=values * values, minlength=(1 << 15) + 1)[occupied]
+            exact = exact and bool(np.allclose(squares, sums * sums / counts))
+    return colors, counts, exact
+
+
+def quantize_pixels(pixels, colors, kmeans=0, mask=None):
+    """Median-cut palette of at most `colors` entries, as an (n, 3) uint8 array.
+
+    The cut runs over a colour histogram rather than individual pixels, so
+    the cost is one pass over the pixel array plus work proportional to the
+    number of distinct colours. `kmeans` runs that many k-means refinement
+    passes over the histogram afterwards.
+    """
+    import numpy as np
+
+    points, weights, exact = color_histogram(pixels, mask, exact_limit=colors)
+    if len(points) == 0:
+        return np.zeros((0, 3), dtype=np.uint8)
+    if exact and len(points) <= colors:
+        return np.rint(points).astype(np.uint8)
+
+    def box_error(members):
+        box = points[members]
+        mean = np.average(box, axis=0, weights=weights[members])
+        return float((weights[members, None] * (box - mean) ** 2).sum())
+
+    boxes = [(box_error(np.arange(len(points))), np.arange(len(points)))]
+    while len(boxes) < colors:
+        # Split the box with the largest weighted error along its widest axis.
+        candidates = [item for item in boxes if len(item[1]) > 1]
+        if not candidates:
+            break
+        target = max(candidates, key=lambda item: item[0])
+        boxes.remove(target)
+        members = target[1]
+        box = points[members]
+        axis = int(np.argmax(box.max(axis=0) - box.min(axis=0)))
+        order = members[np.argsort(box[:, axis], kind="stable")]
+        cumulative = np.cumsum(weights[order])
+        split = int(np.searchsorted(cumulative, cumulative[-1] / 2))
+        split = min(max(split, 0), len(order) - 2) + 1
+        boxes.append((box_error(order[:split]), order[:split]))
+        boxes.append((box_error(order[split:]), order[split:]))
+
+    palette = np.array([np.average(points[members], axis=0, weights=weights[members]) for _, members in boxes])
+    for _ in range(kmeans):
+        assignment = nearest_palette_indices(points, palette)
+        totals = np.bincount(assignment, weights=weights, minlength=len(palette))
+        for channel in range(3):
+            sums = np.bincount(assignment, weights=weights * points[:, channel], minlength=len(palette))
+            palette[:, channel] = np.where(totals > 0, sums / np.maximum(totals, 1), palette[:, channel])
+    return np.unique(np.rint(palette).astype(np.uint8), axis=0)
+
+
+def nearest_palette_indices(pixels, palette):
+    """Index of the closest palette colour for each row of an (N, 3) array."""
+    import numpy as np
+
+    diff = pixels[:, None, :].astype(np.float64) - palette[None, :, :].astype(np.float64)
+    return (diff * diff).sum(axis=2).argmin(axis=1)
+
+
+def image_to_layer(image, grid_size, colors=16, downscale=True, kmeans=0, alpha_threshold=128, palette=None):
+    """Turn a PIL image into editor layer rows plus the palette used.
+
+    The palette is computed from every opaque pixel of the full image
+    (unless one is given, e.g. shared by every cell of a sprite sheet), then
+    the image is either box-downscaled to the grid or cropped to it and each
+    grid cell is mapped to its nearest palette colour. Cells below
+    `alpha_threshold` become transparent (None).
+    """
+    from PIL import Image
+    import numpy as np
+
+    rgba = image.convert("RGBA")
+    if palette is None:
+        full = np.asarray(rgba)
+        palette = quantize_pixels(full, colors, kmeans, mask=full[..., 3] >= alpha_threshold)
+
+    if downscale and rgba.size != (grid_size, grid_size):
+        # Premultiplied so transparent pixels do not bleed their colour in.
+        small = rgba.convert("RGBa").resize((grid_size, grid_size), Image.BOX).convert("RGBA")
+    else:
+        small = Image.new("RGBA", (grid_size, grid_size), (0, 0, 0, 0))
+        small.paste(rgba.crop((0, 0, min(rgba.width, grid_size), min(rgba.height, grid_size))), (0, 0))
+
+    cells = np.asarray(small).reshape(-1, 4)
+    opaque = cells[:, 3] >= alpha_threshold
+    hex_palette = [rgb_to_hex(color) for color in palette]
+    flat = [None] * (grid_size * grid_size)
+    used = []
+    if len(palette) and opaque.any():
+        indices = nearest_palette_indices(cells[opaque, :3], palette)
+        for position, index in zip(np.flatnonzero(opaque).tolist(), indices.tolist()):
+            flat[position] = hex_palette[index]
+        used = [hex_palette[index] for index in np.unique(indices).tolist()]
+    data = [flat[row * grid_size:(row + 1) * grid_size] for row in range(grid_size)]
+    return data, used
+
+
+def _mask_runs(mask):
+    # (rows, starts, ends) of every horizontal run of True, in reading order
+    import numpy as np
+
+    height, width = mask.shape
+    padded = np.zeros((height, width + 2), dtype=np.int8)
+    padded[:, 1:-1] = mask
+    edges = np.diff(padded, axis=1)
+    # Every run starts (+1) and then ends (-1) on the same row
+    rows, columns = np.nonzero(edges)
+    return rows[::2], columns[::2], columns[1::2]
+
+
+def _run_labels(rows, starts, ends, width):
+    # Label the runs of _mask_runs by 8-connected component. Runs touch when
+    # they are on neighbouring rows and overlap or meet at a corner; the
+    # components are found by hooking roots onto the smallest neighbouring
+    # root and halving paths until nothing changes, all in whole-array steps.
+    import numpy as np
+
+    count = len(rows)
+    pitch = width + 2
+    start_keys = rows * pitch + starts
+    end_keys = rows * pitch + ends
+    below = (rows + 1) * pitch
+    first = np.searchsorted(end_keys, below + starts, "left")
+    last = np.searchsorted(start_keys, below + ends, "right")
+    counts = np.maximum(last - first, 0)
+    upper = np.repeat(np.arange(count), counts)
+    lower = np.repeat(first - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+    parent = np.arange(count)
+    while True:
+        a, b = parent[upper], parent[lower]
+        apart = a != b
+        if not apart.any():
+            break
+        a, b = a[apart], b[apart]
+        np.minimum.at(parent, np.maximum(a, b), np.minimum(a, b))
+        while True:
+            grand = parent[parent]
+            if np.array_equal(grand, parent):
+                break
+            parent = grand
+    return np.unique(parent, return_inverse=True)[1]
+
+
+def parse_cell_size(text):
+    """(width, height) from "32" or "32x48"."""
+    parts = text.lower().replace(" ", "").split("x")
+    try:
+        size = [int(part) for part in parts]
+    except ValueError:
+        size = []
+    if len(size) not in (1, 2) or min(size) < 1:
+        raise ValueError(f"cell size must look like 32 or 32x48, not {text!r}")
+    return (size[0], size[-1])
+
+
+def sheet_boxes(pixels, cell=None, spacing=0, margin=0, gap=0, min_pixels=1):
+    """(x, y, width, height) of every sprite on an RGBA sheet, in reading order.
+
+    With cell=(width, height) the sheet is cut on a grid, `margin` pixels in
+    from the top left with `spacing` between cells. Otherwise every
+    8-connected region of visible pixels is a sprite, and regions up to
+    `gap` pixels apart are counted as one. Cells and regions with fewer than
+    `min_pixels` visible pixels are dropped.
+    """
+    import numpy as np
+
+    solid = pixels[..., 3] > 0
+    height, width = solid.shape
+    if cell is not None:
+        cell_width, cell_height = cell
+        if cell_width < 1 or cell_height < 1 or spacing < 0 or margin < 0:
+            raise ValueError("cells need a positive size, and spacing and margin cannot be negative")
+        pitch_x, pitch_y = cell_width + spacing, cell_height + spacing
+        columns = max(0, (width - margin + spacing) // pitch_x)
+        rows = max(0, (height - margin + spacing) // pitch_y)
+        # The last row and column have no spacing after them; pad it in
+        grid = np.zeros((rows * pitch_y, columns * pitch_x), dtype=bool)
+        part = solid[margin:margin + rows * pitch_y, margin:margin + columns * pitch_x]
+        grid[:part.shape[0], :part.shape[1]] = part
+        filled = grid.reshape(rows, pitch_y, columns, pitch_x)[:, :cell_height, :, :cell_width].sum(axis=(1, 3))
+        return [(margin + column * pitch_x, margin + row * pitch_y, cell_width, cell_height)
+                for row, column in np.argwhere(filled >= max(min_pixels, 1)).tolist()]
+
+    rows, starts, ends = _mask_runs(solid)
+    if not len(rows):
+        return []
+    if gap > 0:
+        # Grown right and down by gap, nearby regions meet; the runs of the
+        # real pixels then take the label of the grown run they fall in
+        grown = solid.copy()
+        for step in range(1, min(gap, width - 1) + 1):
+            grown[:, step:] |= solid[:, :-step]
+        wide = grown.copy()
+        for step in range(1, min(gap, height - 1) + 1):
+            grown[step:] |= wide[:-step]
+        grown_rows, grown_starts, grown_ends = _mask_runs(grown)
+        owner = np.searchsorted(grown_rows * (width + 2) + grown_starts, rows * (width + 2) + starts, "right") - 1
+        labels = _run_labels(grown_rows, grown_starts, grown_ends, width)[owner]
+    else:
+        labels = _run_labels(rows, starts, ends, width)
+    regions = labels.max() + 1
+    x0 = np.full(regions, width)
+    y0 = np.full(regions, height)
+    x1 = np.zeros(regions, dtype=np.int64)
+    y1 = np.zeros(regions, dtype=np.int64)
+    np.minimum.at(x0, labels, starts)
+    np.minimum.at(y0, labels, rows)
+    np.maximum.at(x1, labels, ends)
+    np.maximum.at(y1, labels, rows + 1)
+    area = np.bincount(labels, weights=ends - starts, minlength=regions)
+    keep = np.flatnonzero(area >= min_pixels)
+    boxes = sorted(zip(y0[keep].tolist(), x0[keep].tolist(), y1[keep].tolist(), x1[keep].tolist()))
+    # Reading order: boxes that overlap vertically share a row, left to right
+    ordered = []
+    band = []
+    bottom = -1
+    for top, left, low, right in boxes:
+        if band and top >= bottom:
+            ordered += sorted(band)
+            band = []
+        band.append((left, top, right - left, low - top))
+        bottom = max(bottom, low) if len(band) > 1 else low
+    return ordered + sorted(band)
+
+
+def slice_sheet(image, cell=None, spacing=0, margin=0, gap=0, min_pixels=1, uniform=False):
+    """[(box, RGBA image)] for the sprites of a sheet; see sheet_boxes.
+
+    With uniform=True every sprite is padded to the size of the largest,
+    centred and standing on the bottom edge, so they line up as frames.
+    """
+    from PIL import Image
+    import numpy as np
+
+    rgba = image.convert("RGBA")
+    boxes = sheet_boxes(np.asarray(rgba), cell, spacing, margin, gap, min_pixels)
+    sprites = [((x, y, w, h), rgba.crop((x, y, x + w, y + h))) for x, y, w, h in boxes]
+    if uniform and sprites:
+        width = max(w for (_, _, w, _), _ in sprites)
+        height = max(h for (_, _, _, h), _ in sprites)
+        for n, (box, sprite) in enumerate(sprites):
+            if sprite.size != (width, height):
+                frame = Image.new("RGBA", (width, height), (0, 0, 0, 0))
+                frame.paste(sprite, ((width - sprite.width) // 2, height - sprite.height))
+                sprites[n] = (box, frame)
+    return sprites
+
+
+def parse_color(color):
+    """(r, g, b) for a colour string; plain #rrggbb is parsed without PIL."""
+    if color.startswith('#') and len(color) == 7:
+        return (int(color[1:3], 16), int(color[3:5], 16), int(color[5:7], 16))
+    from PIL import ImageColor
+    return ImageColor.getrgb(color)[:3]
+
+
+def normalize_color(color):
+    return rgb_to_hex(parse_color(color))
+
+
+def natural_sort_key(path):
+    """Sort key that orders frame_2.png before frame_11.png."""
+    return [int(part) if part.isdigit() else part.lower() for part in re.split(r"(\d+)", path)]
+
+
+def normalize_project(project_data):
+    """Project dict in the editor's current format.
+
+    Older projects (like those in "Pixel Forge Projects") stored a single
+    "grid_data" grid instead of a list of layers.
+    """
+    if "layers" in project_data:
+        layers = project_data["layers"]
+    else:
+        layers = [{"data": project_data["grid_data"], "visible": True, "opacity": 1.0}]
+    return {"layers": layers, "last_colors": project_data.get("last_colors", [])}
+
+
+def load_project(file_path):
+    """Read a project, resolving layers kept in a shared block store.
+
+    When blocks were used, the store's directory comes back as
+    project["block_store"] so a later save can write into it again.
+    """
+    with open(file_path, 'r') as f:
+        project_data = json.load(f)
+    root = project_data.get("block_store")
+    project = normalize_project(expand_project(project_data, file_path))
+    if root:
+        project["block_store"] = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(file_path)), root))
+    return project
+
+
+def expand_project(project_data, file_path, confine_to=None):
+    """Project dict with layers from a block store read back into plain grids.
+
+    With confine_to, a store outside that directory is refused (ValueError),
+    for projects that come from someone else, as in the render server.
+    """
+    if "block_store" not in project_data:
+        return project_data
+    root = project_data["block_store"]
+    if not isinstance(root, str):
+        raise ValueError("block_store must be a path")
+    root = os.path.join(os.path.dirname(os.path.abspath(file_path)), root)
+    if confine_to is not None:
+        root, confine_to = os.path.realpath(root), os.path.realpath(confine_to)
+        if os.path.commonpath([root, confine_to]) != confine_to:
+            raise ValueError("block store is outside the served directory")
+    store = block_store(root)
+    expanded = {key: value for key, value in project_data.items() if key != "block_store"}
+    expanded["layers"] = [{**{key: value for key, value in layer.items() if key != "blocks"},
+                           "data": store.unpack_layer(layer["blocks"])} if "blocks" in layer else layer
+                          for layer in project_data["layers"]]
+    return expanded
+
+
+def pack_project(project_data, file_path, store_root):
+    """Project dict with every layer's grid replaced by block hashes in store_root.
+
+    Keys the editor does not know about are kept as they are.
+    """
+    project_data = expand_project(project_data, file_path)
+    store = block_store(store_root)
+    packed = {key: value for key, value in project_data.items() if key != "grid_data"}
+    packed["layers"] = [{**{key: value for key, value in layer.items() if key != "data"},
+                         "blocks": store.pack_layer(layer["data"])}
+                        for layer in normalize_project(project_data)["layers"]]
+    packed["block_store"] = os.path.relpath(store_root, os.path.dirname(os.path.abspath(file_path)))
+    return packed
+
+
+def save_project_file(file_path, layers, last_colors=(), store_root=None):
+    project_data = {"layers": layers, "last_colors": list(last_colors)}
+    if store_root:
+        project_data = pack_project(project_data, file_path, store_root)
+    with open(file_path, 'w') as f:
+        json.dump(project_data, f)
+
+
+class BlockStore:
+    """Layer grids cut into square blocks, each distinct block stored once.
+
+    A project saved against a store lists block hashes instead of cells, so
+    near-copies of a sprite share every block they have in common. Blocks
+    are never modified: an edited layer gets new blocks for the parts that
+    changed when it is saved, and projects still using the old ones keep them.
+    """
+
+    block_size = 8
+    max_cached = 4096  # blocks kept parsed in memory
+
+    def __init__(self, root):
+        self.root = root
+        self.cache = OrderedDict()  # block hash -> rows as tuples, least recently used first
+
+    def _path(self, block_hash):
+        # Hashes come from project files; anything but 32 hex digits could reach outside the store
+        if not isinstance(block_hash, str) or not re.fullmatch(r"[0-9a-f]{32}", block_hash):
+            raise ValueError(f"not a block hash: {block_hash!r}")
+        return os.path.join(self.root, block_hash[:2], block_hash + ".json")
+
+    def _remember(self, block_hash, rows):
+        self.cache[block_hash] = rows
+        self.cache.move_to_end(block_hash)
+        if len(self.cache) > self.max_cached:
+            self.cache.popitem(last=False)
+
+    def put(self, rows):
+        text = json.dumps(rows, separators=(",", ":"))
+        block_hash = hashlib.blake2b(text.encode(), digest_size=16).hexdigest()
+        if block_hash not in self.cache:
+            path = self._path(block_hash)
+            if not os.path.exists(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                # Written under a temporary name so readers never see half a block
+                temp_path = f"{path}.{os.getpid()}.tmp"
+                with open(temp_path, 'w') as f:
+                    f.write(text)
+                os.replace(temp_path, path)
+        self._remember(block_hash, tuple(tuple(row) for row in rows))
+        return block_hash
+
+    def get(self, block_hash):
+        rows = self.cache.get(block_hash)
+        if rows is None:
+            with open(self._path(block_hash), 'r') as f:
+                rows = tuple(tuple(row) for row in json.load(f))
+        self._remember(block_hash, rows)
+        return rows
+
+    def pack_layer(self, data):
+        size = self.block_size
+        height = len(data)
+        width = len(data[0]) if height else 0
+        blocks = [[self.put([row[x:x + size] for row in data[y:y + size]]) for x in range(0, width, size)]
+                  for y in range(0, height, size)]
+        return {"width": width, "height": height, "block_size": size, "blocks": blocks}
+
+    def unpack_layer(self, ref):
+        # Fresh lists every time, so editing the result never touches the cache
+        size = ref["block_size"]
+        data = [[None] * ref["width"] for _ in range(ref["height"])]
+        for by, hashes in enumerate(ref["blocks"]):
+            for bx, block_hash in enumerate(hashes):
+                for dy, cells in enumerate(self.get(block_hash)):
+                    data[by * size + dy][bx * size:bx * size + len(cells)] = cells
+        return data
+
+
+_block_stores = {}
+
+
+def block_store(root):
+    """Shared BlockStore for a directory, so its cache outlives single loads."""
+    root = os.path.normpath(os.path.abspath(root))
+    if root not in _block_stores:
+        _block_stores[root] = BlockStore(root)
+    return _block_stores[root]
+
+
+class IndexedProject:
+    """A project's layers as palette indices, ready for vectorized passes.
+
+    Every distinct colour string gets an index (0 is transparent), so a
+    recolour is a lookup-table change and compositing is a handful of
+    array operations per layer instead of a Python loop per cell.
+    """
+
+    def __init__(self, layers):
+        import numpy as np
+
+        codes = {}
+        height = len(layers[0]["data"]) if layers else 0
+        width = len(layers[0]["data"][0]) if height else 0
+        self.indices = np.zeros((len(layers), height, width), dtype=np.uint16)
+        for n, layer in enumerate(layers):
+            flat = [codes.setdefault(color, len(codes) + 1) if color else 0
+                    for row in layer["data"] for color in row]
+            self.indices[n] = np.array(flat, dtype=np.uint16).reshape(height, width)
+        self.colors = list(codes)
+        self.palette = np.zeros((len(codes) + 1, 3), dtype=np.uint8)
+        for color, index in codes.items():
+            self.palette[index] = parse_color(color)
+        self.visible = [layer["visible"] for layer in layers]
+        self.opacity = [layer.get("opacity", 1.0) for layer in layers]
+
+    def composite(self, palette=None):
+        """(H, W, 4) uint8 composite, pixel-identical to the editor export."""
+        import numpy as np
+
+        palette = self.palette if palette is None else palette
+        height, width = self.indices.shape[1:]
+        out = np.zeros((height, width, 4), dtype=np.uint8)
+        for n, layer_indices in enumerate(self.indices):
+            if not self.visible[n]:
+                continue
+            # Same truncation as int(c * opacity) in the editor
+            lut = np.zeros((len(palette), 4), dtype=np.uint8)
+            lut[:, :3] = (palette.astype(np.float64) * self.opacity[n]).astype(np.uint8)
+            lut[:, 3] = int(255 * self.opacity[n])
+            mask = layer_indices > 0
+            out[mask] = lut[layer_indices[mask]]
+        return out
+
+    def remapped_palette(self, mapping):
+        """Palette with `mapping` ({colour: colour}) applied to the source colours."""
+        lookup = {normalize_color(src): parse_color(dst) for src, dst in mapping.items()}
+        palette = self.palette.copy()
+        for index, color in enumerate(self.colors, start=1):
+            target = lookup.get(normalize_color(color))
+            if target is not None:
+                palette[index] = target
+        return palette
+
+    def recolor(self, mapping, per_layer=True):
+        """Composite with a colour mapping applied.
+
+        per_layer maps the layers' own colours before opacity is applied;
+        otherwise the mapping is a lookup pass over the finished composite.
+        """
+        if per_layer:
+            return self.composite(self.remapped_palette(mapping))
+        return recolor_pixels(self.composite(), mapping)
+
+
+def recolor_pixels(pixels, mapping):
+    """Apply {colour: colour} to the RGB of every pixel of an (H, W, 4) array."""
+    import numpy as np
+
+    packed = (pixels[..., 0].astype(np.uint32) << 16) | (pixels[..., 1].astype(np.uint32) << 8) | pixels[..., 2]
+    unique, inverse = np.unique(packed, return_inverse=True)
+    lut = np.stack([(unique >> 16) & 255, (unique >> 8) & 255, unique & 255], axis=1).astype(np.uint8)
+    for src, dst in mapping.items():
+        r, g, b = parse_color(src)
+        hit = np.flatnonzero(unique == ((r << 16) | (g << 8) | b))
+        if len(hit):
+            lut[hit[0]] = parse_color(dst)
+    out = pixels.copy()
+    out[..., :3] = lut[inverse.reshape(packed.shape)]
+    return out
+
+
+def layer_pixels(data):
+    """(H, W, 4) uint8 array of a layer grid; empty cells are transparent."""
+    import numpy as np
+
+    codes = {}
+    flat = [codes.setdefault(color, len(codes) + 1) if color else 0 for row in data for color in row]
+    lut = np.zeros((len(codes) + 1, 4), dtype=np.uint8)
+    for color, index in codes.items():
+        lut[index] = parse_color(color) + (255,)
+    return lut[np.array(flat, dtype=np.intp)].reshape(len(data), len(data[0]) if data else 0, 4)
+
+
+def _shifted(mask, dx, dy):
+    # mask moved by (dx, dy), with False shifted in at the edges
+    import numpy as np
+
+    out = np.zeros_like(mask)
+    height, width = mask.shape
+    out[max(dy, 0):height + min(dy, 0), max(dx, 0):width + min(dx, 0)] = \
+        mask[max(-dy, 0):height - max(dy, 0), max(-dx, 0):width - max(dx, 0)]
+    return out
+
+
+def outline_pixels(pixels, color, diagonal=False):
+    """Paint color on every transparent pixel next to an opaque one, 4- or 8-connected."""
+    solid = pixels[..., 3] > 0
+    steps = [(1, 0), (-1, 0), (0, 1), (0, -1)]
+    if diagonal:
+        steps += [(1, 1), (1, -1), (-1, 1), (-1, -1)]
+    ring = ~solid
+    grown = solid.copy()
+    for dx, dy in steps:
+        grown |= _shifted(solid, dx, dy)
+    out = pixels.copy()
+    out[grown & ring] = parse_color(color) + (255,)
+    return out
+
+
+def shadow_pixels(pixels, color, dx=1, dy=1):
+    """Drop shadow: the sprite's silhouette moved by (dx, dy), behind the sprite."""
+    solid = pixels[..., 3] > 0
+    out = pixels.copy()
+    out[_shifted(solid, dx, dy) & ~solid] = parse_color(color) + (255,)
+    return out
+
+
+def bayer_matrix(size):
+    """size x size ordered-dither thresholds in [0, 1); size is a power of two."""
+    import numpy as np
+
+    matrix = np.zeros((1, 1), dtype=np.int64)
+    while matrix.shape[0] < size:
+        matrix = np.block([[4 * matrix, 4 * matrix + 2], [4 * matrix + 3, 4 * matrix + 1]])
+    return matrix / matrix.size
+
+
+def dither_pixels(pixels, palette, size=4, spread=64):
+    """Ordered (Bayer) dither of the opaque pixels onto palette colours.
+
+    Each pixel is nudged by its tiled threshold, scaled to +/- spread/2,
+    before picking the nearest palette colour, so flat areas between two
+    palette colours become a regular checker of both.
+    """
+    import numpy as np
+
+    if not palette:
+        raise ValueError("dithering needs at least one palette colour")
+    height, width = pixels.shape[:2]
+    colors = np.array([parse_color(color) for color in palette], dtype=np.float64)
+    thresholds = np.tile(bayer_matrix(size), (-(-height // size), -(-width // size)))[:height, :width]
+    solid = pixels[..., 3] > 0
+    nudged = pixels[..., :3].astype(np.float64) + ((thresholds - 0.5) * spread)[..., None]
+    out = pixels.copy()
+    out[solid, :3] = colors[nearest_palette_indices(nudged[solid], colors)].astype(np.uint8)
+    return out
+
+
+def shade_pixels(pixels, ramp, dx=-1, dy=-1):
+    """Shade along a colour ramp (darkest first), lit from the (dx, dy) direction.
+
+    Pixels whose colour is on the ramp step one colour lighter where the
+    neighbour towards the light is transparent, and one darker where the
+    neighbour away from it is. Colours not on the ramp are left alone.
+    """
+    import numpy as np
+
+    if len(ramp) < 2:
+        raise ValueError("a shading ramp needs at least two colours")
+    colors = np.array([parse_color(color) for color in ramp], dtype=np.uint8)
+    solid = pixels[..., 3] > 0
+    keys = (pixels[..., :3].astype(np.int64) * [1 << 16, 1 << 8, 1]).sum(axis=2)
+    ramp_keys = (colors.astype(np.int64) * [1 << 16, 1 << 8, 1]).sum(axis=1)
+    on_ramp = solid & np.isin(keys, ramp_keys)
+    step = np.argmax(keys[..., None] == ramp_keys, axis=2)
+    # A neighbour towards the light that is empty means this pixel faces it
+    lit = on_ramp & ~_shifted(solid, -dx, -dy)
+    dark = on_ramp & ~_shifted(solid, dx, dy)
+    step = np.clip(step + lit - dark, 0, len(ramp) - 1)
+    out = pixels.copy()
+    out[on_ramp, :3] = colors[step[on_ramp]]
+    return out
+
+
+LAYER_FILTERS = {"outline": outline_pixels, "shadow": shadow_pixels, "dither": dither_pixels, "shade": shade_pixels}
+
+
+def filter_layer(data, name, region=None, **options):
+    """Run a LAYER_FILTERS filter over a layer grid.
+
+    Returns the new grid and the (x0, y0, x1, y1) box of cells that
+    changed (None if nothing did). Only cells inside region change, when
+    it is given; unchanged cells keep their original colour strings.
+    """
+    import numpy as np
+
+    if name not in LAYER_FILTERS:
+        raise ValueError(f"unknown filter {name!r}; choose from {', '.join(LAYER_FILTERS)}")
+    before = layer_pixels(data)
+    after = LAYER_FILTERS[name](before, **options)
+    changed = (before != after).any(axis=2)
+    if region is not None:
+        x0, y0, x1, y1 = region
+        inside = np.zeros_like(changed)
+        inside[y0:y1, x0:x1] = True
+        changed &= inside
+    ys, xs = np.nonzero(changed)
+    if not len(ys):
+        return [row[:] for row in data], None
+    box = (int(xs.min()), int(ys.min()), int(xs.max()) + 1, int(ys.max()) + 1)
+    result = [row[:] for row in data]
+    for y, x in zip(ys.tolist(), xs.tolist()):
+        result[y][x] = rgb_to_hex(after[y, x, :3]) if after[y, x, 3] else None
+    return result, box
+
+
+def pixels_to_image(pixels, scale=1):
+    from PIL import Image
+
+    image = Image.fromarray(pixels, "RGBA")
+    if scale != 1:
+        image = image.resize((image.width * scale, image.height * scale), Image.NEAREST)
+    return image
+
+
+ICO_SIZES = (16, 24, 32, 48, 64, 128, 256)
+EXPORT_PRESETS = {
+    "Store listing": {"scales": (1, 2, 4, 8, 16), "ico_sizes": ()},
+    "UI icons": {"scales": (1, 2), "ico_sizes": ICO_SIZES},
+}
+
+
+def scale2x(pixels):
+    """EPX / Scale2x: (H, W, 4) uint8 -> (2H, 2W, 4), keeping edges hard.
+
+    Only copies pixels around, so it works on any (H, W, C) array,
+    palette indices included.
+    """
+    import numpy as np
+
+    padded = np.pad(pixels, ((1, 1), (1, 1), (0, 0)), mode="edge")
+    above, below = padded[:-2, 1:-1], padded[2:, 1:-1]
+    left, right = padded[1:-1, :-2], padded[1:-1, 2:]
+    al = (above == left).all(axis=2)
+    ar = (above == right).all(axis=2)
+    bl = (below == left).all(axis=2)
+    br = (below == right).all(axis=2)
+    height, width = pixels.shape[:2]
+    out = np.empty((height * 2, width * 2) + pixels.shape[2:], dtype=pixels.dtype)
+    out[0::2, 0::2] = np.where((al & ~bl & ~ar)[..., None], above, pixels)
+    out[0::2, 1::2] = np.where((ar & ~al & ~br)[..., None], right, pixels)
+    out[1::2, 0::2] = np.where((bl & ~br & ~al)[..., None], left, pixels)
+    out[1::2, 1::2] = np.where((br & ~ar & ~bl)[..., None], below, pixels)
+    return out
+
+
+def _xbr_corner(pixels):
+    # Bottom-right quarter of each pixel, after 2xBR level 1: weigh the
+    # colour differences across the two diagonals of the 4x4 neighbourhood
+    # and, where an edge runs along the anti-diagonal, blend the corner
+    # halfway towards the closer of the two pixels it runs between.
+    import numpy as np
+
+    rgba = pixels.astype(np.float32)
+    yuva = np.stack([
+        0.299 * rgba[..., 0] + 0.587 * rgba[..., 1] + 0.114 * rgba[..., 2],
+        -0.169 * rgba[..., 0] - 0.331 * rgba[..., 1] + 0.5 * rgba[..., 2],
+        0.5 * rgba[..., 0] - 0.419 * rgba[..., 1] - 0.081 * rgba[..., 2],
+        rgba[..., 3],
+    ], axis=-1)
+    padded = np.pad(yuva, ((2, 2), (2, 2), (0, 0)), mode="edge")
+    height, width = pixels.shape[:2]
+
+    def at(dy, dx):
+        return padded[2 + dy:2 + dy + height, 2 + dx:2 + dx + width]
+
+    def distance(a, b):
+        diff = np.abs(a - b)
+        return 48 * diff[..., 0] + 7 * diff[..., 1] + 6 * diff[..., 2] + 48 * diff[..., 3]
+
+    e, f, h, i = at(0, 0), at(0, 1), at(1, 0), at(1, 1)
+    edge_weight = (distance(e, at(-1, 1)) + distance(e, at(1, -1)) + distance(i, at(0, 2))
+                   + distance(i, at(2, 0)) + 4 * distance(h, f))
+    cross_weight = (distance(h, at(0, -1)) + distance(h, at(2, 1)) + distance(f, at(-1, 0))
+                    + distance(f, at(1, 2)) + 4 * distance(e, i))
+    padded_rgba = np.pad(rgba, ((0, 1), (0, 1), (0, 0)), mode="edge")
+    towards = np.where((distance(e, f) <= distance(e, h))[..., None],
+                       padded_rgba[:-1, 1:], padded_rgba[1:, :-1])
+    corner = np.where((edge_weight < cross_weight)[..., None], (rgba + towards) / 2, rgba)
+    return np.rint(corner).astype(np.uint8)
+
+
+def xbr2x(pixels):
+    """xBR-style 2x upscale: (H, W, 4) uint8 -> (2H, 2W, 4) with smoothed diagonals."""
+    import numpy as np
+
+    height, width = pixels.shape[:2]
+    out = np.empty((height * 2, width * 2, 4), dtype=np.uint8)
+    # Each corner is the bottom-right rule applied to a mirrored image
+    out[1::2, 1::2] = _xbr_corner(pixels)
+    out[1::2, 0::2] = _xbr_corner(pixels[:, ::-1])[:, ::-1]
+    out[0::2, 1::2] = _xbr_corner(pixels[::-1])[::-1]
+    out[0::2, 0::2] = _xbr_corner(pixels[::-1, ::-1])[::-1, ::-1]
+    return out
+
+
+UPSCALERS = {"nearest": None, "scale2x": scale2x, "xbr": xbr2x}
+
+
+def multi_scale(pixels, scales, upscaler="nearest"):
+    """Return {scale: (H*scale, W*scale, 4) array} for integer scales.
+
+    A 2x upscaler is applied for each factor of two in the scale and nearest
+    neighbour covers the rest; intermediate results are shared, so 16x costs
+    one more pass on top of 8x.
+    """
+    if upscaler not in UPSCALERS:
+        raise ValueError(f"unknown upscaler {upscaler!r}; choose from {', '.join(UPSCALERS)}")
+    if any(n < 1 for n in scales):
+        raise ValueError("scales must be positive integers")
+    step = UPSCALERS[upscaler]
+    cache = {1: pixels}
+
+    def scaled(n):
+        if n not in cache:
+            power = n & -n if step else 1  # largest power of two dividing n
+            if power == n:
+                cache[n] = step(scaled(n // 2))
+            else:
+                repeat = n // power
+                cache[n] = scaled(power).repeat(repeat, axis=0).repeat(repeat, axis=1)
+        return cache[n]
+
+    return {n: scaled(n) for n in scales}
+
+
+def export_matrix(pixels, base_path, scales=(1,), ico_sizes=(), upscaler="nearest", optimize=False):
+    """Write base_path_<n>x.png for every scale and base_path.ico from one composite.
+
+    ICO sizes that are a whole multiple of the sprite come from the same
+    scaled images; other sizes are resampled from the nearest larger one.
+    With optimize the PNGs are size-optimized (see encode_png). Returns
+    the paths written.
+    """
+    import numpy as np
+
+    base_path = os.path.splitext(base_path)[0]
+    images = _scaled_images(pixels, scales, ico_sizes, upscaler)
+    written = []
+    for n in sorted(set(scales)):
+        path = f"{base_path}_{n}x.png"
+        if optimize:
+            save_optimized_png(path, np.asarray(images[n]))
+        else:
+            images[n].save(path)
+        written.append(path)
+    if ico_sizes:
+        path = base_path + ".ico"
+        _save_ico(path, images, ico_sizes, max(pixels.shape[:2]))
+        written.append(path)
+    return written
+
+
+def _scaled_images(pixels, scales, ico_sizes, upscaler):
+    from PIL import Image
+
+    side = max(pixels.shape[:2])
+    ico_scales = {max(1, math.ceil(size / side)) for size in ico_sizes}
+    return {n: Image.fromarray(array, "RGBA")
+            for n, array in multi_scale(pixels, sorted(set(scales) | ico_scales), upscaler).items()}
+
+
+def _save_ico(target, images, ico_sizes, side):
+    from PIL import Image
+
+    icons = []
+    for size in sorted(set(ico_sizes)):
+        source = images[max(1, math.ceil(size / side))]
+        icons.append(source if source.size == (size, size) else source.resize((size, size), Image.NEAREST))
+    # Pillow takes the largest image as the base and uses the others as given
+    icons[-1].save(target, format="ICO", sizes=[icon.size for icon in icons], append_images=icons[:-1])
+
+
+def save_ico(target, pixels, ico_sizes, upscaler="nearest"):
+    """Write an ICO with every size in ico_sizes from an (H, W, 4) composite."""
+    if not ico_sizes:
+        raise ValueError("no ICO sizes requested")
+    _save_ico(target, _scaled_images(pixels, (), ico_sizes, upscaler), ico_sizes, max(pixels.shape[:2]))
+
+
+def save_gif(target, images, durations):
+    """Write an animated GIF the way the animator does.
+
+    images and durations may be iterators; frames are written as they
+    arrive (see GifWriter).
+    """
+    with GifWriter(target) as writer:
+        for image, duration in zip(images, durations):
+            writer.add(image, duration)
+
+
+class GifWriter:
+    """An animated GIF (loop=0, disposal=2) written a frame at a time.
+
+    Pillow's save_all collects every frame before it writes any. This runs
+    the same steps through Pillow's GIF plugin, so the bytes are identical,
+    but keeps no more than the frame waiting to be written (its duration
+    grows while identical frames follow it) and the one before it, so
+    memory stays flat however long the animation is.
+
+    The helpers are private to Pillow, so they are trusted only after a
+    small animation written with them matches save_all byte for byte;
+    that check runs once per process. Tested with Pillow 12.3. On any
+    Pillow where a helper is missing or the check fails, the frames are
+    collected and saved with save_all instead.
+    """
+
+    _helpers = ("_normalize_mode", "_normalize_palette", "_getbbox", "_get_background",
+                "_get_global_header", "_write_frame_data", "_write_single_frame")
+    _helpers_ok = None  # result of the one-time check
+
+    @classmethod
+    def helpers_work(cls):
+        if cls._helpers_ok is None:
+            from PIL import GifImagePlugin
+
+            cls._helpers_ok = False  # writers made during the check must not recurse into it
+            if all(hasattr(GifImagePlugin, name) for name in cls._helpers):
+                try:
+                    cls._helpers_ok = cls._check_helpers()
+                except Exception:
+                    cls._helpers_ok = False
+        return cls._helpers_ok
+
+    @classmethod
+    def _check_helpers(cls):
+        # A lone frame, then frames that move, repeat and cover transparency,
+        # each written both ways
+        import io
+        from PIL import Image
+
+        frames = []
+        for x, color in ((1, (255, 0, 0, 255)), (2, (0, 0, 255, 255)), (2, (0, 0, 255, 255)), (0, (0, 255, 0, 128))):
+            frame = Image.new("RGBA", (4, 3), (0, 0, 0, 0))
+            frame.putpixel((x, 1), color)
+            frames.append(frame)
+        for count in (1, len(frames)):
+            durations = [100, 50, 0, 80][:count]
+            expected = io.BytesIO()
+            copies = [frame.copy() for frame in frames[:count]]
+            copies[0].save(expected, format="GIF", save_all=True, append_images=copies[1:],
+                           duration=durations, loop=0, disposal=2)
+            actual = io.BytesIO()
+            writer = cls(actual)
+            writer.streaming = True
+            for frame, duration in zip(frames, durations):
+                writer.add(frame.copy(), duration)
+            writer.close()
+            if actual.getvalue() != expected.getvalue():
+                return False
+        return True
+
+    def __init__(self, target):
+        from PIL import GifImagePlugin
+
+        self.gif = GifImagePlugin
+        self.streaming = self.helpers_work()
+        self.target = target
+        self.owned = not hasattr(target, "write")
+        self.created = self.owned and not os.path.exists(target)
+        self.fp = open(target, 'w+b') if self.owned else target
+        self.first = None  # first image, kept until a second frame decides the layout
+        self.first_palette = None
+        self.first_transparency = None
+        self.info = {"duration": None, "loop": 0, "disposal": 2, "optimize": True}  # options shared by every frame
+        self.pending = None  # (normalized frame, bbox, options) not yet written
+        self.previous = None  # last normalized frame, for the identical-frame check
+        self.background = None
+        self.collected = []  # (image, duration) when not streaming
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, kind, error, traceback):
+        if kind is None:
+            self.close()
+        else:
+            self.abort()
+
+    def add(self, image, duration):
+        if not self.streaming:
+            self.collected.append((image, duration))
+            return
+        gif = self.gif
+        if self.previous is None:
+            image.load()
+            self.first = image
+            self.first_transparency = image.info.get("transparency")
+        frame = gif._normalize_mode(image.copy())
+        if self.previous is None:
+            for key, value in frame.info.items():
+                if key != "transparency" and isinstance(key, str):
+                    self.info.setdefault(key, value)
+        options = self.info.copy()
+        if "transparency" in frame.info:
+            options.setdefault("transparency", frame.info["transparency"])
+        frame = gif._normalize_palette(frame, None, options)
+        options["duration"] = duration
+        bbox = None
+        if self.previous is not None:
+            bbox = gif._getbbox(self.previous, frame)[1]
+            if not bbox:
+                # Identical to the frame before: show that one for longer
+                self.hold(options["duration"])
+                return
+            color = self.info.get("transparency", self.first_transparency)
+            if color is not None:
+                if self.background is None:
+                    from PIL import Image
+
+                    self.background = Image.new("P", frame.size, gif._get_background(frame, color))
+                    self.background.putpalette(self.first_palette, self.first_palette.mode)
+                bbox = gif._getbbox(self.background, frame)[1]
+            else:
+                bbox = (0, 0) + frame.size
+            self.write_pending()
+        else:
+            self.first_palette = frame.palette
+        self.previous = frame
+        self.pending = (frame, bbox, options)
+
+    def hold(self, duration):
+        """Show the last frame added for duration longer, as if it had been added again."""
+        if not self.streaming:
+            image, total = self.collected[-1]
+            self.collected[-1] = (image, total + duration)
+        elif duration:
+            self.pending[2]["duration"] += duration
+
+    def write_pending(self):
+        frame, bbox, options = self.pending
+        if not bbox:
+            for data in self.gif._get_global_header(frame, options):
+                self.fp.write(data)
+            offset = (0, 0)
+        else:
+            options["include_color_table"] = True
+            if bbox != (0, 0) + frame.size:
+                frame = frame.crop(bbox)
+            offset = bbox[:2]
+        self.gif._write_frame_data(self.fp, frame, offset, options)
+        self.first = None  # only needed while it might be a lone frame
+
+    def close(self):
+        try:
+            if not self.streaming:
+                images = [image for image, _ in self.collected]
+                if not images:
+                    raise ValueError("no frames to write")
+                images[0].save(self.fp, format="GIF", save_all=True, append_images=images[1:],
+                               duration=[duration for _, duration in self.collected], loop=0, disposal=2)
+            elif self.pending is None:
+                raise ValueError("no frames to write")
+            elif self.pending[1] is None:
+                # A single frame is written the way Pillow writes a still GIF
+                self.info["duration"] = self.pending[2]["duration"]
+                self.first.encoderinfo = self.info
+                self.gif._write_single_frame(self.first, self.fp, None)
+                self.fp.write(b";")
+            else:
+                self.write_pending()
+                self.fp.write(b";")
+            self.fp.flush()
+        except Exception:
+            self.abort()
+            raise
+        self.release()
+
+    def abort(self):
+        self.release()
+        if self.created:
+            try:
+                os.remove(self.target)
+            except OSError:
+                pass
+
+    def release(self):
+        if self.owned and not self.fp.closed:
+            self.fp.close()
+        self.first = self.pending = self.previous = self.background = None
+        self.collected = []
+
+
+def read_sequence(file_path):
+    """[(png path, duration)] of an animator .pfseq file, skipping missing frames."""
+    with open(file_path, 'r') as f:
+        sequence = json.load(f)
+    base = os.path.dirname(os.path.abspath(file_path))
+    default = sequence.get("frame_duration", 100)
+    frames = []
+    for frame in sequence["frames"]:
+        png = os.path.normpath(os.path.join(base, frame["path"]))
+        if os.path.exists(png):
+            frames.append((png, frame.get("duration", default)))
+    return frames
+
+
+def sequence_to_gif(frames, target, scale=1, upscaler="nearest"):
+    """Write [(png path, duration)] the way the animator's Save as GIF does.
+
+    Frames go to the encoder in the mode they were saved in, since Pillow
+    quantizes RGB, L and P images differently from RGBA. A run of identical
+    frames becomes one GIF frame shown for the whole run. Frames are scaled
+    like the PNG exports.
+    """
+    import numpy as np
+    from PIL import Image
+
+    if not frames:
+        raise ValueError("sequence has no frames")
+    previous_hash = None
+    with GifWriter(target) as writer:
+        # One PNG is decoded at a time and handed straight to the writer
+        for png, duration in frames:
+            with Image.open(png) as img:
+                img.load()
+            rgba = img.convert("RGBA")
+            digest = hashlib.blake2b(f"{rgba.width}x{rgba.height}".encode(), digest_size=16)
+            digest.update(rgba.tobytes())
+            if digest.digest() == previous_hash:
+                writer.hold(duration)
+                continue
+            if scale != 1:
+                scaled = Image.fromarray(multi_scale(np.asarray(rgba), (scale,), upscaler)[scale], "RGBA")
+                img = scaled.convert(img.mode) if img.mode in ("RGB", "L") else scaled
+            writer.add(img, duration)
+            previous_hash = digest.digest()
+
+
+def gif_palette(frames):
+    """One palette for a whole animation: ((n, 3) uint8 colours, indexed frames).
+
+    Every frame is quantized exactly once against the shared palette. The
+    opaque colours of all frames are gathered in a single np.unique; when
+    there are more than 255 they are median-cut down to 255. Colour k gets
+    index k + 1; index 0 is transparent, which makes it the GIF background
+    that disposal restores to.
+    """
+    import numpy as np
+
+    packed = [(frame[..., 0].astype(np.uint32) << 16) | (frame[..., 1].astype(np.uint32) << 8) | frame[..., 2]
+              for frame in frames]
+    solid = [frame[..., 3] > 0 for frame in frames]
+    keys, inverse = np.unique(np.concatenate([key[mask] for key, mask in zip(packed, solid)]), return_inverse=True)
+    colors = np.stack([(keys >> 16) & 255, (keys >> 8) & 255, keys & 255], axis=1).astype(np.uint8)
+    if len(colors) <= 255:
+        palette, lookup = colors, np.arange(1, len(colors) + 1)
+    else:
+        palette = quantize_pixels(np.concatenate([frame[mask][:, :3] for frame, mask in zip(frames, solid)]), 255)
+        lookup = nearest_palette_indices(colors, palette) + 1
+    indexed = []
+    offset = 0
+    for frame, mask in zip(frames, solid):
+        indices = np.zeros(mask.shape, dtype=np.uint8)
+        count = int(mask.sum())
+        indices[mask] = lookup[inverse[offset:offset + count]]
+        offset += count
+        indexed.append(indices)
+    return palette, indexed
+
+
+def _scale_indexed(indices, palette, scale, upscaler):
+    # Nearest and Scale2x only move pixels, so they run on the indices;
+    # xBR blends colours, so its output is matched back to the palette.
+    import numpy as np
+
+    if upscaler != "xbr":
+        return multi_scale(indices[..., None], (scale,), upscaler)[scale][..., 0]
+    table = np.zeros((len(palette) + 1, 4), dtype=np.uint8)
+    table[1:, :3] = palette
+    table[1:, 3] = 255
+    rgba = multi_scale(table[indices], (scale,), upscaler)[scale]
+    packed = (rgba[..., 0].astype(np.uint32) << 16) | (rgba[..., 1].astype(np.uint32) << 8) | rgba[..., 2]
+    keys, inverse = np.unique(packed, return_inverse=True)
+    colors = np.stack([(keys >> 16) & 255, (keys >> 8) & 255, keys & 255], axis=1)
+    out = (nearest_palette_indices(colors, palette) + 1).astype(np.uint8)[inverse.reshape(packed.shape)]
+    out[rgba[..., 3] < 128] = 0
+    return out
+
+
+def _write_indexed_gif(job):
+    target, indexed, palette, durations, scale, upscaler = job
+    from PIL import Image
+
+    flat_palette = b"\0\0\0" + palette.tobytes()
+    images = []
+    for indices in indexed:
+        image = Image.fromarray(_scale_indexed(indices, palette, scale, upscaler) if scale != 1 else indices, "P")
+        image.putpalette(flat_palette)
+        images.append(image)
+    images[0].save(target, format="GIF", save_all=True, append_images=images[1:], duration=durations,
+                   loop=0, disposal=2, transparency=0, background=0, optimize=False)
+    return target
+
+
+def save_gif_scales(frames, durations, targets, upscaler="nearest", workers=None):
+    """Write one animated GIF per scale from (H, W, 4) frames decoded once.
+
+    targets maps each scale to its output path. A run of identical frames
+    becomes one GIF frame shown for the whole run. The frames are indexed
+    against one shared palette (gif_palette), and only the small index
+    arrays go to the worker processes, one per scale, which upscale and
+    encode in parallel. Returns the written paths.
+    """
+    import numpy as np
+    from concurrent.futures import ProcessPoolExecutor
+
+    if upscaler not in UPSCALERS:
+        raise ValueError(f"unknown upscaler {upscaler!r}; choose from {', '.join(UPSCALERS)}")
+    if any(n < 1 for n in targets):
+        raise ValueError("scales must be positive integers")
+    kept = []
+    kept_durations = []
+    for frame, duration in zip(frames, durations):
+        frame = np.asarray(frame)
+        if kept and frame.shape == kept[-1].shape and np.array_equal(frame, kept[-1]):
+            kept_durations[-1] += duration
+            continue
+        kept.append(frame)
+        kept_durations.append(duration)
+    if not kept:
+        raise ValueError("no frames to write")
+    palette, indexed = gif_palette(kept)
+    jobs = [(target, indexed, palette, kept_durations, scale, upscaler) for scale, target in sorted(targets.items())]
+    workers = min(workers or os.cpu_count() or 1, len(jobs))
+    if workers == 1:
+        return [_write_indexed_gif(job) for job in jobs]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(_write_indexed_gif, jobs))
+
+
+def sequence_to_gifs(frames, base_path, scales, upscaler="nearest", workers=None):
+    """Write base_path_<n>x.gif for every scale from [(png path, duration)].
+
+    Each PNG is decoded once however many scales are written.
+    """
+    from PIL import Image
+
+    images = []
+    for png, _ in frames:
+        with Image.open(png) as img:
+            images.append(img.convert("RGBA"))
+    base_path = os.path.splitext(base_path)[0]
+    return save_gif_scales(images, [duration for _, duration in frames],
+                           {n: f"{base_path}_{n}x.gif" for n in scales}, upscaler, workers)
+
+
+RENDER_FORMATS = ("png", "ico", "gif")
+
+
+def render_project(project, fmt="png", scale=1, ico_sizes=ICO_SIZES, upscaler="nearest",
+                   frames="composite", duration=100):
+    """PNG, ICO or GIF bytes for a project dict, composited like the editors.
+
+    A GIF holds the composite as a single frame, or with frames="layers"
+    each visible layer on its own, like the editor's live preview.
+    """
+    import io
+
+    if fmt not in RENDER_FORMATS:
+        raise ValueError(f"unknown format {fmt!r}; choose from {', '.join(RENDER_FORMATS)}")
+    layers = normalize_project(project)["layers"]
+    if not layers:
+        raise ValueError("project has no layers")
+    out = io.BytesIO()
+    if fmt == "gif":
+        if frames == "layers":
+            sources = [[layer] for layer in layers if layer["visible"]] or [layers]
+        elif frames == "composite":
+            sources = [layers]
+        else:
+            raise ValueError(f"unknown frames {frames!r}; choose composite or layers")
+        images = [_scaled_images(IndexedProject(source).composite(), (scale,), (), upscaler)[scale]
+                  for source in sources]
+        save_gif(out, images, [duration] * len(images))
+        return out.getvalue()
+    pixels = IndexedProject(layers).composite()
+    if fmt == "ico":
+        save_ico(out, pixels, ico_sizes, upscaler)
+    else:
+        _scaled_images(pixels, (scale,), (), upscaler)[scale].save(out, format="PNG")
+    return out.getvalue()
+
+
+def _png_chunk(tag, data):
+    return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data))
+
+
+def write_png_rows(target, width, height, bands, level=6):
+    """Write an 8-bit RGBA PNG from an iterable of (rows, width, 4) uint8 bands.
+
+    Each band is filtered and compressed as it arrives, so an image far
+    bigger than memory allows can be written a strip at a time.
+    """
+    import numpy as np
+
+    compressor = zlib.compressobj(level)
+    with open(target, 'wb') as f:
+        f.write(b"\x89PNG\r\n\x1a\n")
+        f.write(_png_chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 6, 0, 0, 0)))
+        rows = 0
+        for band in bands:
+            # Filter type 0 (none) in front of every row
+            filtered = np.zeros((band.shape[0], width * 4 + 1), dtype=np.uint8)
+            filtered[:, 1:] = band.reshape(band.shape[0], width * 4)
+            data = compressor.compress(filtered.tobytes())
+            if data:
+                f.write(_png_chunk(b"IDAT", data))
+            rows += band.shape[0]
+        if rows != height:
+            raise ValueError(f"expected {height} rows, got {rows}")
+        f.write(_png_chunk(b"IDAT", compressor.flush()))
+        f.write(_png_chunk(b"IEND", b""))
+
+
+def _free_key(used, limit):
+    # Smallest value below limit that is not in the sorted array used, or None
+    if not len(used) or used[0] > 0:
+        return 0
+    gaps = (used[1:] - used[:-1]) > 1
+    if gaps.any():
+        return int(used[:-1][gaps][0]) + 1
+    return int(used[-1]) + 1 if used[-1] + 1 < limit else None
+
+
+def _pack_rows(samples, depth):
+    # (H, W) samples below 2**depth -> (H, ceil(W * depth / 8)) bytes, first pixel in the high bits
+    import numpy as np
+
+    if depth == 8:
+        return samples.astype(np.uint8)
+    per_byte = 8 // depth
+    height, width = samples.shape
+    padded = np.zeros((height, -(-width // per_byte) * per_byte), dtype=np.uint8)
+    padded[:, :width] = samples
+    shifts = np.arange(8 - depth, -1, -depth, dtype=np.uint8)
+    return (padded.reshape(height, -1, per_byte) << shifts).sum(axis=2, dtype=np.uint8)
+
+
+def _filter_rows(rows, bpp):
+    """Rows with a filter byte in front, each using whichever of PNG's five
+    filters leaves the smallest sum of absolute values (libpng's heuristic)."""
+    import numpy as np
+
+    raw = rows.astype(np.int16)
+    left = np.zeros_like(raw)
+    left[:, bpp:] = raw[:, :-bpp]
+    up = np.zeros_like(raw)
+    up[1:] = raw[:-1]
+    up_left = np.zeros_like(raw)
+    up_left[1:, bpp:] = raw[:-1, :-bpp]
+    estimate = left + up - up_left
+    pa, pb, pc = np.abs(estimate - left), np.abs(estimate - up), np.abs(estimate - up_left)
+    paeth = np.where((pa <= pb) & (pa <= pc), left, np.where(pb <= pc, up, up_left))
+    filtered = np.stack([raw, raw - left, raw - up, raw - (left + up) // 2, raw - paeth]).astype(np.uint8)
+    costs = np.abs(filtered.view(np.int8).astype(np.int32)).sum(axis=2)
+    choice = costs.argmin(axis=0)
+    out = np.empty((rows.shape[0], rows.shape[1] + 1), dtype=np.uint8)
+    out[:, 0] = choice
+    out[:, 1:] = filtered[choice, np.arange(rows.shape[0])]
+    return out
+
+
+def _png_encodings(pixels):
+    """Every lossless PNG layout that fits an (H, W, 4) image, as
+    (color type, bit depth, rows, bytes per pixel, extra chunks).
+
+    One np.unique over the packed pixels gives the colour table everything
+    else is decided from: palette when there are 256 colours or fewer, at
+    1, 2, 4 or 8 bits; grayscale when every colour is gray, at the fewest
+    bits that hold its levels exactly; and truecolor. Transparency is a
+    tRNS chunk wherever alpha is only ever 0 or 255. Plain RGBA is always
+    offered too, since tiny images can come out smallest that way.
+
+    A grayscale colour key is only written at 8 bits: decoders such as
+    Pillow expand 1, 2 and 4-bit gray to 8 bits without scaling the key,
+    and the transparent pixels would load as opaque.
+    """
+    import numpy as np
+
+    height, width = pixels.shape[:2]
+    rgba = np.array(pixels, dtype=np.uint8)
+    rgba[rgba[..., 3] == 0] = 0  # the colour under a fully transparent pixel is never seen
+    keys = rgba.view("<u4")[..., 0]
+    colors, inverse = np.unique(keys, return_inverse=True)
+    inverse = inverse.reshape(height, width)
+    table = colors.astype("<u4").view(np.uint8).reshape(-1, 4)
+    alpha = table[:, 3]
+    opaque = bool((alpha == 255).all())
+    binary = bool(((alpha == 0) | (alpha == 255)).all())
+    encodings = []
+
+    if len(colors) <= 256:
+        # Translucent entries first so the tRNS chunk can stop after them
+        order = np.argsort(alpha == 255, kind="stable")
+        lookup = np.empty(len(colors), dtype=np.uint8)
+        lookup[order] = np.arange(len(colors))
+        depth = next(bits for bits in (1, 2, 4, 8) if len(colors) <= 1 << bits)
+        chunks = [(b"PLTE", table[order, :3].tobytes())]
+        translucent = int((alpha < 255).sum())
+        if translucent:
+            chunks.append((b"tRNS", alpha[order][:translucent].tobytes()))
+        encodings.append((3, depth, _pack_rows(lookup[inverse], depth), 1, chunks))
+
+    visible = table[alpha > 0]
+    if (visible[:, 0] == visible[:, 1]).all() and (visible[:, 1] == visible[:, 2]).all():
+        levels = visible[:, 0]
+        depth = next(bits for bits in (1, 2, 4, 8) if not (levels % (255 // ((1 << bits) - 1))).any())
+        gray = rgba[..., 0] // (255 // ((1 << depth) - 1))
+        if opaque:
+            encodings.append((0, depth, _pack_rows(gray, depth), 1, []))
+        else:
+            gray = rgba[..., 0].copy()
+            depth = 8
+            key = _free_key(np.unique(levels).astype(np.int64), 256) if binary else None
+            if key is not None:
+                gray[rgba[..., 3] == 0] = key
+                encodings.append((0, depth, _pack_rows(gray, depth), 1, [(b"tRNS", struct.pack(">H", key))]))
+            else:
+                encodings.append((4, 8, rgba[..., [0, 3]].reshape(height, width * 2), 2, []))
+
+    if opaque:
+        encodings.append((2, 8, rgba[..., :3].reshape(height, width * 3), 3, []))
+    else:
+        used = np.unique(visible[:, :3].astype(np.int64) @ np.array([1 << 16, 1 << 8, 1]))
+        key = _free_key(used, 1 << 24) if binary else None
+        if key is not None:
+            rgb = rgba[..., :3].copy()
+            rgb[rgba[..., 3] == 0] = (key >> 16, (key >> 8) & 255, key & 255)
+            encodings.append((2, 8, rgb.reshape(height, width * 3), 3,
+                              [(b"tRNS", struct.pack(">HHH", key >> 16, (key >> 8) & 255, key & 255))]))
+    if not opaque:
+        encodings.append((6, 8, rgba.reshape(height, width * 4), 4, []))
+    return encodings
+
+
+def encode_png(pixels):
+    """The smallest lossless PNG for an (H, W, 4) uint8 image, as bytes.
+
+    Every layout from _png_encodings is compressed at zlib level 9 with
+    the default, filtered and RLE strategies, and the smallest file wins.
+    Only the chunks needed to show the image are written.
+    """
+    import numpy as np
+
+    height, width = pixels.shape[:2]
+    best = None
+    for color_type, depth, rows, bpp, chunks in _png_encodings(pixels):
+        # Filters don't help indexed or packed samples; try them only on whole bytes
+        candidates = [np.insert(rows, 0, 0, axis=1)]
+        if depth == 8 and color_type != 3:
+            candidates.append(_filter_rows(rows, bpp))
+        overhead = sum(len(data) + 12 for _, data in chunks)
+        for filtered in candidates:
+            filtered = filtered.tobytes()
+            for strategy in (zlib.Z_DEFAULT_STRATEGY, zlib.Z_FILTERED, zlib.Z_RLE):
+                compressor = zlib.compressobj(9, zlib.DEFLATED, 15, 9, strategy)
+                idat = compressor.compress(filtered) + compressor.flush()
+                if best is None or overhead + len(idat) < best[0]:
+                    best = (overhead + len(idat), color_type, depth, chunks, idat)
+    _, color_type, depth, chunks, idat = best
+    return _png_file(width, height, color_type, depth, chunks, idat)
+
+
+def _png_file(width, height, color_type, depth, chunks, idat):
+    parts = [b"\x89PNG\r\n\x1a\n", _png_chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, depth, color_type, 0, 0, 0))]
+    parts += [_png_chunk(tag, data) for tag, data in chunks]
+    parts += [_png_chunk(b"IDAT", idat), _png_chunk(b"IEND", b"")]
+    return b"".join(parts)
+
+
+def save_optimized_png(target, pixels):
+    """Write an (H, W, 4) image as the smallest PNG encode_png finds."""
+    data = encode_png(pixels)
+    if hasattr(target, "write"):
+        target.write(data)
+    else:
+        with open(target, 'wb') as f:
+            f.write(data)
+
+
+class TileMap:
+    """A level: a grid of cells that each hold a sprite project, or nothing.
+
+    Cell value n > 0 stands for sprites[n - 1]. Every sprite is composited
+    once into a tile and that tile is reused (instanced) wherever the
+    sprite appears, so rendering costs grow with the number of distinct
+    sprites and the area drawn, not with the size of the map.
+
+    Saved as JSON (.pfmap) with sprite paths relative to the map and the
+    cells as zlib-compressed little-endian uint16 in base64.
+    """
+
+    def __init__(self, width, height, tile_size=16):
+        import numpy as np
+
+        if width < 1 or height < 1 or tile_size < 1:
+            raise ValueError("a tilemap needs a positive size and tile size")
+        self.width = width
+        self.height = height
+        self.tile_size = tile_size
+        self.sprites = []  # absolute project paths
+        self.cells = np.zeros((height, width), dtype=np.uint16)
+        self.tiles = {}  # sprite number -> (tile_size, tile_size, 4) composite
+
+    def add_sprite(self, project_path):
+        """Number of the sprite for project_path, adding it to the map if it is new."""
+        project_path = os.path.abspath(project_path)
+        if project_path not in self.sprites:
+            if len(self.sprites) >= 65535:
+                raise ValueError("a tilemap holds at most 65535 sprites")
+            self.sprites.append(project_path)
+        return self.sprites.index(project_path) + 1
+
+    def tile(self, n):
+        # Sprites that are not tile_size square are fitted with nearest neighbour
+        if n not in self.tiles:
+            from PIL import Image
+            import numpy as np
+
+            pixels = IndexedProject(load_project(self.sprites[n - 1])["layers"]).composite()
+            if pixels.shape[:2] != (self.tile_size, self.tile_size):
+                image = Image.fromarray(pixels, "RGBA").resize((self.tile_size, self.tile_size), Image.NEAREST)
+                pixels = np.asarray(image)
+            self.tiles[n] = pixels
+        return self.tiles[n]
+
+    def tile_stack(self, numbers):
+        """(max(numbers) + 1, T, T, 4) array of tiles; index 0 and unused numbers are clear."""
+        import numpy as np
+
+        top = max(numbers, default=0)
+        stack = np.zeros((top + 1, self.tile_size, self.tile_size, 4), dtype=np.uint8)
+        for n in numbers:
+            if n:
+                stack[n] = self.tile(n)
+        return stack
+
+    def render(self, x0=0, y0=0, x1=None, y1=None):
+        """(H, W, 4) pixels of the cells in [x0, x1) x [y0, y1)."""
+        import numpy as np
+
+        block = self.cells[y0:y1 if y1 is not None else self.height, x0:x1 if x1 is not None else self.width]
+        stack = self.tile_stack(np.unique(block).tolist())
+        size = self.tile_size
+        rows, cols = block.shape
+        # One gather places every tile: (rows, cols, T, T, 4) -> (rows*T, cols*T, 4)
+        return stack[block].transpose(0, 2, 1, 3, 4).reshape(rows * size, cols * size, 4)
+
+    def export_png(self, target, scale=1):
+        """Write the whole map as one PNG, a row of tiles at a time."""
+        import numpy as np
+
+        stack = self.tile_stack(np.unique(self.cells).tolist())
+        if scale != 1:
+            stack = stack.repeat(scale, axis=1).repeat(scale, axis=2)
+        size = self.tile_size * scale
+
+        def bands():
+            for row in self.cells:
+                yield stack[row].transpose(1, 0, 2, 3).reshape(size, self.width * size, 4)
+
+        write_png_rows(target, self.width * size, self.height * size, bands())
+
+    def to_json(self, file_path):
+        import base64
+
+        base = os.path.dirname(os.path.abspath(file_path))
+        cells = zlib.compress(self.cells.astype("<u2").tobytes())
+        return {"pixelforge_tilemap": 1, "width": self.width, "height": self.height, "tile_size": self.tile_size,
+                "sprites": [os.path.relpath(path, base) for path in self.sprites],
+                "cells": base64.b64encode(cells).decode("ascii")}
+
+    def save(self, file_path):
+        with open(file_path, 'w') as f:
+            json.dump(self.to_json(file_path), f)
+
+    @classmethod
+    def load(cls, file_path):
+        import base64
+        import numpy as np
+
+        with open(file_path, 'r') as f:
+            data = json.load(f)
+        if data.get("pixelforge_tilemap") != 1:
+            raise ValueError(f"{file_path} is not a Pixel Forge tilemap")
+        tilemap = cls(data["width"], data["height"], data.get("tile_size", 16))
+        base = os.path.dirname(os.path.abspath(file_path))
+        tilemap.sprites = [os.path.normpath(os.path.join(base, path)) for path in data["sprites"]]
+        cells = np.frombuffer(zlib.decompress(base64.b64decode(data["cells"])), dtype="<u2")
+        if cells.size != tilemap.width * tilemap.height or cells.max(initial=0) > len(tilemap.sprites):
+            raise ValueError(f"{file_path}: cells do not match the map size or sprite list")
+        tilemap.cells = cells.reshape(tilemap.height, tilemap.width).astype(np.uint16)
+        return tilemap
+
+
+def load_variant_table(file_path):
+    """Variant tables are JSON objects: {"variant name": {"#from": "#to", ...}}."""
+    with open(file_path, 'r') as f:
+        table = json.load(f)
+    if not isinstance(table, dict) or not all(isinstance(mapping, dict) for mapping in table.values()):
+        raise ValueError(f"{file_path}: expected {{variant name: {{colour: colour}}}}")
+    return table
+
+
+def _render_variant_batch(job):
+    source, items, per_layer, scale = job
+    project = load_project(source) if isinstance(source, str) else source
+    indexed = IndexedProject(project["layers"])
+    for out_path, mapping in items:
+        pixels_to_image(indexed.recolor(mapping, per_layer), scale).save(out_path)
+    return [out_path for out_path, _ in items]
+
+
+def render_variants(sources, table, out_dir, per_layer=True, scale=1, workers=None):
+    """Write one PNG per (source, variant) into out_dir.
+
+    sources maps an output name prefix to a project path or project dict.
+    Each worker indexes a project once and renders a chunk of its variants,
+    so thousands of variants cost one decode per chunk rather than one per
+    file. Returns the written paths.
+    """
+    from concurrent.futures import ProcessPoolExecutor
+
+    workers = workers or os.cpu_count() or 1
+    os.makedirs(out_dir, exist_ok=True)
+    names = list(table)
+    chunk_size = max(1, math.ceil(len(names) * len(sources) / (workers * 4)))
+    jobs = []
+    for prefix, source in sources.items():
+        for start in range(0, len(names), chunk_size):
+            items = [(os.path.join(out_dir, f"{prefix}_{name}.png"), table[name])
+                     for name in names[start:start + chunk_size]]
+            jobs.append((source, items, per_layer, scale))
+
+    if workers == 1 or len(jobs) == 1:
+        results = [_render_variant_batch(job) for job in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(_render_variant_batch, jobs))
+    return [path for batch in results for path in batch]
+
+
+class FrameStore:
+    """Decoded RGBA frames in fixed-stride slots of memory-mapped scratch files.
+
+    Frames are keyed by content hash. view() and image() hand out the mapped
+    bytes without copying, so a long sequence costs disk-backed pages that
+    the OS can drop rather than a PIL image per frame held in RAM.
+    """
+
+    segment_bytes = 64 * 1024 * 1024
+
+    def __init__(self):
+        self.lock = threading.Lock()  # frames are added from loader threads
+        self._reset(0)
+
+    def _reset(self, stride):
+        self.stride = stride  # bytes per slot: the largest frame stored so far
+        self.segment_slots = max(1, self.segment_bytes // stride) if stride else 0
+        self.segments = []  # one mmap per scratch file, segment_slots slots each
+        self.slots = {}  # content hash -> (slot, width, height)
+        self.free = []  # slots of discarded frames, reused first
+        self.used = 0  # slots handed out so far
+
+    def __contains__(self, content_hash):
+        return content_hash in self.slots
+
+    def __len__(self):
+        return len(self.slots)
+
+    def add(self, content_hash, image):
+        """Store a PIL image under content_hash unless it is already there."""
+        with self.lock:
+            if content_hash in self.slots:
+                return
+            if image.mode != "RGBA":
+                image = image.convert("RGBA")
+            self._store(content_hash, image.width, image.height, image.tobytes())
+
+    def view(self, content_hash):
+        with self.lock:
+            slot, width, height = self.slots[content_hash]
+            return self._slot_view(slot, width * height * 4)
+
+    def image(self, content_hash):
+        """A read-only PIL image backed directly by the mapped slot."""
+        from PIL import Image
+
+        width, height = self.slots[content_hash][1:]
+        return Image.frombuffer("RGBA", (width, height), self.view(content_hash), "raw", "RGBA", 0, 1)
+
+    def discard(self, content_hash):
+        with self.lock:
+            entry = self.slots.pop(content_hash, None)
+            if entry:
+                self.free.append(entry[0])
+
+    def clear(self):
+        # Mappings are dropped rather than closed; views still held elsewhere
+        # keep theirs alive until they go away.
+        with self.lock:
+            self._reset(0)
+
+    def _store(self, content_hash, width, height, data):
+        if len(data) > self.stride:
+            self._restride(len(data))
+        if self.free:
+            slot = self.free.pop()
+        else:
+            slot = self.used
+            self.used += 1
+            if slot >= len(self.segments) * self.segment_slots:
+                self._add_segment()
+        self._slot_view(slot, len(data))[:] = data
+        self.slots[content_hash] = (slot, width, height)
+
+    def _slot_view(self, slot, size):
+        segment, index = divmod(slot, self.segment_slots)
+        offset = index * self.stride
+        return memoryview(self.segments[segment])[offset:offset + size]
+
+    def _add_segment(self):
+        size = self.stride * self.segment_slots
+        with tempfile.TemporaryFile(prefix="pixelforge-frames-") as scratch:
+            scratch.truncate(size)
+            # The mapping keeps its own handle, so the file can be closed now
+            self.segments.append(mmap.mmap(scratch.fileno(), size))
+
+    def _restride(self, stride):
+        # A frame larger than any before it: lay every slot out again with the
+        # wider stride. Sequences are nearly always one size, so this is rare.
+        frames = [(content_hash, width, height, bytes(self._slot_view(slot, width * height * 4)))
+                  for content_hash, (slot, width, height) in self.slots.items()]
+        self._reset(stride)
+        for frame in frames:
+            self._store(*frame)
+
+
+class FrameChannel:
+    """RGBA frames passed from an editor to an animator through shared memory.
+
+    The editor creates the channel and publishes frames into fixed slots; an
+    animator in another process attaches and polls it. Each slot has a
+    sequence number that is odd while the slot is being written, so readers
+    never pick up a half-written frame.
+    """
+
+    default_name = "pixelforge_live"
+    _header = struct.Struct("<4sIIIIQI")  # magic, width, height, max frames, frame count, generation, owner pid
+    _magic = b"PFLV"
+    _seq_offset = 32
+
+    def __init__(self, memory, owner):
+        self.memory = memory
+        self.owner = owner
+        self.untracked = False  # attached with the resource tracker told to leave it alone
+        magic, self.width, self.height, self.max_frames = self._header.unpack_from(memory.buf)[:4]
+        if magic != self._magic:
+            raise ValueError(f"{memory.name} is not a Pixel Forge frame channel")
+        self.frame_bytes = self.width * self.height * 4
+        self._data_offset = self._seq_offset + 8 * self.max_frames
+
+    @classmethod
+    def create(cls, width, height, max_frames=256, name=default_name):
+        from multiprocessing import shared_memory
+
+        size = cls._seq_offset + 8 * max_frames + width * height * 4 * max_frames
+        try:
+            memory = shared_memory.SharedMemory(name=name, create=True, size=size)
+        except FileExistsError:
+            # Left behind by an editor that did not shut down cleanly?
+            stale = cls.attach(name)
+            alive = stale.owner_alive()
+            stale.close()
+            if alive:
+                raise
+            if stale.untracked:
+                from multiprocessing import resource_tracker
+                resource_tracker.register(stale.memory._name, "shared_memory")
+            stale.memory.unlink()
+            memory = shared_memory.SharedMemory(name=name, create=True, size=size)
+        cls._header.pack_into(memory.buf, 0, cls._magic, width, height, max_frames, 0, 0, os.getpid())
+        return cls(memory, owner=True)
+
+    @classmethod
+    def attach(cls, name=default_name):
+        from multiprocessing import shared_memory
+
+        untracked = False
+        try:
+            memory = shared_memory.SharedMemory(name=name, track=False)
+        except TypeError:
+            # Before Python 3.13 an attaching process registers the block with
+            # its resource tracker, which would unlink it on exit.
+            memory = shared_memory.SharedMemory(name=name)
+            # (the creating process itself keeps its registration)
+            if os.name == "posix" and struct.unpack_from("<I", memory.buf, 28)[0] != os.getpid():
+                from multiprocessing import resource_tracker
+                resource_tracker.unregister(memory._name, "shared_memory")
+                untracked = True
+        channel = cls(memory, owner=False)
+        channel.untracked = untracked
+        return channel
+
+    @property
+    def frame_count(self):
+        return struct.unpack_from("<I", self.memory.buf, 16)[0]
+
+    @property
+    def generation(self):
+        return struct.unpack_from("<Q", self.memory.buf, 20)[0]
+
+    def owner_alive(self):
+        pid = struct.unpack_from("<I", self.memory.buf, 28)[0]
+        if not pid:
+            return False
+        if os.name != "posix" or pid == os.getpid():
+            # Windows frees the block with its last handle, so it is never stale
+            return True
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            pass
+        return True
+
+    def set_frame_count(self, count):
+        count = min(count, self.max_frames)
+        if count != self.frame_count:
+            struct.pack_into("<I", self.memory.buf, 16, count)
+            self._bump()
+
+    def sequence(self, index):
+        return struct.unpack_from("<Q", self.memory.buf, self._seq_offset + 8 * index)[0]
+
+    def publish(self, index, data):
+        """Write one frame of width * height RGBA bytes. Unchanged frames are skipped."""
+        if len(data) != self.frame_bytes:
+            raise ValueError(f"expected {self.frame_bytes} bytes, got {len(data)}")
+        start = self._data_offset + index * self.frame_bytes
+        slot = self.memory.buf[start:start + self.frame_bytes]
+        if slot == data:
+            slot.release()
+            return False
+        seq = self.sequence(index)
+        struct.pack_into("<Q", self.memory.buf, self._seq_offset + 8 * index, seq + 1)
+        slot[:] = data
+        slot.release()
+        struct.pack_into("<Q", self.memory.buf, self._seq_offset + 8 * index, seq + 2)
+        self._bump()
+        return True
+
+    def read(self, index):
+        """Return (sequence, bytes) for a slot, or None if it is mid-write."""
+        seq = self.sequence(index)
+        if seq % 2:
+            return None
+        start = self._data_offset + index * self.frame_bytes
+        data = bytes(self.memory.buf[start:start + self.frame_bytes])
+        if self.sequence(index) != seq:
+            return None
+        return seq, data
+
+    def _bump(self):
+        struct.pack_into("<Q", self.memory.buf, 20, self.generation + 1)
+
+    def close(self):
+        if self.owner:
+            # Readers still mapping the block see the owner gone (owner_alive)
+            struct.pack_into("<I", self.memory.buf, 28, 0)
+        self.memory.close()
+        if self.owner:
+            self.memory.unlink()
@@ -0,0 +1,148 @@
+import functools
+import json
+import os
+import threading
+import time
+
+#############################################################################
+##                                                                         ##
+## Pixel Forge Profiler                                                    ##
+## Copyright (C) 2024  Bluehatchet                                         ##
+##                                                                         ##
+## This program is free software: you can redistribute it and/or modify    ##
+## it under the terms of the GNU General Public License as published by    ##
+## the Free Software Foundation, either version 3 of the License, or       ##
+## (at your option) any later version.                                     ##
+##                                                                         ##
+## This program is distributed in the hope that it will be useful,         ##
+## but WITHOUT ANY WARRANTY; without even the implied warranty of          ##
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the           ##
+## GNU General Public License for more details.                            ##
+##                                                                         ##
+## You should have received a copy of the GNU General Public License       ##
+## along with this program.  If not, see <http://www.gnu.org/licenses/>.   ##
+##                                                                         ##
+#############################################################################
+
+# Opt-in instrumentation for the editors and the animator. Start either app
+# with --profile (or PIXELFORGE_PROFILE=1) to record spans; set
+# PIXELFORGE_TRACE=<file> to have the session written out on exit.
+
+
+def profiling_requested(argv):
+    return "--profile" in argv or bool(os.environ.get("PIXELFORGE_PROFILE"))
+
+
+class _Span:
+    def __init__(self, profiler, name, args):
+        self.profiler = profiler
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        self.profiler.stack.append(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        end = time.perf_counter()
+        self.profiler.stack.pop()
+        self.profiler.record(self.name, self.start, end - self.start, self.args)
+        return False
+
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class Profiler:
+    def __init__(self, enabled=False, max_events=200000):
+        self.enabled = enabled
+        self.max_events = max_events
+        self.events = []
+        self.stack = []
+        self.last = {}  # name -> duration in seconds of the latest call
+        self.totals = {}  # name -> [calls, seconds]
+        self.origin = time.perf_counter()
+        self.pid = os.getpid()
+
+    def span(self, name, **args):
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, name, args)
+
+    def count(self, key, n=1):
+        # Attribute work (cells touched, Tk calls made) to the innermost open
+        # span. Outside a span, or when disabled, this is a no-op.
+        if self.stack:
+            args = self.stack[-1].args
+            args[key] = args.get(key, 0) + n
+
+    def record(self, name, start, duration, args=None):
+        self.last[name] = duration
+        total = self.totals.setdefault(name, [0, 0.0])
+        total[0] += 1
+        total[1] += duration
+        if len(self.events) < self.max_events:
+            self.events.append((name, start, duration, threading.get_ident(), dict(args or {})))
+
+    def record_since(self, name, start, **args):
+        if self.enabled:
+            self.record(name, start, time.perf_counter() - start, args)
+
+    def clear(self):
+        self.events.clear()
+        self.last.clear()
+        self.totals.clear()
+        self.origin = time.perf_counter()
+
+    def summary(self):
+        lines = []
+        for name, (calls, seconds) in sorted(self.totals.items(), key=lambda item: -item[1][1]):
+            lines.append(f"{name:<24}{calls:>8} calls{seconds * 1000:>12.1f} ms{seconds * 1000 / calls:>10.2f} ms/call")
+        return "\n".join(lines)
+
+    def chrome_trace(self):
+        trace_events = []
+        for name, start, duration, tid, args in self.events:
+            trace_events.append({
+                "name": name,
+                "cat": "pixelforge",
+                "ph": "X",
+                "ts": round((start - self.origin) * 1e6, 3),
+                "dur": round(duration * 1e6, 3),
+                "pid": self.pid,
+                "tid": tid,
+                "args": args,
+            })
+        return {"traceEvents": trace_events, "displayTimeUnit": "ms"}
+
+    def export_chrome_trace(self, file_path):
+        with open(file_path, 'w') as f:
+            json.dump(self.chrome_trace(), f)
+
+    def export_on_exit(self):
+        trace_path = os.environ.get("PIXELFORGE_TRACE")
+        if self.enabled and trace_path:
+            self.export_chrome_trace(trace_path)
+
+
+def profiled(name):
+    """Record each call of the decorated method as a span on self.profiler."""
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            profiler = self.profiler
+            if not profiler.enabled:
+                return func(self, *args, **kwargs)
+            with profiler.span(name):
+                return func(self, *args, **kwargs)
+        return wrapper
+    return decorate
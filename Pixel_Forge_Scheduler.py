@@ -0,0 +1,168 @@
+import time
+from concurrent.futures import Future
+
+#############################################################################
+##                                                                         ##
+## Pixel Forge Scheduler                                                   ##
+## Copyright (C) 2024  Bluehatchet                                         ##
+##                                                                         ##
+## This program is free software: you can redistribute it and/or modify    ##
+## it under the terms of the GNU General Public License as published by    ##
+## the Free Software Foundation, either version 3 of the License, or       ##
+## (at your option) any later version.                                     ##
+##                                                                         ##
+## This program is distributed in the hope that it will be useful,         ##
+## but WITHOUT ANY WARRANTY; without even the implied warranty of          ##
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the           ##
+## GNU General Public License for more details.                            ##
+##                                                                         ##
+## You should have received a copy of the GNU General Public License       ##
+## along with this program.  If not, see <http://www.gnu.org/licenses/>.   ##
+##                                                                         ##
+#############################################################################
+
+# Cooperative scheduling of long operations inside a Tk app. A task is a
+# generator: every `yield` ends a chunk of work, and yielding a
+# concurrent.futures.Future (e.g. from offload()) parks the task until the
+# future is done, then sends its result (or raises its exception) back
+# into the generator. Chunks run in slices of at most `budget` seconds
+# between Tk events, so input and redraws are never held up for long.
+#
+#   def work():
+#       data = yield scheduler.offload(json.load, f)   # runs on a thread
+#       for row in rows:
+#           draw(row)
+#           yield                                       # let Tk breathe
+#       return data
+#
+#   scheduler.submit("load", work(), priority=1, on_done=show)
+
+
+class Task:
+    def __init__(self, name, steps, priority, on_done, on_error):
+        self.name = name
+        self.steps = steps
+        self.priority = priority
+        self.on_done = on_done
+        self.on_error = on_error
+        self.waiting = None  # Future the task is parked on
+        self.cancelled = False
+
+
+class IdleScheduler:
+    """Runs generator tasks in time-sliced chunks on a widget's event loop.
+
+    The highest priority ready task runs first; tasks of equal priority
+    take turns. Submitting under a name that is already queued replaces
+    the queued task unless replace=False.
+    """
+
+    def __init__(self, widget, budget=0.008, profiler=None):
+        self.widget = widget
+        self.budget = budget
+        self.profiler = profiler
+        self.tasks = []
+        self.job = None
+        self.threads = None
+        self.processes = None
+
+    def submit(self, name, steps, priority=0, on_done=None, on_error=None, replace=True):
+        if replace:
+            self.cancel(name)
+        task = Task(name, steps, priority, on_done, on_error)
+        self.tasks.append(task)
+        if self.job is None:
+            self.job = self.widget.after_idle(self.run_slice)
+        return task
+
+    def pending(self, name):
+        return any(task.name == name for task in self.tasks)
+
+    def run_now(self, name):
+        """Run queued tasks named name to the end right away (blocking on any offloaded work)."""
+        for task in [task for task in self.tasks if task.name == name]:
+            while task in self.tasks:
+                self.step(task)
+
+    def cancel(self, name):
+        """Drop queued tasks named name (or the Task itself). Offloaded work still finishes."""
+        for task in [task for task in self.tasks if task is name or task.name == name]:
+            task.cancelled = True
+            self.tasks.remove(task)
+            task.steps.close()
+
+    def offload(self, fn, *args, processes=False):
+        """Run fn(*args) on a thread (or a process) pool; yield the result to wait for it."""
+        if processes:
+            if self.processes is None:
+                from concurrent.futures import ProcessPoolExecutor
+                self.processes = ProcessPoolExecutor()
+            return self.processes.submit(fn, *args)
+        if self.threads is None:
+            from concurrent.futures import ThreadPoolExecutor
+            self.threads = ThreadPoolExecutor(max_workers=2, thread_name_prefix="pixelforge")
+        return self.threads.submit(fn, *args)
+
+    def run_slice(self):
+        self.job = None
+        start = time.perf_counter()
+        deadline = start + self.budget
+        steps = 0
+        while time.perf_counter() < deadline:
+            ready = [task for task in self.tasks if task.waiting is None or task.waiting.done()]
+            if not ready:
+                break
+            task = max(ready, key=lambda task: task.priority)
+            # To the back of the queue, so equal priorities take turns
+            self.tasks.remove(task)
+            self.tasks.append(task)
+            self.step(task)
+            steps += 1
+        if self.profiler is not None and steps:
+            self.profiler.record_since("scheduler_slice", start, steps=steps)
+        if self.tasks:
+            # Tasks that are only waiting on a pool are polled less often
+            busy = any(task.waiting is None or task.waiting.done() for task in self.tasks)
+            self.job = self.widget.after(1 if busy else 10, self.run_slice)
+
+    def step(self, task):
+        try:
+            if task.waiting is not None:
+                future, task.waiting = task.waiting, None
+                error = future.exception()
+                value = task.steps.throw(error) if error else task.steps.send(future.result())
+            else:
+                value = next(task.steps)
+        except StopIteration as stop:
+            self.tasks.remove(task)
+            self.finish(task.on_done, stop.value)
+            return
+        except Exception as e:
+            self.tasks.remove(task)
+            if task.on_error is None:
+                self.report(e)
+            else:
+                self.finish(task.on_error, e)
+            return
+        if isinstance(value, Future):
+            task.waiting = value
+
+    def finish(self, callback, value):
+        if callback:
+            try:
+                callback(value)
+            except Exception as e:
+                self.report(e)
+
+    def report(self, error):
+        # Unhandled errors go to Tk's usual report rather than out of
+        # run_slice, where they would stall every other queued task.
+        self.widget._root().report_callback_exception(type(error), error, error.__traceback__)
+
+    def shutdown(self):
+        """Drop queued tasks and wait for offloaded work, e.g. an export being written."""
+        for task in list(self.tasks):
+            self.cancel(task)
+        for pool in (self.threads, self.processes):
+            if pool is not None:
+                pool.shutdown(wait=True)
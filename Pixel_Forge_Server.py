@@ -0,0 +1,289 @@
+import asyncio
+import hashlib
+import http.client
+import json
+import os
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import parse_qs, urlencode, urlsplit
+from Pixel_Forge_Core import ICO_SIZES, RENDER_FORMATS, UPSCALERS, expand_project, render_project
+
+#############################################################################
+##                                                                         ##
+## Pixel Forge Render Server                                               ##
+## Copyright (C) 2024  Bluehatchet                                         ##
+##                                                                         ##
+## This program is free software: you can redistribute it and/or modify    ##
+## it under the terms of the GNU General Public License as published by    ##
+## the Free Software Foundation, either version 3 of the License, or       ##
+## (at your option) any later version.                                     ##
+##                                                                         ##
+## This program is distributed in the hope that it will be useful,         ##
+## but WITHOUT ANY WARRANTY; without even the implied warranty of          ##
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the           ##
+## GNU General Public License for more details.                            ##
+##                                                                         ##
+## You should have received a copy of the GNU General Public License       ##
+## along with this program.  If not, see <http://www.gnu.org/licenses/>.   ##
+##                                                                         ##
+#############################################################################
+
+# A small local HTTP server that renders projects on request, for build
+# tools and level editors that would otherwise start an editor per sprite.
+# Started with `python Pixel_Forge_Tools.py serve`; it only listens on
+# localhost and never touches the network beyond that.
+#
+#   GET  /render?path=octo.json&format=png&scale=4     project file under --root
+#   POST /render?format=ico&sizes=16,32,48             project JSON in the body
+#   GET  /stats                                        cache counters as JSON
+#
+# Other options: upscaler=nearest|scale2x|xbr, and for GIFs
+# frames=composite|layers and duration=<ms>.
+
+CONTENT_TYPES = {"png": "image/png", "ico": "image/vnd.microsoft.icon", "gif": "image/gif"}
+MAX_BODY = 32 * 1024 * 1024
+MAX_SCALE = 64
+
+
+class RequestError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def render_options(query):
+    """Render keyword arguments from a parsed query string, validated."""
+    def one(name, default):
+        return query.get(name, [default])[-1]
+
+    try:
+        options = {
+            "fmt": one("format", "png"),
+            "scale": int(one("scale", "1")),
+            "ico_sizes": tuple(sorted({int(part) for part in one("sizes", "").split(",") if part.strip()})) or ICO_SIZES,
+            "upscaler": one("upscaler", "nearest"),
+            "frames": one("frames", "composite"),
+            "duration": int(one("duration", "100")),
+        }
+    except ValueError:
+        raise RequestError(400, "scale, sizes and duration must be integers")
+    if options["fmt"] not in RENDER_FORMATS:
+        raise RequestError(400, f"format must be one of {', '.join(RENDER_FORMATS)}")
+    if options["upscaler"] not in UPSCALERS:
+        raise RequestError(400, f"upscaler must be one of {', '.join(UPSCALERS)}")
+    if not 1 <= options["scale"] <= MAX_SCALE:
+        raise RequestError(400, f"scale must be between 1 and {MAX_SCALE}")
+    if not all(1 <= size <= 256 for size in options["ico_sizes"]):
+        raise RequestError(400, "ICO sizes must be between 1 and 256")
+    if options["duration"] < 1:
+        raise RequestError(400, "duration must be positive")
+    return options
+
+
+def _render_job(job):
+    # Runs in a worker process. The project arrives as the raw bytes that
+    # were hashed, so the cache key always matches what was rendered. Its
+    # block store, if any, has to be under the served root.
+    raw, file_path, root, options = job
+    return render_project(expand_project(json.loads(raw), file_path, confine_to=root), **options)
+
+
+class RenderServer:
+    """Renders projects on a process pool and keeps recent results in an LRU.
+
+    Results are keyed by a hash of the project bytes plus the render
+    options, so an unchanged project is never rendered twice, and identical
+    requests that arrive together share one render.
+    """
+
+    def __init__(self, root=".", workers=None, cache_bytes=64 * 1024 * 1024):
+        self.root = os.path.realpath(root)
+        self.workers = workers
+        self.cache_bytes = cache_bytes
+        self.cache = OrderedDict()  # key -> rendered bytes
+        self.cached = 0
+        self.pending = {}  # key -> future of a render in progress
+        self.stats = {"requests": 0, "hits": 0, "renders": 0, "errors": 0}
+        self.pool = None
+        self.server = None
+
+    async def start(self, host="127.0.0.1", port=0):
+        self.pool = ProcessPoolExecutor(max_workers=self.workers)
+        self.server = await asyncio.start_server(self.handle_client, host, port)
+        return self.server.sockets[0].getsockname()[1]
+
+    async def close(self):
+        if self.server:
+            self.server.close()
+            await self.server.wait_closed()
+        if self.pool:
+            self.pool.shutdown(cancel_futures=True)
+
+    async def render(self, raw, file_path, options):
+        key = hashlib.blake2b(raw, digest_size=16).hexdigest() + json.dumps(options, sort_keys=True)
+        if key in self.cache:
+            self.cache.move_to_end(key)
+            self.stats["hits"] += 1
+            return self.cache[key], True
+        if key in self.pending:
+            self.stats["hits"] += 1
+            return await asyncio.shield(self.pending[key]), True
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self.pool, _render_job, (raw, file_path, self.root, options))
+        self.pending[key] = future
+        try:
+            data = await asyncio.shield(future)
+        finally:
+            del self.pending[key]
+        self.stats["renders"] += 1
+        if len(data) <= self.cache_bytes:
+            self.cache[key] = data
+            self.cached += len(data)
+            while self.cached > self.cache_bytes:
+                self.cached -= len(self.cache.popitem(last=False)[1])
+        return data, False
+
+    def project_path(self, relative):
+        # Only files under the served root can be rendered
+        path = os.path.realpath(os.path.join(self.root, relative))
+        if os.path.commonpath([path, self.root]) != self.root:
+            raise RequestError(403, "path is outside the served directory")
+        if not os.path.isfile(path):
+            raise RequestError(404, f"no project at {relative}")
+        return path
+
+    async def respond(self, method, target, body):
+        url = urlsplit(target)
+        query = parse_qs(url.query)
+        if url.path == "/stats" and method == "GET":
+            stats = dict(self.stats, cached=len(self.cache), cached_bytes=self.cached)
+            return 200, "application/json", json.dumps(stats).encode(), {}
+        if url.path != "/render":
+            raise RequestError(404, "unknown endpoint; use /render or /stats")
+        options = render_options(query)
+        if method == "POST":
+            raw, file_path = body, os.path.join(self.root, "posted.json")
+        elif method == "GET" and "path" in query:
+            file_path = self.project_path(query["path"][-1])
+            raw = await asyncio.to_thread(self.read_file, file_path)
+        else:
+            raise RequestError(400, "GET needs ?path=, or POST the project JSON")
+        try:
+            data, hit = await self.render(raw, file_path, options)
+        except (ValueError, KeyError, IndexError, TypeError) as e:
+            raise RequestError(400, f"cannot render project: {e}")
+        except FileNotFoundError as e:  # e.g. a block the project refers to
+            raise RequestError(404, f"cannot render project: {e}")
+        except OSError as e:
+            raise RequestError(500, f"cannot render project: {e}")
+        return 200, CONTENT_TYPES[options["fmt"]], data, {"X-Cache": "hit" if hit else "miss"}
+
+    @staticmethod
+    def read_file(file_path):
+        with open(file_path, 'rb') as f:
+            return f.read()
+
+    async def handle_client(self, reader, writer):
+        # HTTP/1.1 with keep-alive, so a client can stream many requests
+        # down one connection.
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if not line.strip():
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                parts = request_line.decode("latin-1").split()
+                keep_alive = headers.get("connection", "").lower() != "close" and parts[-1:] == ["HTTP/1.1"]
+                self.stats["requests"] += 1
+                try:
+                    if len(parts) != 3:
+                        raise RequestError(400, "malformed request line")
+                    length = int(headers.get("content-length", "0") or 0)
+                    if length > MAX_BODY:
+                        keep_alive = False
+                        raise RequestError(413, "project is too large")
+                    body = await reader.readexactly(length) if length else b""
+                    status, content_type, data, extra = await self.respond(parts[0], parts[1], body)
+                except RequestError as e:
+                    self.stats["errors"] += 1
+                    status, content_type, data, extra = e.status, "text/plain", str(e).encode(), {}
+                except ValueError:
+                    self.stats["errors"] += 1
+                    keep_alive = False
+                    status, content_type, data, extra = 400, "text/plain", b"bad Content-Length", {}
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    raise
+                except Exception as e:  # every request gets an answer, even on a bug
+                    self.stats["errors"] += 1
+                    keep_alive = False
+                    status, content_type, data, extra = 500, "text/plain", f"internal error: {e}".encode(), {}
+                head = [f"HTTP/1.1 {status} {http.client.responses.get(status, '')}",
+                        f"Content-Type: {content_type}", f"Content-Length: {len(data)}",
+                        "Connection: " + ("keep-alive" if keep_alive else "close")]
+                head += [f"{name}: {value}" for name, value in extra.items()]
+                writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1") + data)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+
+async def _serve(root, host, port, workers, cache_bytes):
+    server = RenderServer(root, workers, cache_bytes)
+    port = await server.start(host, port)
+    print(f"Rendering projects under {server.root} at http://{host}:{port}/render", flush=True)
+    try:
+        await server.server.serve_forever()
+    finally:
+        await server.close()
+
+
+def serve(root=".", host="127.0.0.1", port=8765, workers=None, cache_bytes=64 * 1024 * 1024):
+    try:
+        asyncio.run(_serve(root, host, port, workers, cache_bytes))
+    except KeyboardInterrupt:
+        pass
+
+
+class RenderClient:
+    """Keeps one connection to a render server open across requests."""
+
+    def __init__(self, port=8765, host="127.0.0.1", timeout=60):
+        self.connection = http.client.HTTPConnection(host, port, timeout=timeout)
+
+    def render(self, project=None, path=None, **options):
+        """Rendered bytes for a project dict (or JSON text), or a path under the server's root.
+
+        options are the query parameters: format, scale, sizes, upscaler,
+        frames and duration. Raises RuntimeError with the server's message
+        when the request is refused.
+        """
+        if "sizes" in options and not isinstance(options["sizes"], str):
+            options["sizes"] = ",".join(str(size) for size in options["sizes"])
+        if path is not None:
+            self.connection.request("GET", "/render?" + urlencode(dict(options, path=path)))
+        else:
+            body = project if isinstance(project, (str, bytes)) else json.dumps(project)
+            self.connection.request("POST", "/render?" + urlencode(options), body=body,
+                                    headers={"Content-Type": "application/json"})
+        response = self.connection.getresponse()
+        data = response.read()
+        if response.status != 200:
+            raise RuntimeError(f"{response.status}: {data.decode(errors='replace')}")
+        return data
+
+    def stats(self):
+        self.connection.request("GET", "/stats")
+        return json.loads(self.connection.getresponse().read())
+
+    def close(self):
+        self.connection.close()
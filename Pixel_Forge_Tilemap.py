@@ -0,0 +1,289 @@
+import os
+import tkinter as tk
+from tkinter import filedialog, messagebox, simpledialog
+from Pixel_Forge_Core import TileMap
+from Pixel_Forge_Scheduler import IdleScheduler
+
+#############################################################################
+##                                                                         ##
+## Pixel Forge Tilemap                                                     ##
+## Copyright (C) 2024  Bluehatchet                                         ##
+##                                                                         ##
+## This program is free software: you can redistribute it and/or modify    ##
+## it under the terms of the GNU General Public License as published by    ##
+## the Free Software Foundation, either version 3 of the License, or       ##
+## (at your option) any later version.                                     ##
+##                                                                         ##
+## This program is distributed in the hope that it will be useful,         ##
+## but WITHOUT ANY WARRANTY; without even the implied warranty of          ##
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the           ##
+## GNU General Public License for more details.                            ##
+##                                                                         ##
+## You should have received a copy of the GNU General Public License       ##
+## along with this program.  If not, see <http://www.gnu.org/licenses/>.   ##
+##                                                                         ##
+#############################################################################
+
+# Level building from sprite projects. Opened from an editor's Tilemap
+# menu, or on its own with `python Pixel_Forge_Tilemap.py [map.pfmap]`.
+#
+# Each sprite becomes one PhotoImage per zoom level, shared by every cell
+# that shows it, and only the cells inside the viewport have canvas items,
+# so panning a 512x512 map touches a few hundred items at most.
+
+
+class TilemapWindow(tk.Toplevel):
+    zoom_levels = (1, 2, 4)
+
+    def __init__(self, master, tilemap=None, file_path=None):
+        super().__init__(master)
+        self.configure(bg='black')
+        self.tilemap = tilemap or TileMap(64, 64)
+        self.file_path = file_path
+        self.zoom = 2
+        self.zoom_var = tk.IntVar(value=self.zoom)
+        self.photos = {}  # (sprite number, zoom) -> PhotoImage shared by all its cells
+        self.items = {}  # (x, y) -> (canvas item, sprite number) for the visible cells
+        self.view_job = None
+        self.current_sprite = 0
+        self.scheduler = IdleScheduler(self)
+        self.create_menu()
+        self.create_widgets()
+        self.reset_view()
+
+    def create_menu(self):
+        menu = tk.Menu(self)
+        self.config(menu=menu)
+        file_menu = tk.Menu(menu, tearoff=0)
+        menu.add_cascade(label="File", menu=file_menu)
+        file_menu.add_command(label="New Tilemap...", command=self.new_map)
+        file_menu.add_command(label="Open Tilemap...", command=self.open_map)
+        file_menu.add_command(label="Save Tilemap", command=self.save_map)
+        file_menu.add_command(label="Save Tilemap As...", command=self.save_map_as)
+        file_menu.add_separator()
+        file_menu.add_command(label="Add Sprite Projects...", command=self.add_sprites)
+        file_menu.add_command(label="Export as PNG...", command=self.export_png)
+        view_menu = tk.Menu(menu, tearoff=0)
+        menu.add_cascade(label="View", menu=view_menu)
+        for zoom in self.zoom_levels:
+            view_menu.add_radiobutton(label=f"{zoom}x", variable=self.zoom_var, value=zoom, command=self.change_zoom)
+
+    def create_widgets(self):
+        self.sprite_listbox = tk.Listbox(self, bg='dark gray', fg='white', exportselection=False)
+        self.sprite_listbox.grid(row=0, column=0, padx=10, pady=10, sticky="ns")
+        self.sprite_listbox.bind("<<ListboxSelect>>", self.select_sprite)
+
+        self.canvas = tk.Canvas(self, width=640, height=480, bg='#303030', highlightthickness=0,
+                                xscrollcommand=self.scroll_x, yscrollcommand=self.scroll_y)
+        self.canvas.grid(row=0, column=1, sticky="nsew")
+        self.x_scrollbar = tk.Scrollbar(self, orient=tk.HORIZONTAL, command=self.canvas.xview)
+        self.x_scrollbar.grid(row=1, column=1, sticky="ew")
+        self.y_scrollbar = tk.Scrollbar(self, orient=tk.VERTICAL, command=self.canvas.yview)
+        self.y_scrollbar.grid(row=0, column=2, sticky="ns")
+        self.grid_rowconfigure(0, weight=1)
+        self.grid_columnconfigure(1, weight=1)
+
+        self.status = tk.Label(self, bg='black', fg='white', anchor="w")
+        self.status.grid(row=2, column=0, columnspan=3, sticky="ew", padx=10)
+
+        # Left button places the selected sprite, right button clears, middle drag pans
+        self.canvas.bind("<Button-1>", self.place_tile)
+        self.canvas.bind("<B1-Motion>", self.place_tile)
+        self.canvas.bind("<Button-3>", self.clear_tile)
+        self.canvas.bind("<B3-Motion>", self.clear_tile)
+        self.canvas.bind("<Button-2>", lambda event: self.canvas.scan_mark(event.x, event.y))
+        self.canvas.bind("<B2-Motion>", lambda event: self.canvas.scan_dragto(event.x, event.y, gain=1))
+        self.canvas.bind("<Configure>", lambda event: self.schedule_view())
+
+    def scroll_x(self, first, last):
+        self.x_scrollbar.set(first, last)
+        self.schedule_view()
+
+    def scroll_y(self, first, last):
+        self.y_scrollbar.set(first, last)
+        self.schedule_view()
+
+    def reset_view(self):
+        # New map, or new zoom: drop every item and photo and start over
+        self.canvas.delete("all")
+        self.items.clear()
+        self.photos.clear()
+        size = self.tilemap.tile_size * self.zoom
+        self.canvas.config(scrollregion=(0, 0, self.tilemap.width * size, self.tilemap.height * size))
+        self.sprite_listbox.delete(0, tk.END)
+        for path in self.tilemap.sprites:
+            self.sprite_listbox.insert(tk.END, os.path.splitext(os.path.basename(path))[0])
+        if self.tilemap.sprites:
+            self.current_sprite = min(max(self.current_sprite, 1), len(self.tilemap.sprites))
+            self.sprite_listbox.selection_set(self.current_sprite - 1)
+        else:
+            self.current_sprite = 0
+        name = os.path.basename(self.file_path) if self.file_path else "Untitled"
+        self.title(f"PixelForge Tilemap - {name}")
+        self.schedule_view()
+
+    def schedule_view(self):
+        # Scroll callbacks come in bursts; redraw the viewport once per burst
+        if self.view_job is None:
+            self.view_job = self.after_idle(self.update_view)
+
+    def visible_cells(self):
+        size = self.tilemap.tile_size * self.zoom
+        left = int(self.canvas.canvasx(0)) // size
+        top = int(self.canvas.canvasy(0)) // size
+        right = int(self.canvas.canvasx(self.canvas.winfo_width())) // size + 1
+        bottom = int(self.canvas.canvasy(self.canvas.winfo_height())) // size + 1
+        return (max(0, left), max(0, top), min(self.tilemap.width, right), min(self.tilemap.height, bottom))
+
+    def update_view(self):
+        # Items are kept for cells that stay in view; only cells that
+        # scrolled in get new ones and only cells that scrolled out lose theirs.
+        import numpy as np
+
+        self.view_job = None
+        x0, y0, x1, y1 = self.visible_cells()
+        block = self.tilemap.cells[y0:y1, x0:x1]
+        ys, xs = np.nonzero(block)
+        wanted = {(int(x) + x0, int(y) + y0): int(block[y, x]) for y, x in zip(ys, xs)}
+        for cell in [cell for cell in self.items if cell not in wanted]:
+            self.canvas.delete(self.items.pop(cell)[0])
+        for cell, n in wanted.items():
+            self.draw_cell(cell, n)
+        self.status.config(text=f"{self.tilemap.width}x{self.tilemap.height} tiles, "
+                                f"{len(self.tilemap.sprites)} sprites, {len(self.items)} tiles drawn")
+
+    def draw_cell(self, cell, n):
+        current = self.items.get(cell)
+        if current and current[1] == n:
+            return
+        photo = self.photo(n)
+        if current:
+            self.canvas.itemconfig(current[0], image=photo)
+        else:
+            size = self.tilemap.tile_size * self.zoom
+            item = self.canvas.create_image(cell[0] * size, cell[1] * size, image=photo, anchor="nw")
+            current = (item, n)
+        self.items[cell] = (current[0], n)
+
+    def photo(self, n):
+        key = (n, self.zoom)
+        if key not in self.photos:
+            from PIL import Image, ImageTk
+
+            image = Image.fromarray(self.tilemap.tile(n), "RGBA")
+            if self.zoom != 1:
+                image = image.resize((image.width * self.zoom, image.height * self.zoom), Image.NEAREST)
+            self.photos[key] = ImageTk.PhotoImage(image)
+        return self.photos[key]
+
+    def event_cell(self, event):
+        size = self.tilemap.tile_size * self.zoom
+        x = int(self.canvas.canvasx(event.x)) // size
+        y = int(self.canvas.canvasy(event.y)) // size
+        if 0 <= x < self.tilemap.width and 0 <= y < self.tilemap.height:
+            return x, y
+        return None
+
+    def place_tile(self, event):
+        cell = self.event_cell(event)
+        if cell is None or not self.current_sprite:
+            return
+        self.tilemap.cells[cell[1], cell[0]] = self.current_sprite
+        self.draw_cell(cell, self.current_sprite)
+
+    def clear_tile(self, event):
+        cell = self.event_cell(event)
+        if cell is None:
+            return
+        self.tilemap.cells[cell[1], cell[0]] = 0
+        if cell in self.items:
+            self.canvas.delete(self.items.pop(cell)[0])
+
+    def select_sprite(self, event=None):
+        selected = self.sprite_listbox.curselection()
+        if selected:
+            self.current_sprite = selected[0] + 1
+
+    def change_zoom(self):
+        self.zoom = self.zoom_var.get()
+        self.reset_view()
+
+    def add_sprites(self):
+        paths = filedialog.askopenfilenames(parent=self, filetypes=[("Pixel Forge projects", "*.json")],
+                                            title="Add Sprite Projects")
+        for path in paths:
+            known = os.path.abspath(path) in self.tilemap.sprites
+            try:
+                n = self.tilemap.add_sprite(path)
+                self.tilemap.tile(n)  # fail now, not while drawing, if the project is unreadable
+            except (OSError, ValueError, KeyError, IndexError) as e:
+                if not known:
+                    self.tilemap.sprites.remove(os.path.abspath(path))
+                messagebox.showwarning("Add Sprite", f"Could not read {os.path.basename(path)}:\n{e}", parent=self)
+                continue
+            self.current_sprite = n
+        self.reset_view()
+
+    def new_map(self):
+        width = simpledialog.askinteger("New Tilemap", "Width in tiles:", initialvalue=64, minvalue=1, maxvalue=4096, parent=self)
+        height = width and simpledialog.askinteger("New Tilemap", "Height in tiles:", initialvalue=width,
+                                                   minvalue=1, maxvalue=4096, parent=self)
+        tile_size = height and simpledialog.askinteger("New Tilemap", "Tile size in pixels:", initialvalue=16,
+                                                       minvalue=1, maxvalue=256, parent=self)
+        if tile_size:
+            self.tilemap = TileMap(width, height, tile_size)
+            self.file_path = None
+            self.reset_view()
+
+    def open_map(self):
+        file_path = filedialog.askopenfilename(parent=self, filetypes=[("Pixel Forge tilemaps", "*.pfmap")])
+        if not file_path:
+            return
+        try:
+            self.tilemap = TileMap.load(file_path)
+        except (OSError, ValueError, KeyError) as e:
+            messagebox.showerror("Open Tilemap", str(e), parent=self)
+            return
+        self.file_path = file_path
+        self.reset_view()
+
+    def save_map(self):
+        if self.file_path:
+            self.tilemap.save(self.file_path)
+        else:
+            self.save_map_as()
+
+    def save_map_as(self):
+        file_path = filedialog.asksaveasfilename(parent=self, defaultextension=".pfmap",
+                                                 filetypes=[("Pixel Forge tilemaps", "*.pfmap")])
+        if file_path:
+            self.file_path = file_path
+            self.tilemap.save(file_path)
+            self.reset_view()
+
+    def export_png(self):
+        file_path = filedialog.asksaveasfilename(parent=self, defaultextension=".png", filetypes=[("PNG files", "*.png")],
+                                                 title="Export Tilemap as PNG")
+        if not file_path:
+            return
+
+        # Written a row of tiles at a time on a worker thread
+        def work():
+            yield self.scheduler.offload(self.tilemap.export_png, file_path)
+
+        self.scheduler.submit("export", work(),
+                              on_done=lambda _: messagebox.showinfo("Export Tilemap", f"Tilemap saved as {file_path}", parent=self),
+                              on_error=lambda e: messagebox.showerror("Export Tilemap", str(e), parent=self))
+
+
+if __name__ == "__main__":
+    import sys
+
+    root = tk.Tk()
+    root.withdraw()
+    if len(sys.argv) > 1:
+        window = TilemapWindow(root, TileMap.load(sys.argv[1]), sys.argv[1])
+    else:
+        window = TilemapWindow(root)
+    window.protocol("WM_DELETE_WINDOW", root.destroy)
+    root.mainloop()
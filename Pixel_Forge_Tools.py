@@ -0,0 +1,309 @@
+import argparse
+import json
+import os
+import sys
+import time
+from Pixel_Forge_Core import (LAYER_FILTERS, UPSCALERS, IndexedProject, expand_project, export_matrix, filter_layer,
+                              load_project, load_variant_table, pack_project, parse_cell_size, render_variants,
+                              save_project_file)
+
+#############################################################################
+##                                                                         ##
+## Pixel Forge Tools                                                       ##
+## Copyright (C) 2024  Bluehatchet                                         ##
+##                                                                         ##
+## This program is free software: you can redistribute it and/or modify    ##
+## it under the terms of the GNU General Public License as published by    ##
+## the Free Software Foundation, either version 3 of the License, or       ##
+## (at your option) any later version.                                     ##
+##                                                                         ##
+## This program is distributed in the hope that it will be useful,         ##
+## but WITHOUT ANY WARRANTY; without even the implied warranty of          ##
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the           ##
+## GNU General Public License for more details.                            ##
+##                                                                         ##
+## You should have received a copy of the GNU General Public License       ##
+## along with this program.  If not, see <http://www.gnu.org/licenses/>.   ##
+##                                                                         ##
+#############################################################################
+
+# Headless entry point for build scripts: the same rendering the editors use,
+# without opening a window.
+#
+#   python Pixel_Forge_Tools.py recolor "Pixel Forge Projects/octo.json" --table teams.json --out variants
+#   python Pixel_Forge_Tools.py export "Pixel Forge Projects/octo.json" --scales 1,2,4,8 --ico 16,32,48 --out icons
+#   python Pixel_Forge_Tools.py filter "Pixel Forge Projects/"*.json --filter outline --color "#000000" --out outlined
+#   python Pixel_Forge_Tools.py blocks "Pixel Forge Projects/"*.json --store "Pixel Forge Projects/.pixelforge_blocks"
+#   python Pixel_Forge_Tools.py gif walk.pfseq --scales 1,2,4,8 --out gifs
+#   python Pixel_Forge_Tools.py serve --root "Pixel Forge Projects" --port 8765
+#   python Pixel_Forge_Tools.py watch "Pixel Forge Projects" --out exports --scales 1,4
+#   python Pixel_Forge_Tools.py build assets.json
+#   python Pixel_Forge_Tools.py tilemap level1.pfmap --out level1.png
+#   python Pixel_Forge_Tools.py slice hero_sheet.png --cell 32x48 --out hero_frames
+
+
+def project_name(file_path):
+    return os.path.splitext(os.path.basename(file_path))[0]
+
+
+def recolor_command(args):
+    table = load_variant_table(args.table)
+    sources = {project_name(path): path for path in args.projects}
+    start = time.perf_counter()
+    written = render_variants(sources, table, args.out, per_layer=not args.composite,
+                              scale=args.scale, workers=args.workers)
+    print(f"Wrote {len(written)} variants to {args.out} in {time.perf_counter() - start:.2f}s")
+    return 0
+
+
+def int_list(text):
+    return [int(part) for part in text.split(",") if part.strip()]
+
+
+def scale_list(text):
+    scales = int_list(text)
+    if not scales or not all(1 <= n <= 16 for n in scales):
+        raise argparse.ArgumentTypeError(f"scales must be integers from 1 to 16, not {text!r}")
+    return scales
+
+
+def export_command(args):
+    os.makedirs(args.out, exist_ok=True)
+    start = time.perf_counter()
+    written = []
+    for path in args.projects:
+        pixels = IndexedProject(load_project(path)["layers"]).composite()
+        written += export_matrix(pixels, os.path.join(args.out, project_name(path)),
+                                 args.scales, args.ico, args.upscaler, args.optimize)
+    print(f"Wrote {len(written)} files to {args.out} in {time.perf_counter() - start:.2f}s")
+    return 0
+
+
+def filter_command(args):
+    options = {
+        "outline": {"color": args.color, "diagonal": args.diagonal},
+        "shadow": {"color": args.color, "dx": args.dx, "dy": args.dy},
+        "dither": {"palette": args.palette, "size": args.size, "spread": args.spread},
+        "shade": {"ramp": args.palette, "dx": -args.dx, "dy": -args.dy},
+    }[args.filter]
+    if args.out:
+        os.makedirs(args.out, exist_ok=True)
+    start = time.perf_counter()
+    changed = 0
+    for path in args.projects:
+        project = load_project(path)
+        layers = project["layers"] if args.layer is None else [project["layers"][args.layer]]
+        for layer in layers:
+            layer["data"], region = filter_layer(layer["data"], args.filter, **options)
+            changed += region is not None
+        target = os.path.join(args.out, os.path.basename(path)) if args.out else path
+        save_project_file(target, project["layers"], project["last_colors"],
+                          project.get("block_store") if not args.out else None)
+    print(f"Filtered {changed} layers in {len(args.projects)} projects in {time.perf_counter() - start:.2f}s")
+    return 0
+
+
+def gif_command(args):
+    from Pixel_Forge_Core import read_sequence, sequence_to_gifs
+
+    os.makedirs(args.out, exist_ok=True)
+    start = time.perf_counter()
+    written = []
+    for path in args.sequences:
+        written += sequence_to_gifs(read_sequence(path), os.path.join(args.out, project_name(path)),
+                                    args.scales, args.upscaler, args.workers)
+    print(f"Wrote {len(written)} GIFs to {args.out} in {time.perf_counter() - start:.2f}s")
+    return 0
+
+
+def blocks_command(args):
+    # Rewrites projects in place, either into the shared block store or back
+    # to plain layer grids.
+    before = after = 0
+    for path in args.projects:
+        before += os.path.getsize(path)
+        with open(path, 'r') as f:
+            project_data = json.load(f)
+        if args.expand:
+            project_data = expand_project(project_data, path)
+        else:
+            project_data = pack_project(project_data, path, args.store)
+        with open(path, 'w') as f:
+            json.dump(project_data, f)
+        after += os.path.getsize(path)
+    store_size = 0
+    if not args.expand and os.path.isdir(args.store):
+        for directory, _, names in os.walk(args.store):
+            store_size += sum(os.path.getsize(os.path.join(directory, name)) for name in names)
+    print(f"{len(args.projects)} projects: {before} -> {after} bytes" + (f", store {store_size} bytes" if store_size else ""))
+    return 0
+
+
+def serve_command(args):
+    from Pixel_Forge_Server import serve
+
+    serve(args.root, args.host, args.port, args.workers, args.cache_mb * 1024 * 1024)
+    return 0
+
+
+def watch_command(args):
+    from Pixel_Forge_Watch import Watcher, watch
+
+    if args.once:
+        watcher = Watcher(args.dirs, args.out, args.scales, args.ico, args.upscaler, args.workers)
+        try:
+            watcher.sync()
+        finally:
+            watcher.close()
+        return 0
+    watch(args.dirs, args.out, args.scales, args.ico, args.upscaler, args.workers,
+          polling=args.poll, interval=args.interval, settle=args.settle)
+    return 0
+
+
+def build_command(args):
+    from Pixel_Forge_Build import Build
+
+    results = Build(args.manifest, args.workers, args.force).run()
+    return 1 if any(status != "built" for status, _ in results.values()) else 0
+
+
+def tilemap_command(args):
+    from Pixel_Forge_Core import TileMap
+
+    start = time.perf_counter()
+    tilemap = TileMap.load(args.tilemap)
+    tilemap.export_png(args.out, args.scale)
+    print(f"Wrote {tilemap.width}x{tilemap.height} tiles ({len(tilemap.sprites)} sprites) to {args.out} "
+          f"in {time.perf_counter() - start:.2f}s")
+    return 0
+
+
+def slice_command(args):
+    from PIL import Image
+    from Pixel_Forge_Core import slice_sheet
+
+    os.makedirs(args.out, exist_ok=True)
+    start = time.perf_counter()
+    written = 0
+    for path in args.sheets:
+        with Image.open(path) as image:
+            sprites = slice_sheet(image, args.cell, args.spacing, args.margin, args.gap, args.min_pixels, args.uniform)
+        digits = len(str(len(sprites)))
+        for n, (_, sprite) in enumerate(sprites, 1):
+            sprite.save(os.path.join(args.out, f"{project_name(path)}_{n:0{digits}d}.png"))
+        written += len(sprites)
+    print(f"Wrote {written} sprites from {len(args.sheets)} sheets to {args.out} in {time.perf_counter() - start:.2f}s")
+    return 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="Pixel_Forge_Tools.py", description="Headless Pixel Forge tools.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    recolor = commands.add_parser("recolor", help="Write palette-swapped PNG variants of projects.")
+    recolor.add_argument("projects", nargs="+", help="Project JSON files.")
+    recolor.add_argument("--table", required=True, help='JSON variant table: {"name": {"#from": "#to"}}.')
+    recolor.add_argument("--out", required=True, help="Output directory.")
+    recolor.add_argument("--scale", type=int, default=1, help="Integer upscale factor (default 1).")
+    recolor.add_argument("--composite", action="store_true",
+                         help="Map colours of the finished composite instead of each layer's colours.")
+    recolor.add_argument("--workers", type=int, default=None, help="Worker processes (default: CPU count).")
+    recolor.set_defaults(func=recolor_command)
+
+    export = commands.add_parser("export", help="Write several PNG scales and an ICO from one composite per project.")
+    export.add_argument("projects", nargs="+", help="Project JSON files.")
+    export.add_argument("--out", required=True, help="Output directory.")
+    export.add_argument("--scales", type=scale_list, default=[1], help="Comma-separated integer scales, 1 to 16 (default 1).")
+    export.add_argument("--ico", type=int_list, default=[], help="Comma-separated ICO sizes, e.g. 16,32,48,256.")
+    export.add_argument("--upscaler", choices=list(UPSCALERS), default="nearest",
+                        help="How 2x steps are made: nearest, scale2x (EPX) or xbr (default nearest).")
+    export.add_argument("--optimize", action="store_true",
+                        help="Write the smallest PNGs: fewest bits, palette or grayscale where possible, no extra chunks.")
+    export.set_defaults(func=export_command)
+
+    filters = commands.add_parser("filter", help="Run a layer filter (outline, shadow, dither, shade) over projects.")
+    filters.add_argument("projects", nargs="+", help="Project JSON files.")
+    filters.add_argument("--filter", choices=list(LAYER_FILTERS), required=True, help="Filter to run.")
+    filters.add_argument("--layer", type=int, default=None, help="Layer index to filter (default: every layer).")
+    filters.add_argument("--color", default="#000000", help="Outline or shadow color (default #000000).")
+    filters.add_argument("--diagonal", action="store_true", help="Outline diagonal neighbours too.")
+    filters.add_argument("--dx", type=int, default=1, help="Shadow offset, or direction away from the light (default 1).")
+    filters.add_argument("--dy", type=int, default=1, help="Shadow offset, or direction away from the light (default 1).")
+    filters.add_argument("--palette", type=lambda text: [part.strip() for part in text.split(",") if part.strip()],
+                         default=[], help="Comma-separated dither palette, or shading ramp from dark to light.")
+    filters.add_argument("--size", type=int, choices=(2, 4, 8), default=4, help="Bayer matrix size (default 4).")
+    filters.add_argument("--spread", type=float, default=64, help="Dither strength in colour levels (default 64).")
+    filters.add_argument("--out", help="Write filtered projects here instead of in place.")
+    filters.set_defaults(func=filter_command)
+
+    gif = commands.add_parser("gif", help="Write animator sequences (.pfseq) as GIFs at several scales.")
+    gif.add_argument("sequences", nargs="+", help="Sequence files.")
+    gif.add_argument("--out", required=True, help="Output directory.")
+    gif.add_argument("--scales", type=scale_list, default=[1], help="Comma-separated integer scales, 1 to 16 (default 1).")
+    gif.add_argument("--upscaler", choices=list(UPSCALERS), default="nearest", help="Upscaler for the 2x steps (default nearest).")
+    gif.add_argument("--workers", type=int, default=None, help="Encoder processes (default: one per scale, up to the CPU count).")
+    gif.set_defaults(func=gif_command)
+
+    blocks = commands.add_parser("blocks", help="Move project layers into a shared, deduplicated block store.")
+    blocks.add_argument("projects", nargs="+", help="Project JSON files, rewritten in place.")
+    blocks.add_argument("--store", default=".pixelforge_blocks", help="Block store directory (default .pixelforge_blocks).")
+    blocks.add_argument("--expand", action="store_true", help="Write the layers back into the projects instead.")
+    blocks.set_defaults(func=blocks_command)
+
+    serve = commands.add_parser("serve", help="Render projects to PNG, ICO or GIF over local HTTP.")
+    serve.add_argument("--root", default=".", help="Directory whose projects may be rendered by path (default .).")
+    serve.add_argument("--host", default="127.0.0.1", help="Address to listen on (default 127.0.0.1).")
+    serve.add_argument("--port", type=int, default=8765, help="Port to listen on (default 8765).")
+    serve.add_argument("--workers", type=int, default=None, help="Worker processes (default: CPU count).")
+    serve.add_argument("--cache-mb", type=int, default=64, help="Size of the rendered-result cache (default 64).")
+    serve.set_defaults(func=serve_command)
+
+    watch = commands.add_parser("watch", help="Re-export projects and .pfseq sequences whenever they change.")
+    watch.add_argument("dirs", nargs="+", help="Directories to watch, including subdirectories.")
+    watch.add_argument("--out", required=True, help="Output directory.")
+    watch.add_argument("--scales", type=scale_list, default=[1], help="Comma-separated PNG scales, 1 to 16 (default 1).")
+    watch.add_argument("--ico", type=int_list, default=[], help="Comma-separated ICO sizes to write as well.")
+    watch.add_argument("--upscaler", choices=list(UPSCALERS), default="nearest", help="Upscaler for the 2x steps (default nearest).")
+    watch.add_argument("--workers", type=int, default=None, help="Worker processes (default: CPU count).")
+    watch.add_argument("--poll", action="store_true", help="Poll for changes even where inotify is available.")
+    watch.add_argument("--interval", type=float, default=0.5, help="Seconds between polls (default 0.5).")
+    watch.add_argument("--settle", type=float, default=0.2, help="Quiet seconds that end a burst of saves (default 0.2).")
+    watch.add_argument("--once", action="store_true", help="Export whatever is stale and exit.")
+    watch.set_defaults(func=watch_command)
+
+    build = commands.add_parser("build", help="Build the targets of an asset manifest, skipping those that are up to date.")
+    build.add_argument("manifest", help="Manifest JSON describing sprites, sequences and targets.")
+    build.add_argument("--workers", type=int, default=None, help="Worker processes (default: CPU count).")
+    build.add_argument("--force", action="store_true", help="Rebuild every target and composite.")
+    build.set_defaults(func=build_command)
+
+    tilemap = commands.add_parser("tilemap", help="Export a tilemap (.pfmap) as a single PNG.")
+    tilemap.add_argument("tilemap", help="Tilemap file.")
+    tilemap.add_argument("--out", required=True, help="PNG to write.")
+    tilemap.add_argument("--scale", type=int, default=1, help="Integer upscale factor (default 1).")
+    tilemap.set_defaults(func=tilemap_command)
+
+    slicer = commands.add_parser("slice", help="Cut sprite sheets into one PNG per sprite, skipping empty cells.")
+    slicer.add_argument("sheets", nargs="+", help="Sprite sheet PNGs.")
+    slicer.add_argument("--out", required=True, help="Output directory.")
+    slicer.add_argument("--cell", type=parse_cell_size, default=None,
+                        help="Cut on a grid of cells, e.g. 32 or 32x48 (default: find each sprite by its visible pixels).")
+    slicer.add_argument("--spacing", type=int, default=0, help="Pixels between grid cells (default 0).")
+    slicer.add_argument("--margin", type=int, default=0, help="Pixels before the first grid cell (default 0).")
+    slicer.add_argument("--gap", type=int, default=0, help="Found sprites up to this many pixels apart are one sprite (default 0).")
+    slicer.add_argument("--min-pixels", type=int, default=1, help="Drop sprites with fewer visible pixels (default 1).")
+    slicer.add_argument("--uniform", action="store_true",
+                        help="Pad every sprite to the size of the largest, centred on the bottom edge.")
+    slicer.set_defaults(func=slice_command)
+
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
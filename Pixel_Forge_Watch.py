@@ -0,0 +1,304 @@
+import hashlib
+import json
+import os
+import select
+import struct
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from Pixel_Forge_Core import (IndexedProject, expand_project, export_matrix, normalize_project, read_sequence,
+                              sequence_to_gif)
+
+#############################################################################
+##                                                                         ##
+## Pixel Forge Watch                                                       ##
+## Copyright (C) 2024  Bluehatchet                                         ##
+##                                                                         ##
+## This program is free software: you can redistribute it and/or modify    ##
+## it under the terms of the GNU General Public License as published by    ##
+## the Free Software Foundation, either version 3 of the License, or       ##
+## (at your option) any later version.                                     ##
+##                                                                         ##
+## This program is distributed in the hope that it will be useful,         ##
+## but WITHOUT ANY WARRANTY; without even the implied warranty of          ##
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the           ##
+## GNU General Public License for more details.                            ##
+##                                                                         ##
+## You should have received a copy of the GNU General Public License       ##
+## along with this program.  If not, see <http://www.gnu.org/licenses/>.   ##
+##                                                                         ##
+#############################################################################
+
+# Keeps exported PNGs and GIFs in step with the projects (*.json) and
+# animator sequences (*.pfseq) under a set of directories. Started with
+# `python Pixel_Forge_Tools.py watch`.
+#
+# Every source is remembered with a hash of everything its export depends
+# on (the project file, or the sequence file plus each frame PNG), so only
+# sources whose hash changed are exported again. The hashes are kept in the
+# output directory, which makes restarts just as cheap.
+
+STATE_FILE = ".pixelforge_watch.json"
+SOURCE_EXTENSIONS = (".json", ".pfseq")
+
+
+def _export_project(job):
+    path, base_path, scales, ico_sizes, upscaler = job
+    with open(path, 'r') as f:
+        project_data = json.load(f)
+    if not isinstance(project_data, dict) or not ("layers" in project_data or "grid_data" in project_data):
+        return []  # some other JSON file, e.g. a variant table
+    layers = normalize_project(expand_project(project_data, path))["layers"]
+    return export_matrix(IndexedProject(layers).composite(), base_path, scales, ico_sizes, upscaler)
+
+
+def _export_sequence(job):
+    path, target = job
+    sequence_to_gif(read_sequence(path), target)
+    return [target]
+
+
+class PollingMonitor:
+    """Finds changes by comparing (mtime, size) of every file between scans."""
+
+    def __init__(self, roots, interval=0.5):
+        self.roots = roots
+        self.interval = interval
+        self.seen = self.snapshot()
+
+    def snapshot(self):
+        seen = {}
+        for root in self.roots:
+            for directory, names, files in os.walk(root):
+                names[:] = [name for name in names if not name.startswith(".")]
+                for name in files:
+                    path = os.path.join(directory, name)
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    seen[path] = (stat.st_mtime_ns, stat.st_size)
+        return seen
+
+    def wait(self, timeout):
+        time.sleep(min(timeout, self.interval))
+        seen = self.snapshot()
+        changed = {path for path in seen.keys() | self.seen.keys() if seen.get(path) != self.seen.get(path)}
+        self.seen = seen
+        return changed
+
+    def close(self):
+        pass
+
+
+class InotifyMonitor:
+    """Linux inotify through libc, so no polling is needed while nothing changes."""
+
+    IN_CLOSE_WRITE = 0x8
+    IN_MOVED_FROM = 0x40
+    IN_MOVED_TO = 0x80
+    IN_CREATE = 0x100
+    IN_DELETE = 0x200
+    IN_ISDIR = 0x40000000
+    MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+    def __init__(self, roots):
+        import ctypes
+        import ctypes.util
+
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.directories = {}  # watch descriptor -> directory
+        for root in roots:
+            for directory, names, _ in os.walk(root):
+                names[:] = [name for name in names if not name.startswith(".")]
+                self.add(directory)
+
+    def add(self, directory):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(directory), self.MASK)
+        if wd >= 0:
+            self.directories[wd] = directory
+
+    def wait(self, timeout):
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return set()
+        changed = set()
+        try:
+            data = os.read(self.fd, 65536)
+        except BlockingIOError:
+            return changed
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = struct.unpack_from("iIII", data, offset)
+            name = data[offset + 16:offset + 16 + length].rstrip(b"\0")
+            offset += 16 + length
+            if wd not in self.directories or not name:
+                continue
+            path = os.path.join(self.directories[wd], os.fsdecode(name))
+            if mask & self.IN_ISDIR:
+                if mask & (self.IN_CREATE | self.IN_MOVED_TO) and not os.path.basename(path).startswith("."):
+                    self.add(path)
+            else:
+                changed.add(path)
+        return changed
+
+    def close(self):
+        os.close(self.fd)
+
+
+def make_monitor(roots, interval=0.5, polling=False):
+    if not polling and sys.platform.startswith("linux"):
+        try:
+            return InotifyMonitor(roots)
+        except (OSError, AttributeError):
+            pass  # no inotify (or no libc symbol); poll instead
+    return PollingMonitor(roots, interval)
+
+
+class Watcher:
+    """Exports stale projects and sequences under roots into out_dir."""
+
+    def __init__(self, roots, out_dir, scales=(1,), ico_sizes=(), upscaler="nearest", workers=None, log=print):
+        self.roots = [os.path.abspath(root) for root in roots]
+        self.out_dir = os.path.abspath(out_dir)
+        self.options = (tuple(scales), tuple(ico_sizes), upscaler)
+        self.workers = workers
+        self.log = log
+        self.file_hashes = {}  # path -> ((mtime_ns, size), hash of the bytes)
+        self.frame_users = {}  # frame PNG -> sequences that use it
+        self.state_path = os.path.join(self.out_dir, STATE_FILE)
+        self.state = {}  # source -> {"hash": ..., "outputs": [...]}
+        if os.path.exists(self.state_path):
+            with open(self.state_path, 'r') as f:
+                self.state = json.load(f)
+        self.pool = None
+
+    def sources(self):
+        for root in self.roots:
+            for directory, names, files in os.walk(root):
+                names[:] = [name for name in names
+                            if not name.startswith(".") and os.path.join(directory, name) != self.out_dir]
+                for name in files:
+                    if name.endswith(SOURCE_EXTENSIONS):
+                        yield os.path.join(directory, name)
+
+    def file_hash(self, path):
+        # Files are only read again when their mtime or size has moved
+        stat = os.stat(path)
+        key = (stat.st_mtime_ns, stat.st_size)
+        cached = self.file_hashes.get(path)
+        if cached and cached[0] == key:
+            return cached[1]
+        with open(path, 'rb') as f:
+            content_hash = hashlib.blake2b(f.read(), digest_size=16).hexdigest()
+        self.file_hashes[path] = (key, content_hash)
+        return content_hash
+
+    def source_hash(self, path):
+        digest = hashlib.blake2b(repr(self.options).encode(), digest_size=16)
+        digest.update(self.file_hash(path).encode())
+        if path.endswith(".pfseq"):
+            frames = read_sequence(path)
+            for png, duration in frames:
+                self.frame_users.setdefault(png, set()).add(path)
+                digest.update(f"{self.file_hash(png)}:{duration}".encode())
+        return digest.hexdigest()
+
+    def output_base(self, path):
+        # Sources in subdirectories keep them, so same-named sprites don't collide
+        for root in self.roots:
+            if os.path.commonpath([path, root]) == root:
+                return os.path.join(self.out_dir, os.path.splitext(os.path.relpath(path, root))[0])
+        return os.path.join(self.out_dir, os.path.splitext(os.path.basename(path))[0])
+
+    def stale(self, changed=None):
+        """Sources whose hash differs from their last export, with the new hashes."""
+        if changed is None:
+            candidates = set(self.sources())
+        else:
+            candidates = {path for path in changed if path.endswith(SOURCE_EXTENSIONS)}
+            for path in changed:
+                candidates |= self.frame_users.get(path, set())
+        stale = {}
+        for path in candidates:
+            if os.path.commonpath([path, self.out_dir]) == self.out_dir:
+                continue
+            if not os.path.exists(path):
+                self.state.pop(path, None)
+                continue
+            try:
+                content_hash = self.source_hash(path)
+            except (OSError, ValueError, KeyError) as e:
+                self.log(f"skipped {path}: {e}")
+                continue
+            entry = self.state.get(path)
+            if not entry or entry["hash"] != content_hash or not all(map(os.path.exists, entry["outputs"])):
+                stale[path] = content_hash
+        return stale
+
+    def sync(self, changed=None):
+        """Export everything stale (among changed paths, or all sources). Returns the count."""
+        start = time.perf_counter()
+        stale = self.stale(changed)
+        if not stale:
+            return 0
+        if self.pool is None:
+            self.pool = ProcessPoolExecutor(max_workers=self.workers)
+        futures = {}
+        for path in stale:
+            base = self.output_base(path)
+            os.makedirs(os.path.dirname(base), exist_ok=True)
+            if path.endswith(".pfseq"):
+                futures[path] = self.pool.submit(_export_sequence, (path, base + ".gif"))
+            else:
+                futures[path] = self.pool.submit(_export_project, (path, base) + self.options)
+        exported = 0
+        for path, future in futures.items():
+            try:
+                outputs = future.result()
+            except Exception as e:  # a half-saved file fails here and is retried on its next save
+                self.log(f"failed {path}: {e}")
+                continue
+            self.state[path] = {"hash": stale[path], "outputs": outputs}
+            exported += bool(outputs)
+        os.makedirs(self.out_dir, exist_ok=True)
+        with open(self.state_path, 'w') as f:
+            json.dump(self.state, f)
+        self.log(f"exported {exported} of {len(stale)} changed sources in {(time.perf_counter() - start) * 1000:.1f} ms")
+        return exported
+
+    def run(self, monitor, settle=0.2):
+        """Sync once, then after every burst of changes; settle is the quiet time that ends a burst."""
+        self.sync()
+        while True:
+            changed = monitor.wait(1.0)
+            if not changed:
+                continue
+            # Editors often write a file in several steps; collect the burst
+            while True:
+                more = monitor.wait(settle)
+                if not more:
+                    break
+                changed |= more
+            self.sync(changed)
+
+    def close(self):
+        if self.pool:
+            self.pool.shutdown()
+            self.pool = None
+
+
+def watch(roots, out_dir, scales=(1,), ico_sizes=(), upscaler="nearest", workers=None,
+          polling=False, interval=0.5, settle=0.2):
+    watcher = Watcher(roots, out_dir, scales, ico_sizes, upscaler, workers)
+    monitor = make_monitor(watcher.roots, interval, polling)
+    print(f"Watching {', '.join(watcher.roots)} ({type(monitor).__name__}), exporting to {watcher.out_dir}", flush=True)
+    try:
+        watcher.run(monitor, settle)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        monitor.close()
+        watcher.close()
@@ -0,0 +1,87 @@
+import io
+import os
+import sys
+import zlib
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from Pixel_Forge_Core import _png_encodings, _png_file, encode_png  # noqa: E402
+
+# Every layout _png_encodings offers must load back pixel-exact, not just the
+# smallest one, so each (colour type, bit depth, tRNS) combination is decoded.
+
+
+def sprite(levels, transparent=True, gray=True, translucent=False, seed=0):
+    rng = np.random.default_rng(seed)
+    values = np.array(levels, dtype=np.uint8)[rng.integers(0, len(levels), (9, 13))]
+    pixels = np.zeros((9, 13, 4), dtype=np.uint8)
+    pixels[..., 0] = values
+    pixels[..., 1] = values if gray else 255 - values
+    pixels[..., 2] = values
+    pixels[..., 3] = 255
+    if transparent:
+        pixels[rng.random((9, 13)) < 0.3] = 0
+    if translucent:
+        pixels[0, :, 3] = 128
+    return pixels
+
+
+def decoded(data):
+    with Image.open(io.BytesIO(data)) as image:
+        pixels = np.array(image.convert("RGBA"))
+    pixels[pixels[..., 3] == 0] = 0
+    return pixels
+
+
+def layouts(pixels):
+    height, width = pixels.shape[:2]
+    for color_type, depth, rows, _, chunks in _png_encodings(pixels):
+        idat = zlib.compress(np.insert(rows, 0, 0, axis=1).tobytes())
+        has_key = any(tag == b"tRNS" for tag, _ in chunks)
+        yield (color_type, depth, has_key), _png_file(width, height, color_type, depth, chunks, idat)
+
+
+def expected(pixels):
+    pixels = pixels.copy()
+    pixels[pixels[..., 3] == 0] = 0
+    return pixels
+
+
+CASES = [
+    ([255], {}),
+    ([0, 255], {}),
+    ([0, 255], {"transparent": False}),
+    ([0, 85, 255], {}),
+    ([34, 68, 0, 255], {}),
+    ([0, 17, 255], {}),
+    (list(range(0, 256, 5)), {}),
+    (list(range(256)), {}),
+    ([0, 85, 255], {"transparent": False}),
+    ([0, 17, 255], {"transparent": False}),
+    ([10, 200], {"gray": False}),
+    (list(range(0, 256, 3)), {"gray": False}),
+    ([0, 85, 255], {"translucent": True}),
+    ([10, 200], {"gray": False, "translucent": True}),
+]
+
+
+def test_every_layout_round_trips():
+    seen = set()
+    for levels, options in CASES:
+        for seed in range(5):
+            pixels = sprite(levels, seed=seed, **options)
+            for layout, data in layouts(pixels):
+                seen.add(layout)
+                assert np.array_equal(decoded(data), expected(pixels)), (levels, options, seed, layout)
+    # Palette at every depth, with and without tRNS, and gray, RGB and RGBA
+    assert {(3, 1, True), (3, 2, True), (3, 4, True), (3, 8, True), (3, 2, False)} <= seen
+    assert {(0, 1, False), (0, 2, False), (0, 4, False), (0, 8, True), (2, 8, True), (6, 8, False)} <= seen
+
+
+def test_smallest_file_round_trips():
+    for levels, options in CASES:
+        for seed in range(20):
+            pixels = sprite(levels, seed=seed, **options)
+            assert np.array_equal(decoded(encode_png(pixels)), expected(pixels)), (levels, options, seed)